@@ -54,7 +54,7 @@ a = Analysis(
     hiddenimports=hiddenimports + [
         'win32file', 'win32api', 'wmi', 'sip',
         'PyQt5', 'PyQt5.QtCore', 'PyQt5.QtGui', 'PyQt5.QtWidgets',
-        'folder_search_cpp', 'winreg', 'threading', 'shutil',
+        'folder_search_cpp', 'folder_scanner', 'dir_index', 'folder_watcher', 'duplicate_finder', 'treemap', 'treemap_view', 'scan_session', 'size_history', 'winreg', 'threading', 'shutil',
     ],
     hookspath=[],
     hooksconfig={},
@@ -16,7 +16,7 @@ def get_api_key():
     return "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"
 
 # Функция для анализа папки с помощью ИИ
-def analyze_folder(folder_path, folder_size, folder_name=None, callback=None):
+def analyze_folder(folder_path, folder_size, folder_name=None, callback=None, contents=None):
     """Анализирует папку с помощью ИИ и возвращает рекомендации.
     
     Args:
@@ -24,6 +24,7 @@ def analyze_folder(folder_path, folder_size, folder_name=None, callback=None):
         folder_size: Размер папки в читаемом формате
         folder_name: Имя папки (опционально)
         callback: Функция обратного вызова для потоковой передачи ответа (опционально)
+        contents: Состав папки по типам файлов из результатов сканирования (опционально)
     """
     api_key = get_api_key()
     if not api_key:
@@ -47,11 +48,15 @@ def analyze_folder(folder_path, folder_size, folder_name=None, callback=None):
     except Exception as e:
         files = [f"Ошибка при получении списка файлов: {e}"]
     
+    # Состав по типам файлов известен из сканирования и охватывает всю папку,
+    # а не только первые файлы
+    contents_text = f"\nСостав папки по типам файлов: {contents}\n" if contents else ""
+    
     # Формируем запрос к API
     prompt = f"""Проанализируй папку '{folder_name}' размером {folder_size} и определи, безопасно ли её удалить.
 
 Путь к папке: {folder_path}
-
+{contents_text}
 Примеры файлов в папке:
 {', '.join(files)}
 
@@ -172,22 +177,22 @@ def analyze_folders(folders_list, callback=None):
     """Анализирует список папок и возвращает рекомендации для каждой.
     
     Args:
-        folders_list: Список папок для анализа
+        folders_list: Список папок для анализа: (путь, размер, размер в читаемом формате, состав)
         callback: Функция обратного вызова для потоковой передачи ответа (опционально)
     """
     results = []
     
     for folder_data in folders_list:
-        folder_path, folder_size, formatted_size = folder_data
+        folder_path, folder_size, formatted_size, contents = folder_data
         
         # Добавляем небольшую задержку между запросами, чтобы не перегружать API
         time.sleep(1)
         
         # Если указан callback, передаем его в analyze_folder
         if callback and callable(callback):
-            analysis = analyze_folder(folder_path, formatted_size, callback=callback)
+            analysis = analyze_folder(folder_path, formatted_size, callback=callback, contents=contents)
         else:
-            analysis = analyze_folder(folder_path, formatted_size)
+            analysis = analyze_folder(folder_path, formatted_size, contents=contents)
         
         results.append({
             "path": folder_path,
@@ -335,7 +340,7 @@ class AIAssistantDialog(QDialog):
         """Добавляет папки в таблицу."""
         self.results_table.setRowCount(len(self.folders_list))
         
-        for row, (folder_path, folder_size, formatted_size) in enumerate(self.folders_list):
+        for row, (folder_path, folder_size, formatted_size, contents) in enumerate(self.folders_list):
             # Чекбокс
             checkbox_item = QTableWidgetItem()
             checkbox_item.setFlags(Qt.ItemIsUserCheckable | Qt.ItemIsEnabled)
@@ -352,7 +357,8 @@ class AIAssistantDialog(QDialog):
             # Размер
             size_item = QTableWidgetItem(formatted_size)
             size_item.setFlags(size_item.flags() & ~Qt.ItemIsEditable)
-            size_item.setToolTip(f"Размер папки: {formatted_size}")
+            size_item.setToolTip(f"Размер папки: {formatted_size}\n{contents}" if contents
+                                 else f"Размер папки: {formatted_size}")
             self.results_table.setItem(row, 2, size_item)
             
             # Рекомендация (пока пустая)
@@ -569,7 +575,7 @@ class AIAssistantDialog(QDialog):
         # Анализируем выбранные папки по одной, с потоковой передачей ответов
         try:
             for i, (row, folder_data) in enumerate(selected_folders):
-                folder_path, folder_size, formatted_size = folder_data
+                folder_path, folder_size, formatted_size, contents = folder_data
                 
                 # Устанавливаем текущую обрабатываемую строку
                 self.current_row = row
@@ -585,7 +591,8 @@ class AIAssistantDialog(QDialog):
                     recommendation_item.setText("Анализ...")
                 
                 # Анализируем папку с потоковой передачей ответа
-                analysis = analyze_folder(folder_path, formatted_size, callback=self.stream_callback)
+                analysis = analyze_folder(folder_path, formatted_size, callback=self.stream_callback,
+                                          contents=contents)
                 
                 # Добавляем результат в список
                 self.results.append({
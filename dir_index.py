@@ -0,0 +1,753 @@
+"""
+Постоянный индекс размеров папок.
+
+Полное дерево папок последнего сканирования хранится в компактном двоичном файле,
+который при открытии отображается в память (mmap). Узлы лежат в порядке обхода
+в глубину, поэтому поддерево любой папки — непрерывный диапазон номеров, и смена
+порога или переход в подпапку не требуют ни обхода диска, ни чтения всего файла.
+Дерево зависит от исключений и параметров обхода, поэтому индекс подходит только
+для сканирования с теми же параметрами: их отпечаток хранится в заголовке.
+
+Формат файла (порядок байтов — родной для платформы):
+    заголовок _HEADER с отпечатком параметров сканирования (scan_options_digest),
+    корневой путь в UTF-8,
+    колонки _COLUMNS по одной на поле узла, блок имен в UTF-8.
+Колонка class_sizes хранит len(FILE_CLASSES) значений на узел подряд,
+age_sizes — len(AGE_BUCKET_DAYS) + 1.
+Каждая секция выровнена на 8 байт, чтобы колонки читались через memoryview.cast.
+
+Прежние индексы корня хранятся как снимки (DirIndexStore.snapshots), и
+diff_indexes сравнивает два снимка, не обращаясь к диску.
+"""
+import array
+import hashlib
+import heapq
+import math
+import mmap
+import os
+import shutil
+import struct
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from folder_scanner import AGE_BUCKET_DAYS, FILE_CLASSES, ExcludeMatcher, FolderInfo, is_excluded
+
+_MAGIC = b'SKDI'
+_VERSION = 4
+_AGE_BUCKETS = len(AGE_BUCKET_DAYS) + 1
+# Сигнатура, версия, количество узлов, размер блока имен, длина корневого пути, время сканирования,
+# отпечаток параметров сканирования
+_HEADER = struct.Struct('<4sIQQQd16s')
+# Колонки узлов, коды типов array/memoryview и количество значений на узел
+_COLUMNS = (
+    ('sizes', 'Q', 1),
+    ('allocated', 'Q', 1),
+    ('file_counts', 'Q', 1),
+    ('mtimes', 'q', 1),
+    ('parents', 'i', 1),
+    # Номер первого узла после поддерева
+    ('ends', 'i', 1),
+    ('name_offsets', 'I', 1),
+    ('name_lengths', 'H', 1),
+    # Размеры по классам файлов; нули, если сканер их не собирал
+    ('class_sizes', 'Q', len(FILE_CLASSES)),
+    # Размеры по корзинам возраста и самый новый файл поддерева; нули, если сканер их не собирал
+    ('age_sizes', 'Q', _AGE_BUCKETS),
+    ('newest_mtimes', 'q', 1),
+)
+_ENCODING = 'utf-8'
+# Имена, которые не декодируются как UTF-8, сохраняются без потерь
+_ERRORS = 'surrogateescape'
+# Точность времени изменения на FAT — 2 секунды; папки, измененные ближе
+# к началу сканирования, при повторном сканировании считаются изменившимися
+_MTIME_RESOLUTION_NS = 2 * 10**9
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _as_array(code: str, column) -> array.array:
+    """Копирует колонку DirTree (array.array или memoryview нативного сканера) одним блоком."""
+    result = array.array(code)
+    result.frombytes(memoryview(column).cast('B'))
+    return result
+
+
+def _normalize(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+def scan_options_digest(exclude_dirs: Union[Iterable[str], ExcludeMatcher], prune_excluded: bool = False,
+                        one_file_system: bool = False, follow_links: bool = False,
+                        dedupe_hard_links: bool = False) -> bytes:
+    """
+    Отпечаток параметров сканирования, от которых зависит дерево папок.
+
+    Без prune_excluded исключенные папки обходятся и входят в дерево, поэтому
+    исключения на него не влияют и в отпечаток не попадают.
+    """
+    rules = ()
+    if prune_excluded:
+        matcher = exclude_dirs if isinstance(exclude_dirs, ExcludeMatcher) else ExcludeMatcher(exclude_dirs)
+        rules = sorted(matcher.rules)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((rules, prune_excluded, one_file_system, follow_links, dedupe_hard_links))
+                  .encode(_ENCODING, _ERRORS))
+    return digest.digest()
+
+
+class DirIndex:
+    """Индекс одного корня сканирования, открытый только для чтения через mmap"""
+
+    def __init__(self, file_path: str):
+        """
+        Открывает индекс.
+
+        Args:
+            file_path (str): Путь к файлу индекса
+
+        Raises:
+            OSError: Файл не удалось открыть
+            ValueError: Файл поврежден или записан другой версией
+        """
+        self._file = open(file_path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self._file.close()
+            raise
+        self._views: List[memoryview] = []
+        try:
+            self._load()
+        except (struct.error, TypeError, ValueError) as e:
+            self.close()
+            raise ValueError(f"Поврежденный индекс {file_path}: {e}")
+
+    def _load(self) -> None:
+        magic, version, count, names_size, root_length, scan_time, options = _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("неизвестный формат")
+
+        view = memoryview(self._mmap)
+        self._views.append(view)
+        offset = _HEADER.size
+        self.root_path = bytes(view[offset:offset + root_length]).decode(_ENCODING, _ERRORS)
+        offset = _align(offset + root_length)
+
+        for name, code, width in _COLUMNS:
+            size = count * width * array.array(code).itemsize
+            column = view[offset:offset + size].cast(code)
+            if len(column) != count * width:
+                raise ValueError("файл обрезан")
+            self._views.append(column)
+            setattr(self, name, column)
+            offset = _align(offset + size)
+
+        self._names = view[offset:offset + names_size]
+        self._views.append(self._names)
+        self.node_count = count
+        self.scan_time = scan_time
+        # Отпечаток параметров сканирования (scan_options_digest)
+        self.options = options
+        self._racy_mtime = int(scan_time * 10**9) - _MTIME_RESOLUTION_NS
+
+    def close(self) -> None:
+        # mmap нельзя закрыть, пока на него есть memoryview
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self) -> 'DirIndex':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def name(self, node: int) -> str:
+        offset = self.name_offsets[node]
+        return bytes(self._names[offset:offset + self.name_lengths[node]]).decode(_ENCODING, _ERRORS)
+
+    def path(self, node: int) -> str:
+        """Восстанавливает полный путь папки по цепочке родителей."""
+        parts = []
+        while node > 0:
+            parts.append(self.name(node))
+            node = self.parents[node]
+        return os.path.join(self.root_path, *reversed(parts))
+
+    def children(self, node: int) -> Iterator[int]:
+        child = node + 1
+        end = self.ends[node]
+        while child < end:
+            yield child
+            child = self.ends[child]
+
+    def own_totals(self, node: int) -> Tuple[int, int, int]:
+        """Размер, место на диске и количество файлов, лежащих прямо в папке."""
+        size, allocated, files = self.sizes[node], self.allocated[node], self.file_counts[node]
+        for child in self.children(node):
+            size -= self.sizes[child]
+            allocated -= self.allocated[child]
+            files -= self.file_counts[child]
+        return size, allocated, files
+
+    def class_sizes_of(self, node: int) -> List[int]:
+        """
+        Размеры файлов поддерева по классам FILE_CLASSES.
+
+        Returns:
+            List[int]: Пустой список, если индекс записан без разбивки по классам
+        """
+        start = node * len(FILE_CLASSES)
+        class_sizes = self.class_sizes[start:start + len(FILE_CLASSES)].tolist()
+        # У записанной разбивки сумма всегда равна размеру папки
+        return class_sizes if sum(class_sizes) == self.sizes[node] else []
+
+    def own_class_sizes(self, node: int) -> Optional[List[int]]:
+        """Размеры по классам для файлов, лежащих прямо в папке; None, если разбивки нет."""
+        class_sizes = self.class_sizes_of(node)
+        if not class_sizes:
+            return None
+        for child in self.children(node):
+            start = child * len(FILE_CLASSES)
+            for i in range(len(FILE_CLASSES)):
+                class_sizes[i] -= self.class_sizes[start + i]
+        return class_sizes
+
+    def age_sizes_of(self, node: int) -> List[int]:
+        """
+        Размеры файлов поддерева по корзинам возраста AGE_BUCKET_DAYS
+        на момент сканирования.
+
+        Returns:
+            List[int]: Пустой список, если индекс записан без разбивки по возрасту
+        """
+        start = node * _AGE_BUCKETS
+        age_sizes = self.age_sizes[start:start + _AGE_BUCKETS].tolist()
+        return age_sizes if sum(age_sizes) == self.sizes[node] else []
+
+    def own_age_sizes(self, node: int) -> Optional[List[int]]:
+        """Размеры по корзинам возраста для файлов, лежащих прямо в папке; None, если разбивки нет."""
+        age_sizes = self.age_sizes_of(node)
+        if not age_sizes:
+            return None
+        for child in self.children(node):
+            start = child * _AGE_BUCKETS
+            for i in range(_AGE_BUCKETS):
+                age_sizes[i] -= self.age_sizes[start + i]
+        return age_sizes
+
+    def unchanged(self, node: int, mtime: int) -> bool:
+        """
+        Проверяет, что набор файлов и подпапок в папке не менялся с момента сканирования.
+
+        Добавление, удаление и переименование элементов меняют время изменения
+        папки. Если же папка менялась незадолго до начала сканирования, изменение
+        могло произойти уже после того, как её прочитали, в пределах той же
+        отметки времени, поэтому такой папке не доверяем.
+        """
+        return mtime == self.mtimes[node] and 0 < mtime < self._racy_mtime
+
+    def find(self, path: str) -> Optional[int]:
+        """
+        Находит узел папки по пути.
+
+        Returns:
+            Optional[int]: Номер узла или None, если папка не входит в индекс
+        """
+        try:
+            relative = os.path.relpath(os.path.abspath(path), self.root_path)
+        except ValueError:
+            # Другой диск на Windows
+            return None
+        parts = Path(relative).parts
+        if parts and parts[0] == os.pardir:
+            return None
+
+        node = 0
+        for part in parts:
+            if part == os.curdir:
+                continue
+            wanted = os.path.normcase(part)
+            for child in self.children(node):
+                if os.path.normcase(self.name(child)) == wanted:
+                    node = child
+                    break
+            else:
+                return None
+        return node
+
+    def large_folders(self, size_threshold: int, exclude_dirs: Union[Iterable[str], ExcludeMatcher],
+                      node: int = 0,
+                      top_k: int = 0, exclude_nested: bool = False) -> List[FolderInfo]:
+        """
+        Находит в поддереве узла папки крупнее порога, не обращаясь к диску.
+
+        Args:
+            size_threshold (int): Минимальный размер папки в байтах
+            exclude_dirs: Правила исключения папок (см. folder_scanner.ExcludeMatcher)
+            node (int): Узел, внутри которого ищутся папки (сам он в результат не входит)
+            top_k (int): Вернуть только top_k самых больших папок, 0 — все
+            exclude_nested (bool): Не показывать папку, если без своей самой большой
+                показанной подпапки она не превышает порог
+
+        Returns:
+            List[FolderInfo]: Папки по убыванию размера
+        """
+        listed = self._listed(self.sizes, size_threshold, exclude_dirs, node, top_k, exclude_nested)
+        folders = [self._folder(i) for i in listed]
+        folders.sort(key=lambda folder: folder.size, reverse=True)
+        return folders
+
+    def cold_folders(self, min_age_days: int, size_threshold: int,
+                     exclude_dirs: Union[Iterable[str], ExcludeMatcher],
+                     node: int = 0, top_k: int = 0) -> List[FolderInfo]:
+        """
+        Находит папки, в которых больше всего файлов, не менявшихся давно.
+
+        Папка показывается, только если давно не менявшихся файлов в ней больше
+        порога и без самой большой показанной подпапки, поэтому родитель
+        единственной «холодной» подпапки в результат не попадает. Возраст
+        отсчитывается от времени сканирования.
+
+        Args:
+            min_age_days (int): Одна из границ AGE_BUCKET_DAYS
+            size_threshold (int): Минимальный размер давно не менявшихся файлов в байтах
+            exclude_dirs: Правила исключения папок (см. folder_scanner.ExcludeMatcher)
+            node (int): Узел, внутри которого ищутся папки (сам он в результат не входит)
+            top_k (int): Вернуть только top_k папок, 0 — все
+
+        Returns:
+            List[FolderInfo]: Папки по убыванию размера давно не менявшихся файлов;
+            пусто, если индекс записан без разбивки по возрасту
+        """
+        first = AGE_BUCKET_DAYS.index(min_age_days) + 1
+        age_sizes = self.age_sizes
+        sizes = self.sizes
+        # Давно не менявшихся файлов не больше размера папки, поэтому считаем их
+        # только для папок крупнее порога
+        cold = array.array('Q', [0]) * self.node_count
+        for i in range(node + 1, self.ends[node]):
+            if sizes[i] > size_threshold:
+                start = i * _AGE_BUCKETS
+                cold[i] = sum(age_sizes[start + first:start + _AGE_BUCKETS])
+        listed = self._listed(cold, size_threshold, exclude_dirs, node, top_k, True)
+        listed.sort(key=lambda i: cold[i], reverse=True)
+        return [self._folder(i) for i in listed]
+
+    def _folder(self, node: int) -> FolderInfo:
+        return FolderInfo(self.path(node), self.sizes[node], self.allocated[node],
+                          self.class_sizes_of(node), self.age_sizes_of(node),
+                          self.newest_mtimes[node])
+
+    def _listed(self, values, threshold: int, exclude_dirs: Union[Iterable[str], ExcludeMatcher],
+                node: int, top_k: int, exclude_nested: bool) -> List[int]:
+        """
+        Отбирает в поддереве узла неисключенные папки, у которых значение больше порога.
+
+        Args:
+            values: Колонка со значением каждого узла; у предка оно не меньше,
+                чем у любого потомка
+            top_k, exclude_nested: См. large_folders
+
+        Returns:
+            List[int]: Номера узлов в произвольном порядке
+        """
+        excluder = exclude_dirs if isinstance(exclude_dirs, ExcludeMatcher) else ExcludeMatcher(exclude_dirs)
+        if is_excluded(self.root_path, excluder):
+            return []
+
+        parents = self.parents
+        candidates = [i for i in range(node + 1, self.ends[node]) if values[i] > threshold]
+
+        # Исключенность наследуется, поэтому для кандидатов проверяем цепочку предков,
+        # запоминая уже проверенные узлы
+        excluded: Dict[int, bool] = {0: False}
+        for candidate in candidates:
+            chain = []
+            current = candidate
+            while current not in excluded:
+                chain.append(current)
+                current = parents[current]
+            state = excluded[current]
+            for chained in reversed(chain):
+                if not state:
+                    parent = parents[chained]
+                    path_rules = excluder.path_rules_in(self.path(parent)) if excluder.has_path_rules else None
+                    state = excluder.matches(self.name(chained), path_rules)
+                excluded[chained] = state
+
+        # Подпапки стоят после родителя, поэтому обратный проход видит их раньше.
+        # Папки не больше порога подходящих подпапок не содержат, и их можно пропустить
+        largest_listed: Dict[int, int] = {}
+        listed = []
+        for candidate in reversed(candidates):
+            value = values[candidate]
+            largest = largest_listed.get(candidate, 0)
+            if not excluded[candidate] and not (exclude_nested and value - largest <= threshold):
+                listed.append(candidate)
+                largest = value
+            parent = parents[candidate]
+            if largest > largest_listed.get(parent, 0):
+                largest_listed[parent] = largest
+
+        if top_k:
+            listed = heapq.nlargest(top_k, listed, key=lambda i: values[i])
+        return listed
+
+    @staticmethod
+    def write(file_path: str, root_path: str, tree, scan_time: Optional[float] = None,
+              options: bytes = b'') -> None:
+        """
+        Записывает дерево сканирования (DirTree любого из сканеров) в файл индекса.
+        options — отпечаток параметров, с которыми получено дерево (scan_options_digest).
+
+        Файл сначала пишется во временный и затем подменяется целиком,
+        чтобы открытый индекс не оказался наполовину перезаписан.
+        """
+        count = len(tree.parents)
+        parents = _as_array('i', tree.parents)
+
+        # Конец поддерева: в порядке обхода в глубину потомки идут сразу за узлом
+        ends = array.array('i', range(1, count + 1))
+        for node in range(count - 1, 0, -1):
+            parent = parents[node]
+            if ends[node] > ends[parent]:
+                ends[parent] = ends[node]
+
+        # Одинаковые имена записываются в блок имен один раз, узлы ссылаются на одно место
+        names = bytearray()
+        offsets = []
+        lengths = []
+        for name in tree.names:
+            encoded = name.encode(_ENCODING, _ERRORS)
+            offsets.append(len(names))
+            lengths.append(len(encoded))
+            names += encoded
+        name_offsets = array.array('I', (offsets[name_id] for name_id in tree.name_ids))
+        name_lengths = array.array('H', (lengths[name_id] for name_id in tree.name_ids))
+
+        class_sizes = _as_array('Q', tree.class_sizes)
+        if len(class_sizes) != count * len(FILE_CLASSES):
+            class_sizes = array.array('Q', [0]) * (count * len(FILE_CLASSES))
+        age_sizes = _as_array('Q', tree.age_sizes)
+        newest_mtimes = _as_array('q', tree.newest_mtimes)
+        if len(age_sizes) != count * _AGE_BUCKETS or len(newest_mtimes) != count:
+            age_sizes = array.array('Q', [0]) * (count * _AGE_BUCKETS)
+            newest_mtimes = array.array('q', [0]) * count
+
+        columns = {
+            'sizes': _as_array('Q', tree.sizes),
+            'allocated': _as_array('Q', tree.allocated),
+            'file_counts': _as_array('Q', tree.file_counts),
+            'mtimes': _as_array('q', tree.mtimes),
+            'parents': parents,
+            'ends': ends,
+            'name_offsets': name_offsets,
+            'name_lengths': name_lengths,
+            'class_sizes': class_sizes,
+            'age_sizes': age_sizes,
+            'newest_mtimes': newest_mtimes,
+        }
+
+        root = os.path.abspath(root_path).encode(_ENCODING, _ERRORS)
+        temp_path = f"{file_path}.tmp"
+        with open(temp_path, 'wb') as f:
+            def pad():
+                f.write(b'\0' * (_align(f.tell()) - f.tell()))
+
+            f.write(_HEADER.pack(_MAGIC, _VERSION, count, len(names), len(root),
+                                 time.time() if scan_time is None else scan_time, options))
+            f.write(root)
+            pad()
+            for name, _, _ in _COLUMNS:
+                columns[name].tofile(f)
+                pad()
+            f.write(names)
+        os.replace(temp_path, file_path)
+
+
+@dataclass
+class FolderChange:
+    """Папка, размер которой изменился между двумя снимками"""
+    path: str
+    # 0, если папки не было в старом снимке или нет в новом
+    old_size: int
+    new_size: int
+
+    @property
+    def growth(self) -> int:
+        return self.new_size - self.old_size
+
+    @property
+    def ratio(self) -> float:
+        """Во сколько раз выросла папка; бесконечность у новой папки."""
+        return self.new_size / self.old_size if self.old_size else math.inf
+
+
+@dataclass
+class IndexDiff:
+    """Разница двух снимков одной папки"""
+    old_time: float
+    new_time: float
+    # Изменение размера самой папки
+    total_growth: int = 0
+    # Папки, выросшие больше чем на порог, по убыванию прироста в байтах
+    grown: List[FolderChange] = field(default_factory=list)
+    # Те же папки по убыванию прироста в разах
+    grown_relative: List[FolderChange] = field(default_factory=list)
+    # Появившиеся и исчезнувшие папки больше порога без их подпапок, по убыванию размера
+    appeared: List[FolderChange] = field(default_factory=list)
+    vanished: List[FolderChange] = field(default_factory=list)
+
+
+def _sorted_children(index: DirIndex, node: int) -> List[Tuple[str, int]]:
+    # На Windows регистр имени мог поменяться, а папка осталась той же
+    return sorted((os.path.normcase(index.name(child)), child) for child in index.children(node))
+
+
+def diff_indexes(old: DirIndex, new: DirIndex, size_threshold: int,
+                 exclude_dirs: Union[Iterable[str], ExcludeMatcher] = (),
+                 old_node: int = 0, new_node: int = 0, top_k: int = 20,
+                 exclude_nested: bool = True) -> IndexDiff:
+    """
+    Сравнивает два снимка одной папки без повторного сканирования.
+
+    Деревья проходятся одновременно: подпапки каждой пары совпавших папок
+    сливаются по имени, как два отсортированных списка. Вглубь идем только
+    там, где папка хотя бы в одном снимке больше порога: в меньших папках
+    подходящих подпапок нет, поэтому сравнение затрагивает лишь крупные ветви.
+
+    Args:
+        old, new: Старый и новый снимки
+        size_threshold (int): Порог в байтах: для прироста и для размера
+            появившихся и исчезнувших папок
+        exclude_dirs: Правила исключения папок (см. folder_scanner.ExcludeMatcher)
+        old_node, new_node (int): Сравниваемая папка в каждом снимке (сама в списки не входит)
+        top_k (int): Сколько папок оставить в каждом списке, 0 — все
+        exclude_nested (bool): Не показывать папку, если без своей быстрее всех
+            растущей подпапки она выросла не больше чем на порог
+
+    Returns:
+        IndexDiff: Выросшие, появившиеся и исчезнувшие папки
+    """
+    diff = IndexDiff(old.scan_time, new.scan_time, new.sizes[new_node] - old.sizes[old_node])
+    excluder = exclude_dirs if isinstance(exclude_dirs, ExcludeMatcher) else ExcludeMatcher(exclude_dirs)
+    if is_excluded(new.path(new_node), excluder):
+        return diff
+
+    grown: List[Tuple[int, int]] = []
+    appeared: List[int] = []
+    vanished: List[int] = []
+    stack = [(old_node, new_node)]
+    while stack:
+        old_parent, new_parent = stack.pop()
+        path_rules = excluder.path_rules_in(new.path(new_parent)) if excluder.has_path_rules else None
+        old_children = _sorted_children(old, old_parent)
+        new_children = _sorted_children(new, new_parent)
+        largest_growth = 0
+        i = j = 0
+        while i < len(old_children) or j < len(new_children):
+            if j == len(new_children) or (i < len(old_children) and old_children[i][0] < new_children[j][0]):
+                old_child = old_children[i][1]
+                i += 1
+                if old.sizes[old_child] > size_threshold and not excluder.matches(old.name(old_child), path_rules):
+                    vanished.append(old_child)
+                continue
+            if i == len(old_children) or new_children[j][0] < old_children[i][0]:
+                new_child = new_children[j][1]
+                j += 1
+                if new.sizes[new_child] > size_threshold and not excluder.matches(new.name(new_child), path_rules):
+                    appeared.append(new_child)
+                    largest_growth = max(largest_growth, new.sizes[new_child])
+                continue
+            old_child = old_children[i][1]
+            new_child = new_children[j][1]
+            i += 1
+            j += 1
+            # Папки не больше порога в обоих снимках не содержат ни подходящих подпапок,
+            # ни прироста больше порога
+            if max(old.sizes[old_child], new.sizes[new_child]) <= size_threshold:
+                continue
+            if excluder.matches(new.name(new_child), path_rules):
+                continue
+            largest_growth = max(largest_growth, new.sizes[new_child] - old.sizes[old_child])
+            stack.append((old_child, new_child))
+
+        growth = new.sizes[new_parent] - old.sizes[old_parent]
+        if new_parent != new_node and growth > size_threshold and not (
+                exclude_nested and growth - largest_growth <= size_threshold):
+            grown.append((old_parent, new_parent))
+
+    changes = [FolderChange(new.path(new_child), old.sizes[old_child], new.sizes[new_child])
+               for old_child, new_child in grown]
+    limit = top_k or len(changes)
+    diff.grown = heapq.nlargest(limit, changes, key=lambda change: change.growth)
+    diff.grown_relative = heapq.nlargest(limit, changes, key=lambda change: change.ratio)
+    diff.appeared = [FolderChange(new.path(node), 0, new.sizes[node])
+                     for node in heapq.nlargest(top_k or len(appeared), appeared, key=new.sizes.__getitem__)]
+    diff.vanished = [FolderChange(old.path(node), old.sizes[node], 0)
+                     for node in heapq.nlargest(top_k or len(vanished), vanished, key=old.sizes.__getitem__)]
+    return diff
+
+
+class Snapshot(NamedTuple):
+    """Сохраненный индекс прошлого сканирования корня"""
+    scan_time: float
+    file: Path
+
+    def open(self) -> DirIndex:
+        return DirIndex(str(self.file))
+
+
+class DirIndexStore:
+    """
+    Хранилище индексов: по одному файлу на каждую корневую папку сканирования.
+
+    Прежние индексы корня остаются снимками: два последних сканирования всегда,
+    более ранние — не чаще одного за snapshot_interval, и всего не больше
+    max_snapshots, самые старые удаляются. Снимок — жесткая ссылка
+    на файл индекса, поэтому лишнего места, пока индекс не перезаписан, он не занимает.
+    """
+
+    def __init__(self, index_dir: Path, max_age: Optional[float] = None,
+                 max_snapshots: int = 0, snapshot_interval: float = 86400):
+        """
+        Args:
+            index_dir (Path): Папка для файлов индексов
+            max_age (float): Через сколько секунд индекс считается устаревшим (None — никогда)
+            max_snapshots (int): Сколько снимков хранить для каждого корня (0 — не хранить)
+            snapshot_interval (float): Минимальный промежуток между старыми снимками в секундах
+        """
+        self.index_dir = Path(index_dir)
+        self.max_age = max_age
+        self.max_snapshots = max_snapshots
+        self.snapshot_interval = snapshot_interval
+
+    def _digest(self, root_path: str) -> str:
+        return hashlib.sha1(_normalize(root_path).encode(_ENCODING, _ERRORS)).hexdigest()[:20]
+
+    def index_file(self, root_path: str) -> Path:
+        return self.index_dir / f"{self._digest(root_path)}.idx"
+
+    def snapshot_dir(self, root_path: str) -> Path:
+        return self.index_dir / 'snapshots' / self._digest(root_path)
+
+    def save(self, root_path: str, tree, scan_time: Optional[float] = None, options: bytes = b'') -> None:
+        """
+        Args:
+            scan_time (float): Время начала сканирования, по умолчанию — текущее
+            options (bytes): Отпечаток параметров сканирования (scan_options_digest)
+        """
+        scan_time = time.time() if scan_time is None else scan_time
+        try:
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            DirIndex.write(str(self.index_file(root_path)), root_path, tree, scan_time, options)
+            if self.max_snapshots:
+                self._keep_snapshot(root_path, scan_time)
+        except OSError as e:
+            print(f"Ошибка при сохранении индекса для {root_path}: {e}")
+
+    def _keep_snapshot(self, root_path: str, scan_time: float) -> None:
+        snapshots = self.snapshots(root_path)
+        # Два последних снимка нужны для сравнения с прошлым сканированием, а более
+        # старые прореживаются до одного за snapshot_interval
+        if len(snapshots) >= 3 and snapshots[-2].scan_time - snapshots[-3].scan_time < self.snapshot_interval:
+            snapshots.pop(-2).file.unlink()
+        snapshot_dir = self.snapshot_dir(root_path)
+        snapshot_dir.mkdir(parents=True, exist_ok=True)
+        target = snapshot_dir / f"{scan_time:.3f}.idx"
+        try:
+            # Следующее сохранение заменяет файл индекса новым, а снимок остается на старом
+            os.link(self.index_file(root_path), target)
+        except OSError:
+            shutil.copyfile(self.index_file(root_path), target)
+        snapshots.append(Snapshot(scan_time, target))
+        for old in snapshots[:-self.max_snapshots]:
+            old.file.unlink()
+
+    def snapshots(self, root_path: str) -> List[Snapshot]:
+        """Снимки корня от старых к новым; последний совпадает с текущим индексом."""
+        try:
+            files = list(self.snapshot_dir(root_path).glob('*.idx'))
+        except OSError:
+            return []
+        snapshots = []
+        for file in files:
+            try:
+                snapshots.append(Snapshot(float(file.stem), file))
+            except ValueError:
+                continue
+        snapshots.sort()
+        return snapshots
+
+    def snapshot_before(self, root_path: str, moment: float,
+                        options: Optional[bytes] = None) -> Optional[Snapshot]:
+        """
+        Последний снимок, сделанный не позже moment, например неделю назад.
+        С options пропускаются снимки сканирований с другими исключениями
+        или параметрами обхода: их сравнение показало бы лишние изменения.
+        """
+        earlier = [snapshot for snapshot in self.snapshots(root_path) if snapshot.scan_time <= moment]
+        for snapshot in reversed(earlier):
+            if options is None:
+                return snapshot
+            try:
+                with snapshot.open() as index:
+                    if index.options == options:
+                        return snapshot
+            except (OSError, ValueError):
+                continue
+        return None
+
+    def is_fresh(self, index: DirIndex) -> bool:
+        return self.max_age is None or time.time() - index.scan_time <= self.max_age
+
+    def open(self, root_path: str, include_stale: bool = False,
+             options: Optional[bytes] = None) -> Optional[DirIndex]:
+        """
+        Открывает индекс, построенный именно для этой корневой папки.
+
+        Устаревший индекс возвращается только с include_stale: он годится
+        как основа для повторного сканирования. С options индекс, записанный
+        при других исключениях или параметрах обхода, считается отсутствующим:
+        в его дереве нет исключенных тогда папок или есть лишние.
+        """
+        file_path = self.index_file(root_path)
+        if not file_path.exists():
+            return None
+        try:
+            index = DirIndex(str(file_path))
+        except (OSError, ValueError) as e:
+            print(f"Ошибка при загрузке индекса {file_path}: {e}")
+            return None
+        if (not include_stale and not self.is_fresh(index)) or (options is not None and index.options != options):
+            index.close()
+            return None
+        return index
+
+    def lookup(self, path: str, include_stale: bool = False,
+               options: Optional[bytes] = None) -> Optional[Tuple[DirIndex, int]]:
+        """
+        Ищет индекс, в который входит папка: построенный для неё самой
+        или для любой из родительских папок. Ближайший корень проверяется первым.
+        options — как в open.
+
+        Returns:
+            Optional[Tuple[DirIndex, int]]: Открытый индекс и номер узла папки в нем
+        """
+        absolute = Path(os.path.abspath(path))
+        for candidate in (absolute, *absolute.parents):
+            index = self.open(str(candidate), include_stale, options)
+            if index is None:
+                continue
+            node = index.find(str(absolute))
+            if node is not None:
+                return index, node
+            index.close()
+        return None
@@ -0,0 +1,270 @@
+"""
+Поиск файлов-дубликатов.
+
+Файлы сравниваются в три этапа, и каждый следующий читает меньше файлов:
+размер, хеш первых и последних 64 КБ, хеш всего файла. Хеши считаются в пуле
+потоков (hashlib отпускает GIL на больших блоках) и сохраняются в кеше по пути,
+размеру и времени изменения, поэтому повторный поиск читает только новые
+и измененные файлы.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from folder_scanner import CancellationToken, ExcludeMatcher, is_junction
+
+# Сколько байт с начала и с конца файла хешируется на втором этапе
+_EDGE_SIZE = 64 * 1024
+_READ_CHUNK = 1024 * 1024
+# Как часто сохранять кеш во время хеширования
+_COMMIT_EVERY = 1000
+
+
+@dataclass
+class DuplicateGroup:
+    """Одинаковые файлы: все копии, кроме одной, можно удалить"""
+    size: int
+    digest: str
+    paths: List[str] = field(default_factory=list)
+
+    @property
+    def reclaimable(self) -> int:
+        """Сколько места освободится, если оставить одну копию."""
+        return self.size * (len(self.paths) - 1)
+
+
+@dataclass
+class DuplicateProgress:
+    """Этап поиска ("scan", "partial" или "full") и сколько на нем сделано"""
+    stage: str
+    done: int = 0
+    total: int = 0
+
+
+@dataclass
+class _File:
+    path: str
+    size: int
+    mtime: int
+    partial: Optional[str] = None
+    full: Optional[str] = None
+
+
+class HashCache:
+    """
+    Хеши файлов в SQLite. Запись действительна, пока у файла те же размер
+    и время изменения; для каждого пути хранится одна последняя запись.
+    """
+
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # Соединением пользуется один поток за раз, но не обязательно тот, что его создал
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, partial TEXT, full TEXT)")
+        self._pending = 0
+
+    def get(self, path: str, size: int, mtime: int) -> Tuple[Optional[str], Optional[str]]:
+        """Возвращает (хеш краев, полный хеш), если они известны для этой версии файла."""
+        row = self._db.execute(
+            "SELECT partial, full FROM hashes WHERE path = ? AND size = ? AND mtime = ?",
+            (path, size, mtime)).fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+    def put(self, path: str, size: int, mtime: int,
+            partial: Optional[str], full: Optional[str]) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO hashes (path, size, mtime, partial, full) VALUES (?, ?, ?, ?, ?)",
+            (path, size, mtime, partial, full))
+        self._pending += 1
+        if self._pending >= _COMMIT_EVERY:
+            self.commit()
+
+    def commit(self) -> None:
+        self._db.commit()
+        self._pending = 0
+
+    def close(self) -> None:
+        self.commit()
+        self._db.close()
+
+
+def _hash_edges(path: str, size: int) -> str:
+    """Хеш первых и последних _EDGE_SIZE байт; для небольших файлов — всего содержимого."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        if size <= 2 * _EDGE_SIZE:
+            digest.update(f.read())
+        else:
+            digest.update(f.read(_EDGE_SIZE))
+            f.seek(-_EDGE_SIZE, os.SEEK_END)
+            digest.update(f.read(_EDGE_SIZE))
+    return digest.hexdigest()
+
+
+def _hash_full(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_READ_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _collect_files(root_path: str, excluder: ExcludeMatcher, min_size: int,
+                   cancel_token: Optional[CancellationToken],
+                   progress: Callable[[int], None]) -> List[_File]:
+    """
+    Собирает файлы не меньше min_size. Исключенные папки не обходятся,
+    а из жестких ссылок на один файл берется одна: они не занимают лишнего места.
+    """
+    files = []
+    seen_links = set()
+    stack = [root_path] if not excluder.excludes(os.path.abspath(root_path)) else []
+    while stack:
+        if cancel_token is not None and cancel_token.cancelled:
+            break
+        path = stack.pop()
+        path_rules = excluder.path_rules_in(os.path.abspath(path)) if excluder.has_path_rules else None
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        # Точки соединения не раскрываем: иначе один и тот же файл
+                        # оказался бы собственным дубликатом
+                        if entry.is_dir(follow_symlinks=False) and not is_junction(entry):
+                            if not excluder.matches(entry.name, path_rules):
+                                stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            st = entry.stat(follow_symlinks=False)
+                            if st.st_size < max(min_size, 1):
+                                continue
+                            if st.st_nlink > 1:
+                                # DirEntry на Windows не заполняет st_ino
+                                if os.name == 'nt':
+                                    st = os.lstat(entry.path)
+                                key = (st.st_dev, st.st_ino)
+                                if key in seen_links:
+                                    continue
+                                seen_links.add(key)
+                            files.append(_File(entry.path, st.st_size, st.st_mtime_ns))
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+        progress(len(files))
+    return files
+
+
+def _group(files: Iterable[_File], key) -> List[List[_File]]:
+    """Группирует файлы по ключу и оставляет только группы из нескольких файлов."""
+    groups: Dict[object, List[_File]] = defaultdict(list)
+    for file in files:
+        value = key(file)
+        if value is not None:
+            groups[value].append(file)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def _hash_stage(files: List[_File], stage: str, attribute: str, hasher,
+                threads: int, cache: Optional[HashCache],
+                cancel_token: Optional[CancellationToken],
+                progress_callback: Optional[Callable[[DuplicateProgress], None]]) -> None:
+    """
+    Заполняет у файлов хеш attribute ("partial" или "full"): из кеша или в пуле потоков.
+    Файлы, которые не удалось прочитать, остаются без хеша и выпадают из поиска.
+    """
+    todo = [file for file in files if getattr(file, attribute) is None]
+    progress = DuplicateProgress(stage, len(files) - len(todo), len(files))
+    if progress_callback is not None:
+        progress_callback(progress)
+
+    def run(file: _File):
+        if cancel_token is not None and cancel_token.cancelled:
+            return file, None
+        try:
+            return file, hasher(file)
+        except OSError:
+            return file, None
+
+    with ThreadPoolExecutor(max_workers=max(threads, 1)) as executor:
+        for file, digest in executor.map(run, todo):
+            progress.done += 1
+            if digest is None:
+                continue
+            setattr(file, attribute, digest)
+            if cache is not None:
+                cache.put(file.path, file.size, file.mtime, file.partial, file.full)
+            if progress_callback is not None and progress.done % 100 == 0:
+                progress_callback(progress)
+    if cache is not None:
+        cache.commit()
+    if progress_callback is not None:
+        progress_callback(progress)
+
+
+def find_duplicates(root_path: str, exclude_dirs: Union[Iterable[str], ExcludeMatcher],
+                    min_size: int = 1,
+                    threads: int = 4, cache: Optional[HashCache] = None,
+                    cancel_token: Optional[CancellationToken] = None,
+                    progress_callback: Optional[Callable[[DuplicateProgress], None]] = None
+                    ) -> List[DuplicateGroup]:
+    """
+    Находит одинаковые файлы.
+
+    Args:
+        root_path (str): Папка, в которой ищутся дубликаты
+        exclude_dirs: Папки, которые не просматриваются (см. folder_scanner.ExcludeMatcher)
+        min_size (int): Минимальный размер файла в байтах
+        threads (int): Количество потоков хеширования (для HDD рекомендуется 1)
+        cache (HashCache): Кеш хешей между запусками
+        cancel_token (CancellationToken): Позволяет остановить поиск из другого потока
+        progress_callback: Получает DuplicateProgress в начале, во время и в конце каждого этапа
+
+    Returns:
+        List[DuplicateGroup]: Группы по убыванию места, которое можно освободить;
+        после отмены — пустой список
+    """
+    scan_progress = DuplicateProgress("scan")
+
+    def files_found(count: int) -> None:
+        scan_progress.done = scan_progress.total = count
+        if progress_callback is not None:
+            progress_callback(scan_progress)
+
+    excluder = exclude_dirs if isinstance(exclude_dirs, ExcludeMatcher) else ExcludeMatcher(exclude_dirs)
+    files = _collect_files(str(root_path), excluder, min_size, cancel_token, files_found)
+
+    # Этап 1: одинаковые файлы одного размера
+    candidates = [file for group in _group(files, lambda file: file.size) for file in group]
+    if cache is not None:
+        for file in candidates:
+            file.partial, file.full = cache.get(file.path, file.size, file.mtime)
+
+    # Этап 2: хеш краев файла отсекает почти все совпадения по размеру
+    _hash_stage(candidates, "partial", "partial", lambda file: _hash_edges(file.path, file.size),
+                threads, cache, cancel_token, progress_callback)
+    groups = _group(candidates, lambda file: (file.size, file.partial) if file.partial else None)
+
+    # Этап 3: полный хеш; у небольших файлов хеш краев уже покрывает весь файл
+    remaining = []
+    for group in groups:
+        for file in group:
+            if file.size <= 2 * _EDGE_SIZE:
+                file.full = file.partial
+            remaining.append(file)
+    _hash_stage(remaining, "full", "full", lambda file: _hash_full(file.path),
+                threads, cache, cancel_token, progress_callback)
+
+    if cancel_token is not None and cancel_token.cancelled:
+        return []
+
+    duplicates = [DuplicateGroup(group[0].size, group[0].full, sorted(file.path for file in group))
+                  for group in _group(remaining, lambda file: (file.size, file.full) if file.full else None)]
+    duplicates.sort(key=lambda group: group.reclaimable, reverse=True)
+    return duplicates
@@ -0,0 +1,1144 @@
+"""
+Сканер папок на чистом Python.
+
+Повторяет интерфейс модуля folder_search_cpp и используется, когда нативный
+модуль не собран. Дерево обходится один раз через os.scandir, размеры папок
+собираются снизу вверх, а для файлов используется stat, закешированный в DirEntry.
+"""
+import array
+import heapq
+import os
+import re
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple, Union
+
+
+# Классы файлов для разбивки размера папки; в этом порядке идут размеры в class_sizes
+FILE_CLASSES = ('video', 'archive', 'log', 'binary', 'other')
+_OTHER_CLASS = FILE_CLASSES.index('other')
+
+
+def _extension_classes() -> Dict[str, int]:
+    # Образы дисков и виртуальных машин считаются архивами: это тоже
+    # упакованные данные, которые редко открывают
+    extensions = {
+        'video': 'mp4 mkv avi mov wmv flv webm m4v mpg mpeg vob 3gp',
+        'archive': 'zip rar 7z tar gz tgz bz2 xz zst lz4 lzma cab iso img dmg wim vhd vhdx vmdk qcow2',
+        'log': 'log etl evtx trace',
+        'binary': 'exe dll sys so dylib a lib o obj pdb pyd jar msi bin dmp mdmp hprof',
+    }
+    return {ext: FILE_CLASSES.index(name) for name, exts in extensions.items() for ext in exts.split()}
+
+
+_EXTENSION_CLASSES = _extension_classes()
+# Названия классов для пользователя, в порядке FILE_CLASSES
+FILE_CLASS_NAMES = ('видео', 'архивы и образы', 'журналы', 'программы', 'прочее')
+
+
+def file_class(name: str) -> int:
+    """Номер класса файла в FILE_CLASSES по расширению имени, без учета регистра."""
+    ext = name[name.rfind('.') + 1:] if '.' in name else ''
+    # Как и нативный сканер, не-ASCII расширения не приводим к нижнему регистру
+    if not ext.isascii():
+        return _OTHER_CLASS
+    return _EXTENSION_CLASSES.get(ext.lower(), _OTHER_CLASS)
+
+
+def describe_class_sizes(class_sizes: List[int], limit: int = 3) -> str:
+    """
+    Кратко описывает состав папки: до limit самых больших классов с долей
+    от размера, например "видео 62%, архивы и образы 20%".
+
+    Returns:
+        str: Пустая строка, если разбивка неизвестна или папка пуста
+    """
+    total = sum(class_sizes)
+    if not total:
+        return ''
+    shares = sorted(((size, name) for size, name in zip(class_sizes, FILE_CLASS_NAMES)
+                     if size * 100 >= total), reverse=True)
+    return ', '.join(f"{name} {size * 100 // total}%" for size, name in shares[:limit])
+
+
+# Границы корзин возраста файлов в днях: корзина 0 — файлы моложе 30 дней,
+# корзина i — не моложе AGE_BUCKET_DAYS[i-1] дней; возраст считается от начала сканирования
+AGE_BUCKET_DAYS = (30, 90, 365, 3 * 365)
+# Названия корзин возраста для пользователя
+AGE_BUCKET_NAMES = ('моложе 30 дней', '30–90 дней', '90 дней – 1 год', '1–3 года', 'старше 3 лет')
+_NS_PER_DAY = 86400 * 10**9
+
+
+def cold_size(age_sizes: List[int], min_age_days: int) -> int:
+    """
+    Размер файлов, которые не менялись не меньше min_age_days дней.
+
+    Args:
+        age_sizes: Размеры по корзинам возраста (FolderInfo.age_sizes)
+        min_age_days (int): Одна из границ AGE_BUCKET_DAYS
+    """
+    return sum(age_sizes[AGE_BUCKET_DAYS.index(min_age_days) + 1:])
+
+
+@dataclass
+class FolderInfo:
+    """Папка и размер её поддерева в байтах"""
+    path: str
+    size: int
+    # Место, которое файлы занимают на диске
+    allocated_size: int = 0
+    # Размер файлов каждого класса FILE_CLASSES; пусто, если разбивка не собиралась
+    class_sizes: List[int] = field(default_factory=list)
+    # Размер файлов по корзинам возраста AGE_BUCKET_DAYS и время изменения самого
+    # нового файла в наносекундах; пусто и 0, если возраст не собирался
+    age_sizes: List[int] = field(default_factory=list)
+    newest_mtime: int = 0
+
+
+@dataclass
+class FileInfo:
+    """Файл и его размер в байтах"""
+    path: str
+    size: int
+    allocated_size: int = 0
+
+
+# Корзин в SizeHistogram: пустые файлы и по одной на каждую длину размера в битах
+_HISTOGRAM_BUCKETS = 65
+
+
+@dataclass
+class SizeHistogram:
+    """
+    Распределение файлов по размеру в логарифмическом масштабе:
+    корзина 0 — пустые файлы, корзина i — файлы от 2^(i-1) до 2^i - 1 байт.
+    """
+    counts: List[int] = field(default_factory=list)
+    # Суммарный размер файлов в корзине
+    bytes: List[int] = field(default_factory=list)
+
+
+def _array_field(code: str):
+    """Поле dataclass с пустым array.array: колонка на миллионы узлов без объекта на каждое число."""
+    return field(default_factory=lambda: array.array(code))
+
+
+@dataclass
+class DirTree:
+    """
+    Полное дерево папок в виде параллельных массивов, узлы в порядке обхода в глубину:
+    узел 0 — корень, родитель всегда раньше потомков, а поддерево каждой папки
+    занимает непрерывный диапазон номеров. Каждое различное имя папки хранится
+    в names один раз, а полный путь собирается по цепочке родителей только
+    по запросу (path). У корня имя — полный путь.
+    """
+    parents: array.array = _array_field('i')
+    # Номер имени папки в names
+    name_ids: array.array = _array_field('I')
+    names: List[str] = field(default_factory=list)
+    sizes: array.array = _array_field('Q')
+    allocated: array.array = _array_field('Q')
+    # Количество файлов во всем поддереве
+    file_counts: array.array = _array_field('Q')
+    # Время изменения папки в наносекундах от начала эпохи Unix
+    mtimes: array.array = _array_field('q')
+    # Размеры по классам файлов, len(FILE_CLASSES) значений на узел подряд;
+    # заполняется, только если задан file_classes
+    class_sizes: array.array = _array_field('Q')
+    # Размеры по корзинам возраста, len(AGE_BUCKET_DAYS) + 1 значений на узел подряд,
+    # и время изменения самого нового файла поддерева (0 — файлов нет);
+    # заполняются, только если задан file_ages
+    age_sizes: array.array = _array_field('Q')
+    newest_mtimes: array.array = _array_field('q')
+    # Номер каждого имени в names
+    _name_ids: Dict[str, int] = field(default_factory=dict, repr=False, compare=False)
+
+    def name(self, node: int) -> str:
+        return self.names[self.name_ids[node]]
+
+    def path(self, node: int) -> str:
+        """Восстанавливает полный путь папки по цепочке родителей."""
+        parts = []
+        while node > 0:
+            parts.append(self.name(node))
+            node = self.parents[node]
+        return os.path.join(self.name(0), *reversed(parts))
+
+    def _intern(self, name: str) -> int:
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._name_ids[name] = len(self.names)
+            self.names.append(name)
+        return name_id
+
+    def add_node(self, parent: int, name: str, mtime: int) -> int:
+        self.parents.append(parent)
+        self.name_ids.append(self._intern(name))
+        self.sizes.append(0)
+        self.allocated.append(0)
+        self.file_counts.append(0)
+        self.mtimes.append(mtime)
+        return len(self.parents) - 1
+
+    def set_totals(self, node: int, size: int, allocated: int, file_count: int,
+                   class_sizes: Optional[List[int]] = None,
+                   age_sizes: Optional[List[int]] = None, newest_mtime: int = 0) -> None:
+        self.sizes[node] = size
+        self.allocated[node] = allocated
+        self.file_counts[node] = file_count
+        if class_sizes is not None:
+            start = node * len(FILE_CLASSES)
+            _reserve(self.class_sizes, start + len(FILE_CLASSES))
+            self.class_sizes[start:start + len(FILE_CLASSES)] = array.array('Q', class_sizes)
+        if age_sizes is not None:
+            start = node * len(age_sizes)
+            _reserve(self.age_sizes, start + len(age_sizes))
+            self.age_sizes[start:start + len(age_sizes)] = array.array('Q', age_sizes)
+            _reserve(self.newest_mtimes, node + 1)
+            self.newest_mtimes[node] = newest_mtime
+
+    def append_subtree(self, subtree: 'DirTree', parent: int) -> None:
+        """Дописывает в конец дерево, построенное отдельно, под узел parent."""
+        offset = len(self.parents)
+        self.parents.extend(parent if p < 0 else p + offset for p in subtree.parents)
+        name_ids = [self._intern(name) for name in subtree.names]
+        self.name_ids.extend(name_ids[name_id] for name_id in subtree.name_ids)
+        self.sizes.extend(subtree.sizes)
+        self.allocated.extend(subtree.allocated)
+        self.file_counts.extend(subtree.file_counts)
+        self.mtimes.extend(subtree.mtimes)
+        if subtree.class_sizes:
+            _reserve(self.class_sizes, offset * len(FILE_CLASSES))
+            self.class_sizes.extend(subtree.class_sizes)
+        if subtree.newest_mtimes:
+            _reserve(self.age_sizes, offset * (len(AGE_BUCKET_DAYS) + 1))
+            self.age_sizes.extend(subtree.age_sizes)
+            _reserve(self.newest_mtimes, offset)
+            self.newest_mtimes.extend(subtree.newest_mtimes)
+
+
+def _reserve(column: array.array, length: int) -> None:
+    """Дополняет колонку DirTree нулями до length значений."""
+    # Итоги узлов задаются после итогов их подпапок, а места под разбивку
+    # корня и других родителей к этому времени еще нет
+    if len(column) < length:
+        column.extend(array.array(column.typecode, [0]) * (length - len(column)))
+
+
+@dataclass
+class ScanStats:
+    """Счетчики сканирования; время этапов в секундах суммируется по всем потокам"""
+    # Папки, которые удалось открыть, и прочитанные в них записи (файлы, подпапки, ссылки)
+    dirs_opened: int = 0
+    entries_read: int = 0
+    # Запросы атрибутов файлов и папок к файловой системе
+    stat_calls: int = 0
+    # Учтенные файлы и сумма их размеров
+    files_counted: int = 0
+    bytes_summed: int = 0
+    # Проверки подпапок по правилам исключения и подпапки, которые не читались:
+    # исключенные при prune_excluded, на другом томе, ссылки и повторные пути к папке
+    exclude_checks: int = 0
+    dirs_pruned: int = 0
+    mounts_skipped: int = 0
+    links_skipped: int = 0
+    # Ошибки по типу: нет доступа, файл или папка исчезли во время обхода, прочие
+    permission_errors: int = 0
+    not_found_errors: int = 0
+    other_errors: int = 0
+    # Чтение папок, запросы атрибутов и проверки исключений; замеряются только при time_phases
+    enumerate_time: float = 0.0
+    stat_time: float = 0.0
+    exclude_time: float = 0.0
+    # Обратные вызовы, сборка дерева и все сканирование целиком; замеряются всегда
+    callback_time: float = 0.0
+    tree_time: float = 0.0
+    wall_time: float = 0.0
+
+    def add(self, other: 'ScanStats') -> None:
+        """Прибавляет счетчики other; подходит и для ScanStats нативного сканера."""
+        for item in fields(self):
+            setattr(self, item.name, getattr(self, item.name) + getattr(other, item.name))
+
+    def count_error(self, error: OSError) -> None:
+        """Относит ошибку файловой системы к одному из типов."""
+        if isinstance(error, PermissionError):
+            self.permission_errors += 1
+        elif isinstance(error, (FileNotFoundError, NotADirectoryError)):
+            self.not_found_errors += 1
+        else:
+            self.other_errors += 1
+
+
+@dataclass
+class ScanResult:
+    """Результат сканирования"""
+    folders: List[FolderInfo]
+    total_size: int = 0
+    total_allocated: int = 0
+    # Заполняется, только если задан collect_tree
+    tree: DirTree = field(default_factory=DirTree)
+    # False, если сканирование было отменено и результаты неполные
+    complete: bool = True
+    # По убыванию размера; заполняется, только если задан largest_files
+    largest_files: List[FileInfo] = field(default_factory=list)
+    # Заполняется, только если задан size_histogram
+    size_histogram: SizeHistogram = field(default_factory=SizeHistogram)
+    # Точки монтирования, в которые сканирование не зашло из-за one_file_system, по алфавиту
+    skipped_mounts: List[str] = field(default_factory=list)
+    stats: ScanStats = field(default_factory=ScanStats)
+
+
+class CancellationToken:
+    """Флаг отмены сканирования, который можно выставить из другого потока"""
+
+    def __init__(self):
+        self._cancelled = False
+
+    def cancel(self) -> None:
+        self._cancelled = True
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+
+@dataclass
+class ScanProgress:
+    """Сколько уже обработано с начала сканирования"""
+    dirs_scanned: int = 0
+    files_scanned: int = 0
+    bytes_scanned: int = 0
+
+
+class _ScanReporter:
+    """
+    Передает прогресс и найденные папки пачками.
+
+    Обратные вызовы срабатывают не чаще раза в interval_ms или когда набралось
+    batch_size найденных папок. При обходе в несколько потоков они вызываются
+    из того потока, который заполнил пачку, но никогда одновременно.
+    """
+
+    def __init__(self, progress_callback: Optional[Callable[[ScanProgress], None]],
+                 folder_callback: Optional[Callable[[List[FolderInfo]], None]],
+                 interval_ms: int, batch_size: int):
+        self.progress_callback = progress_callback
+        self.folder_callback = folder_callback
+        self.interval = interval_ms / 1000
+        self.batch_size = batch_size
+        self.progress = ScanProgress()
+        self.pending: List[FolderInfo] = []
+        self.lock = threading.Lock()
+        self.next_report = time.monotonic() + self.interval
+        # Время в обратных вызовах; они не вызываются одновременно
+        self.callback_time = 0.0
+
+    def dir_scanned(self, files: int, size: int) -> None:
+        with self.lock:
+            self.progress.dirs_scanned += 1
+            self.progress.files_scanned += files
+            self.progress.bytes_scanned += size
+            if time.monotonic() >= self.next_report:
+                self._flush()
+
+    def folder_found(self, folder: FolderInfo) -> None:
+        if self.folder_callback is None:
+            return
+        with self.lock:
+            self.pending.append(folder)
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        start = time.perf_counter()
+        batch, self.pending = self.pending, []
+        if batch and self.folder_callback is not None:
+            self.folder_callback(batch)
+        if self.progress_callback is not None:
+            self.progress_callback(ScanProgress(**vars(self.progress)))
+        self.callback_time += time.perf_counter() - start
+        self.next_report = time.monotonic() + self.interval
+
+
+def _ascii_lower(text: str) -> str:
+    # Как и нативный сканер, регистр меняем только у латиницы
+    if text.isascii():
+        return text.lower()
+    return ''.join(c.lower() if c.isascii() else c for c in text)
+
+
+def _normalize_rule_path(path: str) -> str:
+    """Разделители приведены к '/', повторы и завершающий разделитель убраны."""
+    normalized = re.sub('/+', '/', path.replace('\\', '/'))
+    if len(normalized) > 1 and normalized.endswith('/'):
+        normalized = normalized[:-1]
+    return _ascii_lower(normalized)
+
+
+class ExcludeMatcher:
+    """
+    Правила исключения папок, разобранные один раз перед обходом.
+
+    Правило — точное имя папки ("AppData"), шаблон имени с * и ? ("*.tmp", "cache*")
+    или абсолютный путь ("C:\\Windows", "/proc"), который исключает ровно эту папку.
+    Регистр латинских букв не учитывается, исключение наследуется всеми подпапками.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self._names: Set[str] = set()
+        # Папка -> имена исключенных в ней подпапок, по правилам-путям
+        self._paths: Dict[str, Set[str]] = {}
+        globs = []
+        rules = set()
+        for pattern in patterns:
+            rule = _normalize_rule_path(pattern)
+            if not rule or rule == '/':
+                continue
+            rules.add(rule)
+            slash = rule.rfind('/')
+            if slash >= 0:
+                self._paths.setdefault(rule[:slash] if slash else '/', set()).add(rule[slash + 1:])
+            elif '*' in rule or '?' in rule:
+                globs.append(''.join('.*' if c == '*' else '.' if c == '?' else re.escape(c)
+                                     for c in rule))
+            else:
+                self._names.add(rule)
+        # Все шаблоны проверяются одним регулярным выражением
+        self._globs = re.compile('|'.join(f'(?:{glob})' for glob in globs), re.DOTALL) if globs else None
+        # Разобранные правила: одинаковые наборы правил дают одинаковые rules
+        self.rules = frozenset(rules)
+
+    @property
+    def has_path_rules(self) -> bool:
+        return bool(self._paths)
+
+    def path_rules_in(self, dir_path: str) -> Optional[Set[str]]:
+        """
+        Имена подпапок dir_path, исключенных правилами-путями, или None.
+        Вычисляется один раз на папку, а не для каждой её записи.
+        """
+        if not self._paths:
+            return None
+        return self._paths.get(_normalize_rule_path(dir_path))
+
+    def matches(self, name: str, path_rules: Optional[Set[str]] = None) -> bool:
+        """Исключена ли подпапка name; path_rules — результат path_rules_in для её родителя."""
+        if not self._names and self._globs is None and not path_rules:
+            return False
+        lowered = _ascii_lower(name)
+        if lowered in self._names or (path_rules and lowered in path_rules):
+            return True
+        return self._globs is not None and self._globs.fullmatch(lowered) is not None
+
+    def excludes(self, path: str) -> bool:
+        """Исключена ли папка по полному пути: она сама или любой из её предков."""
+        normalized = _normalize_rule_path(path)
+        # Проверяем каждый компонент пути вместе с папкой, в которой он лежит
+        start = 0
+        while start <= len(normalized):
+            end = normalized.find('/', start)
+            if end < 0:
+                end = len(normalized)
+            name = normalized[start:end]
+            if name and self.matches(name, self.path_rules_in(normalized[:start - 1] or '/')):
+                return True
+            start = end + 1
+        return False
+
+
+def _as_matcher(exclude_dirs: Union[Iterable[str], ExcludeMatcher]) -> ExcludeMatcher:
+    return exclude_dirs if isinstance(exclude_dirs, ExcludeMatcher) else ExcludeMatcher(exclude_dirs)
+
+
+def is_excluded(path: str, exclude_dirs: Union[Iterable[str], ExcludeMatcher]) -> bool:
+    """
+    Проверяет, исключен ли путь правилами exclude_dirs (см. ExcludeMatcher).
+    Для многих проверок выгоднее один раз создать ExcludeMatcher и передавать его.
+    """
+    return _as_matcher(exclude_dirs).excludes(str(path))
+
+
+class _Scanner:
+    """Состояние одного сканирования: настройки, найденные папки, прогресс и отмена"""
+
+    def __init__(self, size_threshold: int, exclude_dirs: Union[Iterable[str], ExcludeMatcher],
+                 threads: int = 1,
+                 reporter: Optional[_ScanReporter] = None,
+                 cancel_token: Optional[CancellationToken] = None,
+                 dedupe_hard_links: bool = False, top_k: int = 0,
+                 exclude_nested: bool = False, largest_files: int = 0,
+                 size_histogram: bool = False, file_classes: bool = False,
+                 prune_excluded: bool = False, one_file_system: bool = False,
+                 follow_links: bool = False, time_phases: bool = False,
+                 file_ages: bool = False):
+        self.size_threshold = size_threshold
+        self.excluder = _as_matcher(exclude_dirs)
+        self.prune_excluded = prune_excluded
+        self.one_file_system = one_file_system
+        self.follow_links = follow_links
+        self.skipped_mounts: List[str] = []
+        self._root_device = 0
+        # Папки, в которые уже заходил обход (при follow_links)
+        self._visited_dirs: Set[Tuple[int, int]] = set()
+        self.threads = threads or os.cpu_count() or 1
+        self.reporter = reporter
+        self.cancel_token = cancel_token
+        self.dedupe_hard_links = dedupe_hard_links
+        self.top_k = top_k
+        self.exclude_nested = exclude_nested
+        self.large_folders: List[FolderInfo] = []
+        # При top_k — куча (размер, номер, папка) с наименьшей папкой на вершине
+        self._heap: List[Tuple[int, int, FolderInfo]] = []
+        self._heap_pushes = 0
+        self._heap_lock = threading.Lock()
+        self.largest_files = largest_files
+        # Куча (размер, номер, файл) самых больших файлов
+        self._files_heap: List[Tuple[int, int, FileInfo]] = []
+        self.histogram: Optional[SizeHistogram] = None
+        if size_histogram:
+            self.histogram = SizeHistogram([0] * _HISTOGRAM_BUCKETS, [0] * _HISTOGRAM_BUCKETS)
+        self.file_classes = file_classes
+        self.file_ages = file_ages
+        # Файл попадает в корзину i + 1, если изменен не позже _age_limits[i]
+        now = time.time_ns()
+        self._age_limits = [now - days * _NS_PER_DAY for days in AGE_BUCKET_DAYS]
+        self._stats_lock = threading.Lock()
+        self._seen_links: Set[Tuple[int, int]] = set()
+        self._links_lock = threading.Lock()
+        self.time_phases = time_phases
+        # Время сборки общего дерева из поддеревьев потоков
+        self.tree_time = 0.0
+        # Счетчики каждого потока обхода, сводятся в take_stats
+        self._local = threading.local()
+        self._thread_stats: List[ScanStats] = []
+
+    @property
+    def _stats(self) -> ScanStats:
+        """Счетчики текущего потока."""
+        try:
+            return self._local.stats
+        except AttributeError:
+            stats = self._local.stats = ScanStats()
+            with self._stats_lock:
+                self._thread_stats.append(stats)
+            return stats
+
+    def take_stats(self) -> ScanStats:
+        """Счетчики всех потоков; callback_time, tree_time и wall_time заполняет вызывающий."""
+        stats = ScanStats()
+        for own in self._thread_stats:
+            stats.add(own)
+        return stats
+
+    def _folder_found(self, path: str, size: int, allocated: int,
+                      class_sizes: Optional[List[int]] = None,
+                      age_sizes: Optional[List[int]] = None, newest_mtime: int = 0) -> None:
+        folder = FolderInfo(path, size, allocated, list(class_sizes or ()),
+                            list(age_sizes or ()), newest_mtime)
+        if self.top_k:
+            with self._heap_lock:
+                self._heap_pushes += 1
+                item = (size, self._heap_pushes, folder)
+                if len(self._heap) < self.top_k:
+                    heapq.heappush(self._heap, item)
+                elif size > self._heap[0][0]:
+                    heapq.heapreplace(self._heap, item)
+            return
+        self.large_folders.append(folder)
+        if self.reporter is not None:
+            self.reporter.folder_found(folder)
+
+    def _add_file_stats(self, sizes: List[int], candidates: List[Tuple[int, str, int]]) -> None:
+        """Добавляет файлы одной папки в распределение и кучу самых больших файлов."""
+        with self._stats_lock:
+            if self.histogram is not None:
+                counts, totals = self.histogram.counts, self.histogram.bytes
+                for size in sizes:
+                    bucket = size.bit_length()
+                    counts[bucket] += 1
+                    totals[bucket] += size
+            heap = self._files_heap
+            for size, path, allocated in candidates:
+                if len(heap) == self.largest_files and size <= heap[0][0]:
+                    continue
+                self._heap_pushes += 1
+                item = (size, self._heap_pushes, FileInfo(path, size, allocated))
+                if len(heap) < self.largest_files:
+                    heapq.heappush(heap, item)
+                else:
+                    heapq.heapreplace(heap, item)
+
+    def take_largest_files(self) -> List[FileInfo]:
+        files = [file for _, _, file in self._files_heap]
+        self._files_heap = []
+        files.sort(key=lambda file: file.size, reverse=True)
+        return files
+
+    def take_large_folders(self) -> List[FolderInfo]:
+        """Найденные папки по убыванию размера, не больше top_k."""
+        if self.top_k:
+            self.large_folders = [folder for _, _, folder in self._heap]
+            self._heap = []
+        self.large_folders.sort(key=lambda folder: folder.size, reverse=True)
+        return self.large_folders
+
+    def _age_bucket(self, mtime: int) -> int:
+        """Корзина возраста файла; файлы из будущего — в корзине 0."""
+        bucket = 0
+        for limit in self._age_limits:
+            if mtime > limit:
+                break
+            bucket += 1
+        return bucket
+
+    def _first_link(self, st: os.stat_result) -> bool:
+        """Проверяет, встречается ли файл с несколькими жесткими ссылками впервые."""
+        key = (st.st_dev, st.st_ino)
+        with self._links_lock:
+            if key in self._seen_links:
+                return False
+            self._seen_links.add(key)
+            return True
+
+    @property
+    def _check_dirs(self) -> bool:
+        # В Unix тома монтируются в обычные папки, а на Windows — только через
+        # точки соединения, которые без follow_links не раскрываются
+        return self.follow_links or (self.one_file_system and os.name != 'nt')
+
+    def _enter_directory(self, path: str, entry: Optional[os.DirEntry] = None) -> bool:
+        """
+        Можно ли заходить в подпапку: она на томе корня (one_file_system) и еще
+        не встречалась по другому пути (follow_links). Пропущенные тома запоминает.
+        """
+        stats = self._stats
+        stats.stat_calls += 1
+        try:
+            # DirEntry на Windows не заполняет st_dev и st_ino
+            st = entry.stat() if entry is not None and os.name != 'nt' else os.stat(path)
+        except OSError:
+            # Ошибку чтения папки обработает сам обход
+            return True
+        if self.one_file_system and st.st_dev != self._root_device:
+            stats.mounts_skipped += 1
+            with self._links_lock:
+                self.skipped_mounts.append(path)
+            return False
+        if not self.follow_links:
+            return True
+        key = (st.st_dev, st.st_ino)
+        with self._links_lock:
+            if key in self._visited_dirs:
+                stats.links_skipped += 1
+                return False
+            self._visited_dirs.add(key)
+            return True
+
+    def _read_directory(self, path: str, excluded: bool) -> Tuple['_Totals', List[Tuple[os.DirEntry, bool]]]:
+        """
+        Читает одну папку.
+
+        Returns:
+            Итоги по файлам самой папки и её подпапки с признаком исключения;
+            complete=False, если чтение прервано отменой
+        """
+        totals = _Totals(self.file_classes, self.file_ages)
+        classes = totals.classes
+        ages = totals.ages
+        subdirs = []
+        cancel_token = self.cancel_token
+        excluder = self.excluder
+        stats = self._stats
+        # При time_phases время запросов атрибутов и проверок исключений вычитается
+        # из времени чтения папки, остаток относится к перечислению записей
+        clock = time.perf_counter if self.time_phases else None
+        read_start = clock() if clock else 0.0
+        stat_time = exclude_time = 0.0
+        # Правила-пути для подпапок этой папки проверяются один раз, а не на каждую запись
+        path_rules = None
+        if not excluded and excluder.has_path_rules:
+            phase_start = clock() if clock else 0.0
+            path_rules = excluder.path_rules_in(os.path.abspath(path))
+            if clock:
+                exclude_time += clock() - phase_start
+        # Размеры файлов для распределения и кандидаты в самые большие файлы
+        sizes = [] if self.histogram is not None else None
+        candidates = [] if self.largest_files and not excluded else None
+        check_dirs = self._check_dirs
+        try:
+            with os.scandir(path) as entries:
+                stats.dirs_opened += 1
+                for entry in entries:
+                    if cancel_token is not None and cancel_token.cancelled:
+                        totals.complete = False
+                        break
+                    stats.entries_read += 1
+                    try:
+                        # Символические ссылки и точки соединения (junction) раскрываются
+                        # только при follow_links и только если ведут в папку
+                        is_link = entry.is_symlink() or is_junction(entry)
+                        if is_link and not self.follow_links:
+                            stats.links_skipped += 1
+                            continue
+                        if entry.is_dir():
+                            child_excluded = excluded
+                            if not child_excluded:
+                                phase_start = clock() if clock else 0.0
+                                stats.exclude_checks += 1
+                                child_excluded = excluder.matches(entry.name, path_rules)
+                                if clock:
+                                    exclude_time += clock() - phase_start
+                            # Исключенная папка отсекается здесь же и дальше не читается
+                            if child_excluded and self.prune_excluded:
+                                stats.dirs_pruned += 1
+                                continue
+                            if check_dirs:
+                                phase_start = clock() if clock else 0.0
+                                enter = self._enter_directory(entry.path, entry)
+                                if clock:
+                                    stat_time += clock() - phase_start
+                                if not enter:
+                                    continue
+                            subdirs.append((entry, child_excluded))
+                        elif not is_link and entry.is_file(follow_symlinks=False):
+                            phase_start = clock() if clock else 0.0
+                            stats.stat_calls += 1
+                            st = entry.stat(follow_symlinks=False)
+                            # DirEntry на Windows не заполняет st_nlink и st_ino
+                            if self.dedupe_hard_links and os.name == 'nt':
+                                stats.stat_calls += 1
+                                st = os.lstat(entry.path)
+                            if clock:
+                                stat_time += clock() - phase_start
+                            if self.dedupe_hard_links and st.st_nlink > 1 and not self._first_link(st):
+                                continue
+                            totals.size += st.st_size
+                            # st_blocks есть только на POSIX, на Windows считаем по размеру
+                            blocks = getattr(st, 'st_blocks', None)
+                            allocated = st.st_size if blocks is None else blocks * 512
+                            totals.allocated += allocated
+                            totals.files += 1
+                            if classes is not None:
+                                classes[file_class(entry.name)] += st.st_size
+                            if ages is not None:
+                                ages[self._age_bucket(st.st_mtime_ns)] += st.st_size
+                                totals.newest = max(totals.newest, st.st_mtime_ns)
+                            if sizes is not None:
+                                sizes.append(st.st_size)
+                            if candidates is not None:
+                                candidates.append((st.st_size, entry.path, allocated))
+                    except OSError as error:
+                        stats.count_error(error)
+                        continue
+        except OSError as error:
+            # Папку без доступа не пропускаем молча, а учитываем как ошибку
+            stats.count_error(error)
+        stats.files_counted += totals.files
+        stats.bytes_summed += totals.size
+        if clock:
+            stats.enumerate_time += clock() - read_start - stat_time - exclude_time
+            stats.stat_time += stat_time
+            stats.exclude_time += exclude_time
+        if sizes or candidates:
+            self._add_file_stats(sizes or [], candidates or [])
+        if self.reporter is not None:
+            self.reporter.dir_scanned(totals.files, totals.size)
+        return totals, subdirs
+
+    def _list_directory(self, path: str, excluded: bool, previous=None, prev_node: int = -1,
+                        mtime: int = 0, need_mtimes: bool = False) -> Tuple['_Totals', List['_Subdir']]:
+        """
+        Получает итоги по файлам папки и список её подпапок.
+
+        Если папка есть в прежнем дереве (previous, узел prev_node) и время её
+        изменения с тех пор не поменялось, набор файлов и подпапок в ней тот же,
+        и они берутся из прежнего дерева без чтения папки. Подпапки при этом
+        все равно проверяются по отдельности: изменения внутри них на время
+        изменения родителя не влияют.
+
+        Args:
+            mtime (int): Текущее время изменения папки, нужно только вместе с prev_node
+            need_mtimes (bool): Прочитать время изменения подпапок, даже если их нет в прежнем дереве
+        """
+        # Исключенный корень при prune_excluded не читается; подпапки отсекаются раньше
+        if excluded and self.prune_excluded:
+            return _Totals(self.file_classes, self.file_ages), []
+
+        reusable = prev_node >= 0 and previous.unchanged(prev_node, mtime)
+        own_classes = own_ages = None
+        # Индекс, записанный без разбивки по классам или возрасту, не заменяет чтение папки
+        if reusable and self.file_classes:
+            own_classes = previous.own_class_sizes(prev_node)
+            reusable = own_classes is not None
+        if reusable and self.file_ages:
+            own_ages = previous.own_age_sizes(prev_node)
+            reusable = own_ages is not None
+        if reusable:
+            totals = _Totals(self.file_classes, self.file_ages)
+            if self.cancel_token is not None and self.cancel_token.cancelled:
+                totals.complete = False
+                return totals, []
+            totals.size, totals.allocated, totals.files = previous.own_totals(prev_node)
+            if own_classes is not None:
+                totals.classes = own_classes
+            if own_ages is not None:
+                # Возраст файлов в индексе отсчитан от прошлого сканирования. Ни один
+                # файл папки не новее самого нового файла её прежнего поддерева,
+                # поэтому файлы из более молодых корзин сдвигаются в его корзину
+                totals.newest = previous.newest_mtimes[prev_node]
+                oldest = self._age_bucket(totals.newest) if totals.newest else 0
+                totals.ages = [0] * oldest + own_ages[oldest:]
+                totals.ages[oldest] += sum(own_ages[:oldest])
+            subdirs = []
+            stats = self._stats
+            path_rules = None
+            if not excluded and self.excluder.has_path_rules:
+                path_rules = self.excluder.path_rules_in(os.path.abspath(path))
+            for prev_child in previous.children(prev_node):
+                name = previous.name(prev_child)
+                child_excluded = excluded
+                if not child_excluded:
+                    stats.exclude_checks += 1
+                    child_excluded = self.excluder.matches(name, path_rules)
+                if child_excluded and self.prune_excluded:
+                    stats.dirs_pruned += 1
+                    continue
+                child_path = os.path.join(path, name)
+                # Том могли подключить в папку, не меняя времени изменения родителя
+                if self._check_dirs and not self._enter_directory(child_path):
+                    continue
+                stats.stat_calls += 1
+                subdirs.append(_Subdir(name, child_path, child_excluded,
+                                       _dir_mtime(child_path), prev_child))
+            if self.reporter is not None:
+                self.reporter.dir_scanned(totals.files, totals.size)
+            return totals, subdirs
+
+        totals, entries = self._read_directory(path, excluded)
+        known = {}
+        if prev_node >= 0:
+            known = {previous.name(prev_child): prev_child for prev_child in previous.children(prev_node)}
+        subdirs = []
+        stats = self._stats
+        for entry, child_excluded in entries:
+            prev_child = known.get(entry.name, -1)
+            child_mtime = 0
+            if need_mtimes or prev_child >= 0:
+                stats.stat_calls += 1
+                child_mtime = _dir_mtime(entry)
+            subdirs.append(_Subdir(entry.name, entry.path, child_excluded, child_mtime, prev_child))
+        return totals, subdirs
+
+    def _add_child(self, totals: '_Totals', subdir: '_Subdir', child: '_Totals') -> None:
+        """Добавляет итоги подпапки к родителю и отмечает крупную папку."""
+        totals.add(child)
+        listed = (child.complete and not subdir.excluded and child.size > self.size_threshold
+                  and not (self.exclude_nested
+                           and child.size - child.largest_listed <= self.size_threshold))
+        if listed:
+            self._folder_found(subdir.path, child.size, child.allocated, child.classes,
+                               child.ages, child.newest)
+        totals.largest_listed = max(totals.largest_listed,
+                                    child.size if listed else child.largest_listed)
+
+    def scan_directory(self, path: str, excluded: bool,
+                       tree: Optional[DirTree] = None, node: int = 0,
+                       previous=None, prev_node: int = -1, mtime: int = 0) -> '_Totals':
+        """
+        Обходит папку в глубину и возвращает итоги по её поддереву.
+
+        Размер каждого файла прибавляется к его папке, а итог поднимается к родителю.
+        Исключенность наследуется от родителя, поэтому путь не разбирается заново.
+        Папки, которые не успели дочитать до отмены, в результат не попадают.
+        Если передано дерево, папка уже добавлена в него под номером node.
+        При повторном сканировании prev_node — узел этой папки в прежнем дереве.
+
+        Обход идет по явному стеку, а не рекурсией, поэтому глубина вложенности
+        папок не ограничена глубиной стека Python.
+        """
+        totals, subdirs = self._list_directory(path, excluded, previous, prev_node,
+                                               mtime, tree is not None)
+        # Папки на пути от path до текущей: итоги, еще не обойденные подпапки,
+        # узел в дереве и описание папки у её родителя
+        stack = [(totals, iter(subdirs), node, None)]
+        while stack:
+            dir_totals, pending, dir_node, dir_subdir = stack[-1]
+            subdir = next(pending, None)
+            if subdir is not None:
+                # Узел добавляется до обхода подпапки, чтобы её поддерево шло сразу за ним
+                child_node = tree.add_node(dir_node, subdir.name, subdir.mtime) if tree is not None else 0
+                child_totals, child_subdirs = self._list_directory(
+                    subdir.path, subdir.excluded, previous, subdir.prev_node,
+                    subdir.mtime, tree is not None)
+                stack.append((child_totals, iter(child_subdirs), child_node, subdir))
+                continue
+            # Все подпапки обойдены: итоги папки готовы и поднимаются к родителю
+            stack.pop()
+            if tree is not None:
+                tree.set_totals(dir_node, dir_totals.size, dir_totals.allocated, dir_totals.files,
+                                dir_totals.classes, dir_totals.ages, dir_totals.newest)
+            if stack:
+                self._add_child(stack[-1][0], dir_subdir, dir_totals)
+        return totals
+
+    def scan_root(self, root_path: str, excluded: bool,
+                  tree: Optional[DirTree] = None,
+                  previous=None, prev_node: int = -1) -> '_Totals':
+        """
+        Обходит корневую папку, распределяя её подпапки по пулу потоков.
+
+        os.scandir и stat отпускают GIL, поэтому несколько потоков ускоряют
+        обход на SSD и сетевых дисках. Каждый поток строит свое поддерево,
+        которое затем дописывается к общему дереву по порядку.
+        """
+        if self.one_file_system or self.follow_links:
+            try:
+                st = os.stat(root_path)
+                self._root_device = st.st_dev
+                self._visited_dirs.add((st.st_dev, st.st_ino))
+            except OSError:
+                # Без тома корня границу проверить не с чем
+                self.one_file_system = False
+        mtime = _dir_mtime(root_path) if tree is not None or prev_node >= 0 else 0
+        if tree is not None:
+            tree.add_node(-1, root_path, mtime)
+        if self.threads == 1:
+            return self.scan_directory(root_path, excluded, tree, 0, previous, prev_node, mtime)
+
+        def scan_subdir(subdir: _Subdir):
+            subtree = None
+            if tree is not None:
+                subtree = DirTree()
+                subtree.add_node(-1, subdir.name, subdir.mtime)
+            return self.scan_directory(subdir.path, subdir.excluded, subtree, 0,
+                                       previous, subdir.prev_node, subdir.mtime), subtree
+
+        totals, subdirs = self._list_directory(root_path, excluded, previous, prev_node,
+                                               mtime, tree is not None)
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            futures = [(subdir, executor.submit(scan_subdir, subdir)) for subdir in subdirs]
+            for subdir, future in futures:
+                child, subtree = future.result()
+                self._add_child(totals, subdir, child)
+                if tree is not None:
+                    tree_start = time.perf_counter()
+                    tree.append_subtree(subtree, 0)
+                    self.tree_time += time.perf_counter() - tree_start
+        if tree is not None:
+            tree.set_totals(0, totals.size, totals.allocated, totals.files, totals.classes,
+                            totals.ages, totals.newest)
+        return totals
+
+
+class _Subdir(NamedTuple):
+    """Подпапка, которую предстоит обойти"""
+    name: str
+    path: str
+    excluded: bool
+    mtime: int
+    # Узел в прежнем дереве или -1, если папка новая
+    prev_node: int
+
+
+class _Totals:
+    """Итоги по поддереву папки"""
+    __slots__ = ('size', 'allocated', 'files', 'complete', 'largest_listed', 'classes',
+                 'ages', 'newest')
+
+    def __init__(self, file_classes: bool = False, file_ages: bool = False):
+        self.size = 0
+        self.allocated = 0
+        self.files = 0
+        self.complete = True
+        # Размер самой большой показанной папки в поддереве (для exclude_nested)
+        self.largest_listed = 0
+        # Размеры по классам FILE_CLASSES или None, если разбивка не собирается
+        self.classes = [0] * len(FILE_CLASSES) if file_classes else None
+        # Размеры по корзинам возраста или None и время изменения самого нового файла
+        self.ages = [0] * (len(AGE_BUCKET_DAYS) + 1) if file_ages else None
+        self.newest = 0
+
+    def add(self, other: '_Totals') -> None:
+        self.size += other.size
+        self.allocated += other.allocated
+        self.files += other.files
+        if self.classes is not None and other.classes is not None:
+            self.classes = [own + child for own, child in zip(self.classes, other.classes)]
+        if self.ages is not None and other.ages is not None:
+            self.ages = [own + child for own, child in zip(self.ages, other.ages)]
+            self.newest = max(self.newest, other.newest)
+        if not other.complete:
+            self.complete = False
+
+
+def is_junction(entry: os.DirEntry) -> bool:
+    """Точка соединения на Windows: как и ссылка, ведет в другую папку или на другой том."""
+    # Тег точки повторного анализа DirEntry получает вместе с содержимым папки
+    return (os.name == 'nt' and entry.is_dir(follow_symlinks=False)
+            and entry.stat(follow_symlinks=False).st_reparse_tag == stat.IO_REPARSE_TAG_MOUNT_POINT)
+
+
+def _dir_mtime(entry) -> int:
+    """Время изменения папки в наносекундах, у ссылки — папки, куда она ведет; принимает DirEntry или путь."""
+    try:
+        if isinstance(entry, os.DirEntry):
+            return entry.stat().st_mtime_ns
+        return os.stat(entry).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def get_folder_size(folder_path: str, threads: int = 1) -> int:
+    """Возвращает размер папки в байтах."""
+    return _Scanner(0, set(), threads).scan_root(str(folder_path), True).size
+
+
+def scan_folders(root_path: str, size_threshold_mb: int,
+                 exclude_dirs: Union[Iterable[str], ExcludeMatcher],
+                 threads: int = 1, cancel_token: Optional[CancellationToken] = None,
+                 dedupe_hard_links: bool = False, collect_tree: bool = False,
+                 progress_callback: Optional[Callable[[ScanProgress], None]] = None,
+                 folder_callback: Optional[Callable[[List[FolderInfo]], None]] = None,
+                 interval_ms: int = 100, batch_size: int = 256,
+                 top_k: int = 0, exclude_nested: bool = False,
+                 largest_files: int = 0, size_histogram: bool = False,
+                 file_classes: bool = False, prune_excluded: bool = False,
+                 one_file_system: bool = False, follow_links: bool = False,
+                 time_phases: bool = False, file_ages: bool = False,
+                 previous=None) -> ScanResult:
+    """
+    Находит папки, размер которых превышает порог.
+
+    Args:
+        root_path (str): Папка, с которой начинается сканирование
+        size_threshold_mb (int): Минимальный размер папки в мегабайтах
+        exclude_dirs: Папки, которые не попадают в результат: имена, шаблоны
+            с * и ? и абсолютные пути (см. ExcludeMatcher)
+        threads (int): Количество потоков обхода, 0 — по числу ядер
+        cancel_token (CancellationToken): Позволяет остановить сканирование из другого потока
+        dedupe_hard_links (bool): Учитывать файл с несколькими жесткими ссылками один раз
+        collect_tree (bool): Вернуть в результате дерево всех папок (ScanResult.tree)
+        progress_callback: Получает ScanProgress во время сканирования
+        folder_callback: Получает пачки найденных папок во время сканирования
+        interval_ms (int): Как часто вызывать обратные вызовы
+        batch_size (int): Сколько найденных папок отправлять без ожидания интервала
+        top_k (int): Вернуть только top_k самых больших папок, 0 — все папки крупнее
+            порога. Найденные папки тогда не передаются в folder_callback
+        exclude_nested (bool): Не показывать папку, если без своей самой большой
+            показанной подпапки она не превышает порог
+        largest_files (int): Собрать столько самых больших файлов вне исключенных папок
+        size_histogram (bool): Собрать распределение всех файлов по размеру (SizeHistogram)
+        file_classes (bool): Разбить размер каждой папки по классам файлов FILE_CLASSES
+            (FolderInfo.class_sizes и DirTree.class_sizes)
+        prune_excluded (bool): Не читать исключенные папки вовсе, тогда их размер
+            не входит в размер родителя. По умолчанию они обходятся и только
+            не попадают в результат
+        one_file_system (bool): Не выходить за пределы тома корня; подключенные
+            внутри него тома не читаются и перечисляются в ScanResult.skipped_mounts
+        follow_links (bool): Заходить в папки по символическим ссылкам и точкам
+            соединения. Каждая папка читается один раз, поэтому зацикленные ссылки
+            и повторные пути к одной папке пропускаются
+        time_phases (bool): Замерить в ScanResult.stats время чтения папок, запросов
+            атрибутов и проверок исключений. Счетчики собираются всегда, а замер
+            времени этапов немного замедляет обход
+        file_ages (bool): Разбить размер каждой папки по возрасту файлов (корзины
+            AGE_BUCKET_DAYS от начала сканирования) и найти её самый новый файл
+            (FolderInfo.age_sizes и newest_mtime, DirTree.age_sizes и newest_mtimes)
+        previous: Индекс прежнего сканирования (dir_index.DirIndex), в который входит
+            root_path. Тогда заново читаются только папки, время изменения которых
+            поменялось, а для остальных файлы берутся из индекса. Файлы, измененные
+            на месте без пересоздания, время изменения папки не меняют и при таком
+            сканировании не замечаются; жесткие ссылки из прочитанных заново папок
+            учитываются один раз только среди них. Файлы неизменившихся папок
+            не читаются и в largest_files и size_histogram не попадают
+
+    Returns:
+        ScanResult: Найденные папки по убыванию размера; после отмены
+        в нем только полностью обойденные папки и complete=False
+    """
+    start = time.perf_counter()
+    root_path = str(root_path)
+    reporter = None
+    if progress_callback is not None or folder_callback is not None:
+        reporter = _ScanReporter(progress_callback, folder_callback, interval_ms, batch_size)
+    excluder = _as_matcher(exclude_dirs)
+    scanner = _Scanner(size_threshold_mb * 1024 * 1024, excluder, threads,
+                       reporter, cancel_token, dedupe_hard_links, top_k, exclude_nested,
+                       largest_files, size_histogram, file_classes, prune_excluded,
+                       one_file_system, follow_links, time_phases, file_ages)
+    tree = DirTree() if collect_tree else None
+    prev_node = previous.find(root_path) if previous is not None else None
+    totals = scanner.scan_root(root_path, excluder.excludes(os.path.abspath(root_path)), tree,
+                               previous, -1 if prev_node is None else prev_node)
+    if reporter is not None:
+        reporter.flush()
+    stats = scanner.take_stats()
+    stats.tree_time = scanner.tree_time
+    if reporter is not None:
+        stats.callback_time = reporter.callback_time
+    result = ScanResult(scanner.take_large_folders(), totals.size, totals.allocated,
+                        tree if tree is not None else DirTree(), totals.complete,
+                        scanner.take_largest_files(),
+                        scanner.histogram if scanner.histogram is not None else SizeHistogram(),
+                        sorted(scanner.skipped_mounts), stats)
+    stats.wall_time = time.perf_counter() - start
+    return result
+
+
+def find_large_folders(root_path: str, size_threshold_mb: int,
+                       exclude_dirs: Union[Iterable[str], ExcludeMatcher], threads: int = 1,
+                       progress_callback: Optional[Callable[[ScanProgress], None]] = None,
+                       folder_callback: Optional[Callable[[List[FolderInfo]], None]] = None,
+                       interval_ms: int = 100, batch_size: int = 256,
+                       top_k: int = 0, exclude_nested: bool = False,
+                       previous=None) -> List[FolderInfo]:
+    """
+    Находит папки, размер которых превышает порог.
+
+    Args:
+        top_k, exclude_nested: Ограничение результата (см. scan_folders)
+        previous: Индекс прежнего сканирования для повторного сканирования (см. scan_folders)
+
+    Returns:
+        List[FolderInfo]: Найденные папки, отсортированные по убыванию размера
+    """
+    return scan_folders(root_path, size_threshold_mb, exclude_dirs, threads,
+                        progress_callback=progress_callback, folder_callback=folder_callback,
+                        interval_ms=interval_ms, batch_size=batch_size,
+                        top_k=top_k, exclude_nested=exclude_nested,
+                        previous=previous).folders
+
+
+def count_folders(root_path: str, exclude_dirs: Union[Iterable[str], ExcludeMatcher]) -> int:
+    """Считает количество неисключенных папок для индикатора прогресса."""
+    excluder = _as_matcher(exclude_dirs)
+    root_path = str(root_path)
+    if excluder.excludes(os.path.abspath(root_path)):
+        return 0
+    total = 0
+    stack = [root_path]
+    while stack:
+        path = stack.pop()
+        path_rules = excluder.path_rules_in(os.path.abspath(path)) if excluder.has_path_rules else None
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        # В исключенную папку не заходим: все её подпапки тоже исключены
+                        if entry.is_dir(follow_symlinks=False) and not excluder.matches(entry.name, path_rules):
+                            total += 1
+                            stack.append(entry.path)
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return total
@@ -1,50 +1,1359 @@
 #include "folder_search.hpp"
 #include <filesystem>
 #include <algorithm>
-#include <thread>
+#include <array>
+#include <atomic>
+#include <cerrno>
 #include <chrono>
+#include <condition_variable>
+#include <deque>
+#include <exception>
+#include <limits>
+#include <memory>
+#include <mutex>
+#include <string_view>
+#include <system_error>
+#include <thread>
+#include <unordered_map>
+#include <unordered_set>
+
+#ifdef _WIN32
+#define WIN32_LEAN_AND_MEAN
+#define NOMINMAX
+#include <windows.h>
+#else
+#include <sys/stat.h>
+#endif
 
 namespace fs = std::filesystem;
 
-uint64_t FolderSearch::getFolderSize(const std::string& folderPath) {
-    uint64_t totalSize = 0;
-    try {
-        for (const auto& entry : fs::recursive_directory_iterator(
-            folderPath,
-            fs::directory_options::skip_permission_denied
-        )) {
-            if (fs::is_regular_file(entry) && !fs::is_symlink(entry)) {
+namespace {
+
+// Добавляет элемент в кучу из limit самых больших, наименьший — на вершине.
+// make() вызывается, только если элемент в кучу попадает; если make() бросает
+// исключение, куча остается прежней
+template <typename T, typename Make>
+void keepLargest(std::vector<T>& heap, size_t limit, uint64_t size, Make make) {
+    auto larger = [](const T& a, const T& b) { return a.size > b.size; };
+    if (heap.size() == limit) {
+        if (size <= heap.front().size) {
+            return;
+        }
+        T item = make();
+        std::pop_heap(heap.begin(), heap.end(), larger);
+        heap.back() = std::move(item);
+    } else {
+        heap.push_back(make());
+    }
+    std::push_heap(heap.begin(), heap.end(), larger);
+}
+
+// Объединяет кучи потоков: limit самых больших по убыванию размера
+template <typename T>
+std::vector<T> mergeLargest(std::vector<std::vector<T>*> heaps, size_t limit) {
+    std::vector<T> result;
+    for (auto* heap : heaps) {
+        std::move(heap->begin(), heap->end(), std::back_inserter(result));
+        heap->clear();
+    }
+    std::sort(result.begin(), result.end(),
+        [](const T& a, const T& b) { return a.size > b.size; });
+    if (limit && result.size() > limit) {
+        result.resize(limit);
+    }
+    return result;
+}
+
+// Номер корзины SizeHistogram: количество значащих битов размера
+size_t sizeBucket(uint64_t size) {
+    size_t bucket = 0;
+    while (size) {
+        size >>= 1;
+        ++bucket;
+    }
+    return bucket;
+}
+
+// Расширения каждого класса файлов, кроме Other. Образы дисков и виртуальных
+// машин считаются архивами: это тоже упакованные данные, которые редко открывают
+const std::unordered_map<std::string_view, FileClass>& extensionClasses() {
+    static const std::unordered_map<std::string_view, FileClass> classes = [] {
+        std::unordered_map<std::string_view, FileClass> map;
+        for (std::string_view ext : {"mp4", "mkv", "avi", "mov", "wmv", "flv", "webm", "m4v",
+                                     "mpg", "mpeg", "vob", "3gp"}) {
+            map.emplace(ext, FileClass::Video);
+        }
+        for (std::string_view ext : {"zip", "rar", "7z", "tar", "gz", "tgz", "bz2", "xz", "zst",
+                                     "lz4", "lzma", "cab", "iso", "img", "dmg", "wim", "vhd",
+                                     "vhdx", "vmdk", "qcow2"}) {
+            map.emplace(ext, FileClass::Archive);
+        }
+        for (std::string_view ext : {"log", "etl", "evtx", "trace"}) {
+            map.emplace(ext, FileClass::Log);
+        }
+        for (std::string_view ext : {"exe", "dll", "sys", "so", "dylib", "a", "lib", "o", "obj",
+                                     "pdb", "pyd", "jar", "msi", "bin", "dmp", "mdmp", "hprof"}) {
+            map.emplace(ext, FileClass::Binary);
+        }
+        return map;
+    }();
+    return classes;
+}
+
+// Класс файла по расширению без учета регистра. Путь разбирается на месте,
+// без выделения памяти: функция вызывается для каждого файла
+template <typename Char>
+FileClass fileClassOf(const std::basic_string<Char>& path) {
+    constexpr size_t kMaxExtension = 8;
+    size_t dot = path.rfind(Char('.'));
+    if (dot == std::basic_string<Char>::npos || path.size() - dot - 1 > kMaxExtension) {
+        return FileClass::Other;
+    }
+    char ext[kMaxExtension];
+    size_t length = path.size() - dot - 1;
+    for (size_t i = 0; i < length; ++i) {
+        Char c = path[dot + 1 + i];
+        // Точка в имени папки, а не файла, или не-ASCII символ
+        if (c <= Char(' ') || c >= Char(0x7f) || c == Char('/') || c == Char('\\')) {
+            return FileClass::Other;
+        }
+        ext[i] = static_cast<char>(c >= Char('A') && c <= Char('Z') ? c - Char('A') + Char('a') : c);
+    }
+    const auto& classes = extensionClasses();
+    auto it = classes.find(std::string_view(ext, length));
+    return it == classes.end() ? FileClass::Other : it->second;
+}
+
+using ClassSizes = std::array<uint64_t, kFileClasses>;
+
+std::string asciiLower(std::string text) {
+    for (char& c : text) {
+        if (c >= 'A' && c <= 'Z') {
+            c = static_cast<char>(c - 'A' + 'a');
+        }
+    }
+    return text;
+}
+
+// Путь для сравнения с правилами-путями: разделители приведены к '/', повторы
+// и завершающий разделитель убраны, латиница в нижнем регистре
+std::string normalizeRulePath(const std::string& path) {
+    std::string normalized;
+    normalized.reserve(path.size());
+    for (char c : path) {
+        if (c == '\\') {
+            c = '/';
+        }
+        if (c == '/' && !normalized.empty() && normalized.back() == '/') {
+            continue;
+        }
+        normalized.push_back(c);
+    }
+    if (normalized.size() > 1 && normalized.back() == '/') {
+        normalized.pop_back();
+    }
+    return asciiLower(std::move(normalized));
+}
+
+// Сопоставление с шаблоном, где * — любая последовательность, а ? — один символ
+bool globMatch(const std::string& pattern, const std::string& text) {
+    size_t p = 0;
+    size_t t = 0;
+    size_t star = std::string::npos;
+    size_t starText = 0;
+    while (t < text.size()) {
+        if (p < pattern.size() && (pattern[p] == '?' || pattern[p] == text[t])) {
+            ++p;
+            ++t;
+        } else if (p < pattern.size() && pattern[p] == '*') {
+            star = p++;
+            starText = t;
+        } else if (star != std::string::npos) {
+            p = star + 1;
+            t = ++starText;
+        } else {
+            return false;
+        }
+    }
+    while (p < pattern.size() && pattern[p] == '*') {
+        ++p;
+    }
+    return p == pattern.size();
+}
+
+// Размер файла и место, которое он занимает на диске
+struct FileSizes {
+    uint64_t apparent = 0;
+    uint64_t allocated = 0;
+};
+
+using AgeSizes = std::array<uint64_t, kAgeBuckets>;
+
+// Итоги по файлам, лежащим прямо в папке
+struct DirFiles {
+    FileSizes sizes;
+    uint64_t count = 0;
+    ClassSizes classSizes{};
+    AgeSizes ageSizes{};
+    // Время изменения самого нового файла, 0 — файлов нет
+    int64_t newestMtime = 0;
+};
+
+// Поднимает atomic-максимум до value
+template <typename T>
+void raiseMax(std::atomic<T>& target, T value) {
+    T current = target.load(std::memory_order_relaxed);
+    while (current < value &&
+           !target.compare_exchange_weak(current, value, std::memory_order_relaxed)) {
+    }
+}
+
+// Идентификатор файла на томе: устройство и inode (на Windows — серийный номер тома и file index)
+struct FileId {
+    uint64_t device;
+    uint64_t inode;
+
+    bool operator==(const FileId& other) const {
+        return device == other.device && inode == other.inode;
+    }
+};
+
+struct FileIdHash {
+    size_t operator()(const FileId& id) const {
+        return std::hash<uint64_t>()(id.inode * 31 + id.device);
+    }
+};
+
+// Множество идентификаторов, общее для всех потоков. Разбито на части,
+// чтобы потоки реже ждали друг друга
+class FileIdSet {
+public:
+    // true, если id встретился впервые
+    bool insert(const FileId& id) {
+        Shard& shard = shards_[FileIdHash()(id) % kShards];
+        std::lock_guard<std::mutex> lock(shard.mutex);
+        return shard.ids.insert(id).second;
+    }
+
+private:
+    static constexpr size_t kShards = 64;
+    struct Shard {
+        std::mutex mutex;
+        std::unordered_set<FileId, FileIdHash> ids;
+    };
+    std::array<Shard, kShards> shards_;
+};
+
+// Идентификатор папки, в которую ведет путь (ссылки раскрываются)
+bool directoryId(const fs::path& path, FileId& id) {
+#ifdef _WIN32
+    HANDLE handle = CreateFileW(
+        path.c_str(), FILE_READ_ATTRIBUTES,
+        FILE_SHARE_READ | FILE_SHARE_WRITE | FILE_SHARE_DELETE, nullptr,
+        OPEN_EXISTING, FILE_FLAG_BACKUP_SEMANTICS, nullptr);
+    if (handle == INVALID_HANDLE_VALUE) {
+        return false;
+    }
+    BY_HANDLE_FILE_INFORMATION info;
+    bool ok = GetFileInformationByHandle(handle, &info) != 0;
+    CloseHandle(handle);
+    if (ok) {
+        id = FileId{info.dwVolumeSerialNumber,
+                    (static_cast<uint64_t>(info.nFileIndexHigh) << 32) | info.nFileIndexLow};
+    }
+    return ok;
+#else
+    struct stat st;
+    if (::stat(path.c_str(), &st) != 0) {
+        return false;
+    }
+    id = FileId{static_cast<uint64_t>(st.st_dev), static_cast<uint64_t>(st.st_ino)};
+    return true;
+#endif
+}
+
+// В Unix тома монтируются в обычные папки, а на Windows — только через точки
+// соединения, которые без followLinks не раскрываются
+#ifdef _WIN32
+constexpr bool kMountsInPlainDirs = false;
+#else
+constexpr bool kMountsInPlainDirs = true;
+#endif
+
+using Clock = std::chrono::steady_clock;
+
+// Прибавляет к total время жизни объекта, если замер включен
+class PhaseTimer {
+public:
+    PhaseTimer(bool enabled, Clock::duration& total)
+        : total_(enabled ? &total : nullptr), start_(enabled ? Clock::now() : Clock::time_point()) {}
+    ~PhaseTimer() {
+        if (total_) {
+            *total_ += Clock::now() - start_;
+        }
+    }
+    PhaseTimer(const PhaseTimer&) = delete;
+    PhaseTimer& operator=(const PhaseTimer&) = delete;
+
+private:
+    Clock::duration* total_;
+    Clock::time_point start_;
+};
+
+double seconds(Clock::duration duration) {
+    return std::chrono::duration<double>(duration).count();
+}
+
+// Относит ошибку файловой системы к одному из типов ScanStats
+void countError(ScanStats& stats, const std::error_code& ec) {
+    if (ec == std::errc::permission_denied || ec == std::errc::operation_not_permitted) {
+        stats.permissionErrors++;
+    } else if (ec == std::errc::no_such_file_or_directory || ec == std::errc::not_a_directory) {
+        stats.notFoundErrors++;
+    } else {
+        stats.otherErrors++;
+    }
+}
+
+// Время изменения папки в наносекундах от начала эпохи Unix; у ссылки — папки, куда она ведет.
+// statCalls увеличивается, если для этого понадобился запрос к файловой системе
+#ifdef _WIN32
+// file_time_type в MSVC считает интервалы по 100 нс от 1601-01-01
+int64_t unixNanoseconds(fs::file_time_type time) {
+    return (static_cast<int64_t>(time.time_since_epoch().count()) - 116444736000000000LL) * 100;
+}
+#endif
+
+int64_t directoryMtime(const fs::directory_entry& entry, uint64_t* statCalls = nullptr) {
+#ifdef _WIN32
+    std::error_code ec;
+    auto time = entry.last_write_time(ec);
+    if (ec) {
+        return 0;
+    }
+    return unixNanoseconds(time);
+#else
+    struct stat st;
+    if (statCalls) {
+        ++*statCalls;
+    }
+    if (::stat(entry.path().c_str(), &st) != 0) {
+        return 0;
+    }
+    return static_cast<int64_t>(st.st_mtim.tv_sec) * 1000000000LL + st.st_mtim.tv_nsec;
+#endif
+}
+
+#ifdef _WIN32
+uint64_t clusterSizeFor(const fs::path& path) {
+    DWORD sectorsPerCluster = 0;
+    DWORD bytesPerSector = 0;
+    DWORD freeClusters = 0;
+    DWORD totalClusters = 0;
+    fs::path root = path.root_path();
+    if (!root.empty() && GetDiskFreeSpaceW(root.c_str(), &sectorsPerCluster, &bytesPerSector,
+                                           &freeClusters, &totalClusters)) {
+        return static_cast<uint64_t>(sectorsPerCluster) * bytesPerSector;
+    }
+    return 4096;
+}
+#endif
+
+using NativeString = fs::path::string_type;
+
+// Словарь имен папок, общий для всех потоков: одинаковые имена (src, .git,
+// node_modules) хранятся один раз, а узел дерева держит только указатель на имя.
+// Элементы unordered_set не перемещаются при росте таблицы, поэтому указатели
+// остаются верными до конца сканирования
+class NamePool {
+public:
+    const NativeString* intern(const NativeString& name) {
+        Shard& shard = shards_[std::hash<NativeString>()(name) % kShards];
+        std::lock_guard<std::mutex> lock(shard.mutex);
+        return &*shard.names.insert(name).first;
+    }
+
+private:
+    // Словарь разбит на части, чтобы потоки реже ждали друг друга
+    static constexpr size_t kShards = 64;
+    struct Shard {
+        std::mutex mutex;
+        std::unordered_set<NativeString> names;
+    };
+    std::array<Shard, kShards> shards_;
+};
+
+// Папка в дереве обхода. Узлы живут до конца сканирования,
+// чтобы завершенные подпапки могли добавить свой размер к родителю.
+// Полный путь в узле не хранится: на миллионах папок он занимал бы больше,
+// чем все остальные поля, и собирается по цепочке родителей, когда нужен
+// Размеры поддерева по классам файлов, собираются так же, как DirNode::size
+using DirClassSizes = std::array<std::atomic<uint64_t>, kFileClasses>;
+
+// Размеры поддерева по корзинам возраста и самый новый файл поддерева
+struct DirAges {
+    std::array<std::atomic<uint64_t>, kAgeBuckets> sizes{};
+    std::atomic<int64_t> newestMtime{0};
+};
+
+struct DirNode {
+    DirNode* parent;
+    // Имя в NamePool; у корня — nullptr, его путь хранит ScanEngine
+    const NativeString* name;
+    // Размер файлов самой папки плюс размеры уже завершенных подпапок
+    std::atomic<uint64_t> size{0};
+    std::atomic<uint64_t> allocated{0};
+    std::atomic<uint64_t> files{0};
+    // Разбивка по классам файлов и по возрасту; заводится, только если её собирают,
+    // иначе каждый узел занимал бы вдвое больше памяти
+    DirClassSizes* classSizes = nullptr;
+    DirAges* ages = nullptr;
+    // Размер самой большой показанной папки в поддереве (для excludeNested)
+    std::atomic<uint64_t> largestListed{0};
+    int64_t mtime = 0;
+    // Номер узла в DirTree, назначается после обхода
+    int32_t id = -1;
+    // Сама папка (пока читается) плюс еще не завершенные подпапки
+    std::atomic<uint32_t> pending{1};
+    bool excluded;
+    // Поддерево обойдено не полностью из-за отмены
+    std::atomic<bool> partial{false};
+
+    DirNode(DirNode* parentNode, const NativeString* dirName, bool isExcluded)
+        : parent(parentNode), name(dirName), excluded(isExcluded) {}
+};
+
+// Обход дерева папок с кражей работы.
+// У каждого потока своя очередь папок: владелец берет папки с конца (обход в глубину),
+// а свободные потоки крадут с начала, где лежат крупные поддеревья ближе к корню.
+// Размер папки поднимается к родителю, когда завершены она сама и все её подпапки,
+// поэтому каждая папка читается один раз при любом числе потоков.
+// Если заданы обратные вызовы, вызывающий поток не обходит папки сам,
+// а только передает прогресс и найденные папки пачками.
+class ScanEngine {
+public:
+    ScanEngine(uint64_t sizeThreshold, const std::set<std::string>& excludeDirs,
+               const ScanOptions& options, const ScanCallbacks* callbacks = nullptr)
+        : sizeThreshold_(sizeThreshold), excluder_(excludeDirs),
+          cancelToken_(options.cancelToken), dedupeHardLinks_(options.dedupeHardLinks),
+          collectTree_(options.collectTree), topK_(options.topK),
+          excludeNested_(options.excludeNested), largestFiles_(options.largestFiles),
+          sizeHistogram_(options.sizeHistogram), fileClasses_(options.fileClasses),
+          fileAges_(options.fileAges), pruneExcluded_(options.pruneExcluded),
+          oneFileSystem_(options.oneFileSystem), followLinks_(options.followLinks),
+          timePhases_(options.timePhases),
+          callbacks_(callbacks) {
+        unsigned threads = options.threads;
+        if (callbacks_ && !callbacks_->onProgress && !callbacks_->onFoldersFound) {
+            callbacks_ = nullptr;
+        }
+        if (threads == 0) {
+            threads = std::max(1u, std::thread::hardware_concurrency());
+        }
+        for (unsigned i = 0; i < threads; ++i) {
+            workers_.push_back(std::make_unique<Worker>());
+        }
+        // Файл попадает в корзину i + 1, если изменен не позже ageLimits_[i]
+        int64_t now = std::chrono::duration_cast<std::chrono::nanoseconds>(
+            std::chrono::system_clock::now().time_since_epoch()).count();
+        for (size_t i = 0; i < ageLimits_.size(); ++i) {
+            ageLimits_[i] = now - static_cast<int64_t>(kAgeBucketDays[i]) * 86400 * 1000000000LL;
+        }
+    }
+
+    // Обходит дерево и возвращает размер корневой папки
+    uint64_t run(const fs::path& rootPath, bool rootExcluded) {
+#ifdef _WIN32
+        std::error_code ec;
+        fs::path absoluteRoot = fs::absolute(rootPath, ec);
+        clusterSize_ = clusterSizeFor(ec ? rootPath : absoluteRoot);
+#endif
+        rootPath_ = rootPath;
+        if (oneFileSystem_ || followLinks_) {
+            FileId rootId;
+            if (directoryId(rootPath, rootId)) {
+                rootDevice_ = rootId.device;
+                if (followLinks_) {
+                    visitedDirs_.insert(rootId);
+                }
+            } else {
+                // Без тома корня границу проверить не с чем
+                oneFileSystem_ = false;
+            }
+        }
+        checkDirs_ = followLinks_ || (oneFileSystem_ && kMountsInPlainDirs);
+        DirNode* root = newNode(*workers_[0], nullptr, nullptr, rootExcluded);
+        if (collectTree_) {
+            std::error_code rootEc;
+            root->mtime = directoryMtime(fs::directory_entry(rootPath, rootEc));
+        }
+        push(0, root);
+
+        std::vector<std::thread> threads;
+        for (size_t i = callbacks_ ? 0 : 1; i < workers_.size(); ++i) {
+            threads.emplace_back(&ScanEngine::workerLoop, this, i);
+        }
+        if (callbacks_) {
+            reportLoop();
+        } else {
+            workerLoop(0);
+        }
+        for (auto& thread : threads) {
+            thread.join();
+        }
+        if (callbacks_) {
+            flushReports();
+            if (callbackError_) {
+                std::rethrow_exception(callbackError_);
+            }
+        }
+        return rootSize_;
+    }
+
+    uint64_t rootAllocated() const {
+        return rootAllocated_;
+    }
+
+    // false, если обход был прерван и часть папок не дочитана
+    bool complete() const {
+        return !stopped_.load();
+    }
+
+    // Собирает узлы всех потоков в одно дерево в порядке обхода в глубину
+    DirTree takeTree() {
+        std::vector<DirNode*> all;
+        for (auto& worker : workers_) {
+            for (auto& node : worker->nodes) {
+                node.id = static_cast<int32_t>(all.size());
+                all.push_back(&node);
+            }
+        }
+
+        // Списки детей в виде односвязных списков, чтобы не заводить вектор на каждую папку
+        std::vector<int32_t> firstChild(all.size(), -1);
+        std::vector<int32_t> nextSibling(all.size(), -1);
+        for (size_t i = 1; i < all.size(); ++i) {
+            int32_t parent = all[i]->parent->id;
+            nextSibling[i] = firstChild[parent];
+            firstChild[parent] = static_cast<int32_t>(i);
+        }
+
+        DirTree tree;
+        tree.parents.reserve(all.size());
+        tree.nameIds.reserve(all.size());
+        tree.sizes.reserve(all.size());
+        tree.allocated.reserve(all.size());
+        tree.fileCounts.reserve(all.size());
+        tree.mtimes.reserve(all.size());
+        if (fileClasses_) {
+            tree.classSizes.reserve(all.size() * kFileClasses);
+        }
+        if (fileAges_) {
+            tree.ageSizes.reserve(all.size() * kAgeBuckets);
+            tree.newestMtimes.reserve(all.size());
+        }
+        tree.names.push_back(toUtf8(rootPath_));
+        // Номера имен в tree.names, присваиваются при первой встрече
+        std::unordered_map<const NativeString*, uint32_t> nameIds;
+
+        std::vector<std::pair<int32_t, int32_t>> stack{{0, -1}};  // узел и номер родителя в дереве
+        while (!stack.empty()) {
+            auto [nodeIndex, parentId] = stack.back();
+            stack.pop_back();
+            DirNode* node = all[nodeIndex];
+            int32_t id = static_cast<int32_t>(tree.parents.size());
+            tree.parents.push_back(parentId);
+            if (parentId < 0) {
+                tree.nameIds.push_back(0);
+            } else {
+                auto [it, inserted] = nameIds.emplace(
+                    node->name, static_cast<uint32_t>(tree.names.size()));
+                if (inserted) {
+                    tree.names.push_back(toUtf8(*node->name));
+                }
+                tree.nameIds.push_back(it->second);
+            }
+            tree.sizes.push_back(node->size.load());
+            tree.allocated.push_back(node->allocated.load());
+            tree.fileCounts.push_back(node->files.load());
+            tree.mtimes.push_back(node->mtime);
+            if (fileClasses_) {
+                for (const auto& classSize : *node->classSizes) {
+                    tree.classSizes.push_back(classSize.load());
+                }
+            }
+            if (fileAges_) {
+                for (const auto& ageSize : node->ages->sizes) {
+                    tree.ageSizes.push_back(ageSize.load());
+                }
+                tree.newestMtimes.push_back(node->ages->newestMtime.load());
+            }
+            for (int32_t child = firstChild[nodeIndex]; child >= 0; child = nextSibling[child]) {
+                stack.emplace_back(child, id);
+            }
+        }
+        return tree;
+    }
+
+    // Найденные папки по убыванию размера, не больше topK
+    std::vector<FolderInfo> takeLargeFolders() {
+        std::vector<std::vector<FolderInfo>*> heaps;
+        for (auto& worker : workers_) {
+            heaps.push_back(&worker->largeFolders);
+        }
+        return mergeLargest(heaps, topK_);
+    }
+
+    std::vector<FileInfo> takeLargestFiles() {
+        std::vector<std::vector<FileInfo>*> heaps;
+        for (auto& worker : workers_) {
+            heaps.push_back(&worker->largestFiles);
+        }
+        return mergeLargest(heaps, largestFiles_);
+    }
+
+    // Счетчики всех потоков; treeTime и wallTime заполняет вызывающий
+    ScanStats takeStats() const {
+        ScanStats stats;
+        Clock::duration enumerateTime{};
+        Clock::duration statTime{};
+        Clock::duration excludeTime{};
+        for (const auto& worker : workers_) {
+            const ScanStats& own = worker->stats;
+            stats.dirsOpened += own.dirsOpened;
+            stats.entriesRead += own.entriesRead;
+            stats.statCalls += own.statCalls;
+            stats.excludeChecks += own.excludeChecks;
+            stats.dirsPruned += own.dirsPruned;
+            stats.mountsSkipped += own.mountsSkipped;
+            stats.linksSkipped += own.linksSkipped;
+            stats.permissionErrors += own.permissionErrors;
+            stats.notFoundErrors += own.notFoundErrors;
+            stats.otherErrors += own.otherErrors;
+            enumerateTime += worker->enumerateTime;
+            statTime += worker->statTime;
+            excludeTime += worker->excludeTime;
+        }
+        stats.filesCounted = filesScanned_.load();
+        stats.bytesSummed = bytesScanned_.load();
+        stats.enumerateTime = seconds(enumerateTime);
+        stats.statTime = seconds(statTime);
+        stats.excludeTime = seconds(excludeTime);
+        stats.callbackTime = seconds(callbackTime_);
+        return stats;
+    }
+
+    std::vector<std::string> takeSkippedMounts() {
+        std::vector<std::string> mounts;
+        for (auto& worker : workers_) {
+            std::move(worker->skippedMounts.begin(), worker->skippedMounts.end(),
+                      std::back_inserter(mounts));
+            worker->skippedMounts.clear();
+        }
+        std::sort(mounts.begin(), mounts.end());
+        return mounts;
+    }
+
+    SizeHistogram takeHistogram() {
+        SizeHistogram histogram;
+        histogram.counts.assign(SizeHistogram::kBuckets, 0);
+        histogram.bytes.assign(SizeHistogram::kBuckets, 0);
+        for (auto& worker : workers_) {
+            for (size_t i = 0; i < SizeHistogram::kBuckets; ++i) {
+                histogram.counts[i] += worker->histogramCounts[i];
+                histogram.bytes[i] += worker->histogramBytes[i];
+            }
+        }
+        return histogram;
+    }
+
+private:
+    struct Worker {
+        std::mutex queueMutex;
+        std::deque<DirNode*> queue;
+        // Узлы, созданные этим потоком; deque не перемещает уже добавленные элементы
+        std::deque<DirNode> nodes;
+        // Разбивки узлов этого потока, если они собираются
+        std::deque<DirClassSizes> classSizes;
+        std::deque<DirAges> ages;
+        // При topK — куча с наименьшей папкой на вершине. Общие topK папок
+        // гарантированно входят в объединение куч всех потоков
+        std::vector<FolderInfo> largeFolders;
+        // Куча самых больших файлов, устроена так же
+        std::vector<FileInfo> largestFiles;
+        std::array<uint64_t, SizeHistogram::kBuckets> histogramCounts{};
+        std::array<uint64_t, SizeHistogram::kBuckets> histogramBytes{};
+        // Точки монтирования, пропущенные из-за oneFileSystem
+        std::vector<std::string> skippedMounts;
+        // Счетчики этого потока; время этапов копится отдельно и переводится в секунды в takeStats
+        ScanStats stats;
+        Clock::duration enumerateTime{};
+        Clock::duration statTime{};
+        Clock::duration excludeTime{};
+    };
+
+    void addLargeFolder(Worker& worker, FolderInfo folder) {
+        if (topK_) {
+            keepLargest(worker.largeFolders, topK_, folder.size, [&] { return std::move(folder); });
+            return;
+        }
+        worker.largeFolders.push_back(std::move(folder));
+        if (callbacks_ && callbacks_->onFoldersFound) {
+            std::lock_guard<std::mutex> lock(reportMutex_);
+            pendingFolders_.push_back(worker.largeFolders.back());
+            if (pendingFolders_.size() >= callbacks_->batchSize) {
+                reportCv_.notify_all();
+            }
+        }
+    }
+
+    DirNode* newNode(Worker& worker, DirNode* parent, const NativeString* name, bool excluded) {
+        DirNode* node = &worker.nodes.emplace_back(parent, name, excluded);
+        if (fileClasses_) {
+            node->classSizes = &worker.classSizes.emplace_back();
+        }
+        if (fileAges_) {
+            node->ages = &worker.ages.emplace_back();
+        }
+        return node;
+    }
+
+    void push(size_t index, DirNode* node) {
+        outstanding_.fetch_add(1);
+        {
+            std::lock_guard<std::mutex> lock(workers_[index]->queueMutex);
+            workers_[index]->queue.push_back(node);
+        }
+        queued_.fetch_add(1);
+        if (idle_.load() > 0) {
+            std::lock_guard<std::mutex> lock(idleMutex_);
+            idleCv_.notify_one();
+        }
+    }
+
+    DirNode* nextDir(size_t index) {
+        {
+            Worker& own = *workers_[index];
+            std::lock_guard<std::mutex> lock(own.queueMutex);
+            if (!own.queue.empty()) {
+                DirNode* node = own.queue.back();
+                own.queue.pop_back();
+                queued_.fetch_sub(1);
+                return node;
+            }
+        }
+        for (size_t offset = 1; offset < workers_.size(); ++offset) {
+            Worker& victim = *workers_[(index + offset) % workers_.size()];
+            std::lock_guard<std::mutex> lock(victim.queueMutex);
+            if (!victim.queue.empty()) {
+                DirNode* node = victim.queue.front();
+                victim.queue.pop_front();
+                queued_.fetch_sub(1);
+                return node;
+            }
+        }
+        return nullptr;
+    }
+
+    void workerLoop(size_t index) {
+        while (true) {
+            if (DirNode* node = nextDir(index)) {
+                processDir(index, node);
+                if (outstanding_.fetch_sub(1) == 1) {
+                    {
+                        std::lock_guard<std::mutex> lock(idleMutex_);
+                        idleCv_.notify_all();
+                    }
+                    std::lock_guard<std::mutex> lock(reportMutex_);
+                    reportCv_.notify_all();
+                }
+                continue;
+            }
+
+            std::unique_lock<std::mutex> lock(idleMutex_);
+            idle_.fetch_add(1);
+            idleCv_.wait(lock, [this] {
+                return queued_.load() > 0 || outstanding_.load() == 0;
+            });
+            idle_.fetch_sub(1);
+            if (outstanding_.load() == 0) {
+                return;
+            }
+        }
+    }
+
+    // Полный путь папки по цепочке имен до корня
+    fs::path pathOf(const DirNode* node) const {
+        std::vector<const NativeString*> names;
+        for (; node->parent; node = node->parent) {
+            names.push_back(node->name);
+        }
+        fs::path path = rootPath_;
+        for (auto it = names.rbegin(); it != names.rend(); ++it) {
+            path /= **it;
+        }
+        return path;
+    }
+
+    static std::string toUtf8(const fs::path& path) {
+        try {
+            return path.u8string();
+        } catch (...) {
+            return std::string();
+        }
+    }
+
+    void processDir(size_t index, DirNode* node) {
+        // После отмены папки из очередей не читаются, а только завершаются
+        if (stopRequested()) {
+            node->partial.store(true, std::memory_order_relaxed);
+            complete(index, node, DirFiles());
+            return;
+        }
+
+        // Исключенный корень при pruneExcluded не читается; подпапки отсекаются раньше
+        if (node->excluded && pruneExcluded_) {
+            complete(index, node, DirFiles());
+            return;
+        }
+
+        Worker& worker = *workers_[index];
+        ScanStats& stats = worker.stats;
+        DirFiles files;
+        try {
+            fs::path dirPath = pathOf(node);
+            // Правила-пути для подпапок этой папки проверяются один раз, а не на каждую запись
+            const std::unordered_set<std::string>* pathRules = nullptr;
+            if (!node->excluded && excluder_.hasPathRules()) {
+                PhaseTimer timer(timePhases_, worker.excludeTime);
+                std::error_code absoluteEc;
+                pathRules = excluder_.pathRulesIn(toUtf8(fs::absolute(dirPath, absoluteEc)));
+            }
+            // Папку без доступа не пропускаем молча, а учитываем как ошибку
+            std::error_code ec;
+            fs::directory_iterator it;
+            {
+                PhaseTimer timer(timePhases_, worker.enumerateTime);
+                it = fs::directory_iterator(dirPath, ec);
+            }
+            if (!ec) {
+                stats.dirsOpened++;
+            }
+            for (const fs::directory_iterator end; !ec && it != end; nextEntry(worker, it, ec)) {
+                if (stopRequested()) {
+                    node->partial.store(true, std::memory_order_relaxed);
+                    break;
+                }
+                const auto& entry = *it;
+                std::error_code entryEc;
+                stats.entriesRead++;
+
+                // Символические ссылки и точки соединения (junction) раскрываются
+                // только при followLinks и только если ведут в папку
+                bool isLink = entry.is_symlink(entryEc);
+#ifdef _MSC_VER
+                // Тип точки соединения MSVC берет из данных, прочитанных вместе с папкой
+                isLink = isLink || entry.symlink_status(entryEc).type() == fs::file_type::junction;
+#endif
+                if (isLink && !followLinks_) {
+                    stats.linksSkipped++;
+                    continue;
+                }
+
+                if (entry.is_directory(entryEc)) {
+                    fs::path name = entry.path().filename();
+                    bool childExcluded = node->excluded;
+                    if (!childExcluded) {
+                        PhaseTimer timer(timePhases_, worker.excludeTime);
+                        stats.excludeChecks++;
+                        childExcluded = excluder_.matches(toUtf8(name), pathRules);
+                    }
+                    // Исключенная папка отсекается здесь же и не попадает ни в очередь, ни в дерево
+                    if (childExcluded && pruneExcluded_) {
+                        stats.dirsPruned++;
+                        continue;
+                    }
+                    if (checkDirs_) {
+                        PhaseTimer timer(timePhases_, worker.statTime);
+                        if (!enterDirectory(worker, entry.path())) {
+                            continue;
+                        }
+                    }
+                    DirNode* child = newNode(worker, node, names_.intern(name.native()), childExcluded);
+                    if (collectTree_) {
+                        PhaseTimer timer(timePhases_, worker.statTime);
+                        child->mtime = directoryMtime(entry, &stats.statCalls);
+                    }
+                    node->pending.fetch_add(1, std::memory_order_relaxed);
+                    push(index, child);
+                } else if (!isLink && entry.is_regular_file(entryEc)) {
+                    FileSizes sizes;
+                    int64_t mtime = 0;
+                    bool measured;
+                    {
+                        PhaseTimer timer(timePhases_, worker.statTime);
+                        measured = measureFile(stats, entry, sizes, mtime);
+                    }
+                    if (measured) {
+                        files.sizes.apparent += sizes.apparent;
+                        files.sizes.allocated += sizes.allocated;
+                        files.count++;
+                        if (fileClasses_) {
+                            files.classSizes[static_cast<size_t>(fileClassOf(entry.path().native()))] +=
+                                sizes.apparent;
+                        }
+                        if (fileAges_) {
+                            files.ageSizes[ageBucket(mtime)] += sizes.apparent;
+                            files.newestMtime = std::max(files.newestMtime, mtime);
+                        }
+                        if (sizeHistogram_) {
+                            size_t bucket = sizeBucket(sizes.apparent);
+                            worker.histogramCounts[bucket]++;
+                            worker.histogramBytes[bucket] += sizes.apparent;
+                        }
+                        // Путь строится, только если файл попадает в кучу. В Windows string()
+                        // бросает исключение для имен вне кодовой страницы ANSI, поэтому
+                        // путь переводится в UTF-8, как и имена в DirTree
+                        if (largestFiles_ && !node->excluded) {
+                            try {
+                                keepLargest(worker.largestFiles, largestFiles_, sizes.apparent, [&] {
+                                    return FileInfo{entry.path().u8string(), sizes.apparent, sizes.allocated};
+                                });
+                            } catch (...) {
+                                // Непредставимое в UTF-8 имя не прерывает чтение остальной папки
+                                stats.otherErrors++;
+                            }
+                        }
+                    }
+                }
+            }
+            if (ec) {
+                countError(stats, ec);
+            }
+        } catch (...) {
+            stats.otherErrors++;
+        }
+        dirsScanned_.fetch_add(1, std::memory_order_relaxed);
+        filesScanned_.fetch_add(files.count, std::memory_order_relaxed);
+        bytesScanned_.fetch_add(files.sizes.apparent, std::memory_order_relaxed);
+        complete(index, node, files);
+    }
+
+    // Корзина возраста файла по времени изменения; файлы из будущего — в корзине 0
+    size_t ageBucket(int64_t mtime) const {
+        size_t bucket = 0;
+        while (bucket < ageLimits_.size() && mtime <= ageLimits_[bucket]) {
+            ++bucket;
+        }
+        return bucket;
+    }
+
+    void nextEntry(Worker& worker, fs::directory_iterator& it, std::error_code& ec) {
+        PhaseTimer timer(timePhases_, worker.enumerateTime);
+        it.increment(ec);
+    }
+
+    // Возвращает false, если размер прочитать не удалось
+    // или файл уже учтен через другую жесткую ссылку. mtime заполняется при fileAges
+    bool measureFile(ScanStats& stats, const fs::directory_entry& entry, FileSizes& sizes,
+                     int64_t& mtime) {
+#ifdef _WIN32
+        std::error_code ec;
+        sizes.apparent = entry.file_size(ec);
+        if (ec) {
+            countError(stats, ec);
+            return false;
+        }
+        if (fileAges_) {
+            // Время изменения, как и размер, уже прочитано вместе с содержимым папки
+            auto time = entry.last_write_time(ec);
+            mtime = ec ? 0 : unixNanoseconds(time);
+        }
+        // Для сжатых и разреженных файлов возвращает реально занятое место
+        stats.statCalls++;
+        DWORD high = 0;
+        DWORD low = GetCompressedFileSizeW(entry.path().c_str(), &high);
+        if (low == INVALID_FILE_SIZE && GetLastError() != NO_ERROR) {
+            sizes.allocated = sizes.apparent;
+        } else {
+            sizes.allocated = (static_cast<uint64_t>(high) << 32) | low;
+        }
+        sizes.allocated = (sizes.allocated + clusterSize_ - 1) / clusterSize_ * clusterSize_;
+
+        if (dedupeHardLinks_) {
+            stats.statCalls++;
+            HANDLE handle = CreateFileW(
+                entry.path().c_str(), FILE_READ_ATTRIBUTES,
+                FILE_SHARE_READ | FILE_SHARE_WRITE | FILE_SHARE_DELETE, nullptr,
+                OPEN_EXISTING, FILE_FLAG_BACKUP_SEMANTICS | FILE_FLAG_OPEN_REPARSE_POINT, nullptr);
+            if (handle != INVALID_HANDLE_VALUE) {
+                BY_HANDLE_FILE_INFORMATION info;
+                bool seen = false;
+                if (GetFileInformationByHandle(handle, &info) && info.nNumberOfLinks > 1) {
+                    FileId id{info.dwVolumeSerialNumber,
+                              (static_cast<uint64_t>(info.nFileIndexHigh) << 32) | info.nFileIndexLow};
+                    seen = !seenLinks_.insert(id);
+                }
+                CloseHandle(handle);
+                if (seen) {
+                    return false;
+                }
+            }
+        }
+        return true;
+#else
+        // Один lstat дает и размер, и занятые блоки, и число жестких ссылок
+        struct stat st;
+        stats.statCalls++;
+        if (::lstat(entry.path().c_str(), &st) != 0) {
+            countError(stats, std::error_code(errno, std::generic_category()));
+            return false;
+        }
+        sizes.apparent = static_cast<uint64_t>(st.st_size);
+        sizes.allocated = static_cast<uint64_t>(st.st_blocks) * 512;
+        mtime = static_cast<int64_t>(st.st_mtim.tv_sec) * 1000000000LL + st.st_mtim.tv_nsec;
+        if (dedupeHardLinks_ && st.st_nlink > 1) {
+            FileId id{static_cast<uint64_t>(st.st_dev), static_cast<uint64_t>(st.st_ino)};
+            return seenLinks_.insert(id);
+        }
+        return true;
+#endif
+    }
+
+    // Можно ли заходить в подпапку: она на томе корня (oneFileSystem) и еще
+    // не встречалась по другому пути (followLinks). Пропущенные тома запоминает
+    bool enterDirectory(Worker& worker, const fs::path& path) {
+        FileId id;
+        worker.stats.statCalls++;
+        if (!directoryId(path, id)) {
+            // Ошибку чтения папки обработает сам обход
+            return true;
+        }
+        if (oneFileSystem_ && id.device != rootDevice_) {
+            worker.stats.mountsSkipped++;
+            worker.skippedMounts.push_back(toUtf8(path));
+            return false;
+        }
+        if (followLinks_ && !visitedDirs_.insert(id)) {
+            worker.stats.linksSkipped++;
+            return false;
+        }
+        return true;
+    }
+
+    // Добавляет размер файлов папки и поднимает размеры завершенных папок к предкам
+    void complete(size_t index, DirNode* node, const DirFiles& files) {
+        node->size.fetch_add(files.sizes.apparent, std::memory_order_relaxed);
+        node->allocated.fetch_add(files.sizes.allocated, std::memory_order_relaxed);
+        node->files.fetch_add(files.count, std::memory_order_relaxed);
+        if (fileClasses_) {
+            for (size_t i = 0; i < kFileClasses; ++i) {
+                (*node->classSizes)[i].fetch_add(files.classSizes[i], std::memory_order_relaxed);
+            }
+        }
+        if (fileAges_) {
+            for (size_t i = 0; i < kAgeBuckets; ++i) {
+                node->ages->sizes[i].fetch_add(files.ageSizes[i], std::memory_order_relaxed);
+            }
+            raiseMax(node->ages->newestMtime, files.newestMtime);
+        }
+        DirNode* current = node;
+        while (current->pending.fetch_sub(1, std::memory_order_acq_rel) == 1) {
+            uint64_t total = current->size.load(std::memory_order_relaxed);
+            uint64_t allocated = current->allocated.load(std::memory_order_relaxed);
+            uint64_t files = current->files.load(std::memory_order_relaxed);
+            bool partial = current->partial.load(std::memory_order_relaxed);
+            DirNode* parent = current->parent;
+            if (!parent) {
+                rootSize_ = total;
+                rootAllocated_ = allocated;
+                return;
+            }
+            if (partial) {
+                parent->partial.store(true, std::memory_order_relaxed);
+            }
+            // Папки с недочитанным поддеревом не попадают в результат с заниженным размером
+            uint64_t largestListed = current->largestListed.load(std::memory_order_relaxed);
+            bool listed = !partial && !current->excluded && total > sizeThreshold_ &&
+                !(excludeNested_ && total - largestListed <= sizeThreshold_);
+            if (listed) {
+                largestListed = total;
                 try {
-                    totalSize += fs::file_size(entry);
+                    FolderInfo folder;
+                    folder.path = pathOf(current).u8string();
+                    folder.size = total;
+                    folder.allocatedSize = allocated;
+                    if (fileClasses_) {
+                        for (const auto& classSize : *current->classSizes) {
+                            folder.classSizes.push_back(classSize.load(std::memory_order_relaxed));
+                        }
+                    }
+                    if (fileAges_) {
+                        for (const auto& ageSize : current->ages->sizes) {
+                            folder.ageSizes.push_back(ageSize.load(std::memory_order_relaxed));
+                        }
+                        folder.newestMtime = current->ages->newestMtime.load(std::memory_order_relaxed);
+                    }
+                    addLargeFolder(*workers_[index], std::move(folder));
                 } catch (...) {
-                    continue;
+                    // Папка, путь которой не перевести в UTF-8, учитывается как ошибка
+                    workers_[index]->stats.otherErrors++;
+                }
+            }
+            raiseMax(parent->largestListed, largestListed);
+            parent->size.fetch_add(total, std::memory_order_relaxed);
+            parent->allocated.fetch_add(allocated, std::memory_order_relaxed);
+            parent->files.fetch_add(files, std::memory_order_relaxed);
+            if (fileClasses_) {
+                for (size_t i = 0; i < kFileClasses; ++i) {
+                    (*parent->classSizes)[i].fetch_add(
+                        (*current->classSizes)[i].load(std::memory_order_relaxed),
+                        std::memory_order_relaxed);
+                }
+            }
+            if (fileAges_) {
+                for (size_t i = 0; i < kAgeBuckets; ++i) {
+                    parent->ages->sizes[i].fetch_add(
+                        current->ages->sizes[i].load(std::memory_order_relaxed),
+                        std::memory_order_relaxed);
                 }
+                raiseMax(parent->ages->newestMtime, current->ages->newestMtime.load(std::memory_order_relaxed));
             }
+            current = parent;
+        }
+    }
+
+    // Проверяется на каждой записи папки, поэтому должна быть дешевой
+    bool stopRequested() {
+        if (stopped_.load(std::memory_order_relaxed)) {
+            return true;
+        }
+        if (cancelToken_ && cancelToken_->isCancelled()) {
+            stopped_.store(true, std::memory_order_relaxed);
+            return true;
+        }
+        return false;
+    }
+
+    // Передает прогресс и найденные папки, пока рабочие потоки обходят дерево
+    void reportLoop() {
+        auto interval = std::chrono::milliseconds(callbacks_->intervalMs);
+        std::unique_lock<std::mutex> lock(reportMutex_);
+        while (true) {
+            reportCv_.wait_for(lock, interval, [this] {
+                return outstanding_.load() == 0 || pendingFolders_.size() >= callbacks_->batchSize;
+            });
+            // Последнюю пачку run() отправляет после завершения всех потоков
+            if (outstanding_.load() == 0) {
+                return;
+            }
+            lock.unlock();
+            flushReports();
+            lock.lock();
+        }
+    }
+
+    void flushReports() {
+        std::vector<FolderInfo> batch;
+        {
+            std::lock_guard<std::mutex> lock(reportMutex_);
+            batch.swap(pendingFolders_);
+        }
+        // После ошибки в обратном вызове сканирование доводится до конца молча,
+        // а исключение пробрасывается из run()
+        if (callbackError_) {
+            return;
+        }
+        PhaseTimer timer(true, callbackTime_);
+        try {
+            if (!batch.empty() && callbacks_->onFoldersFound) {
+                callbacks_->onFoldersFound(batch);
+            }
+            if (callbacks_->onProgress) {
+                ScanProgress progress;
+                progress.dirsScanned = dirsScanned_.load(std::memory_order_relaxed);
+                progress.filesScanned = filesScanned_.load(std::memory_order_relaxed);
+                progress.bytesScanned = bytesScanned_.load(std::memory_order_relaxed);
+                callbacks_->onProgress(progress);
+            }
+        } catch (...) {
+            // Результат все равно будет выброшен, поэтому обход можно прервать
+            callbackError_ = std::current_exception();
+            stopped_.store(true);
+        }
+    }
+
+    uint64_t sizeThreshold_;
+    ExcludeMatcher excluder_;
+    std::shared_ptr<CancellationToken> cancelToken_;
+    std::atomic<bool> stopped_{false};
+    bool dedupeHardLinks_;
+    bool collectTree_;
+    size_t topK_;
+    bool excludeNested_;
+    size_t largestFiles_;
+    bool sizeHistogram_;
+    bool fileClasses_;
+    bool fileAges_;
+    // Границы корзин возраста в наносекундах от начала эпохи Unix
+    std::array<int64_t, kAgeBuckets - 1> ageLimits_{};
+    bool pruneExcluded_;
+    bool oneFileSystem_;
+    bool followLinks_;
+    bool timePhases_;
+    // Подпапкам нужен идентификатор: для границы тома или для учета посещенных папок
+    bool checkDirs_ = false;
+    uint64_t rootDevice_ = 0;
+    FileIdSet seenLinks_;
+    // Папки, в которые уже заходил обход (при followLinks)
+    FileIdSet visitedDirs_;
+    fs::path rootPath_;
+    NamePool names_;
+#ifdef _WIN32
+    uint64_t clusterSize_ = 4096;
+#endif
+    const ScanCallbacks* callbacks_;
+    std::vector<std::unique_ptr<Worker>> workers_;
+    uint64_t rootSize_ = 0;
+    uint64_t rootAllocated_ = 0;
+
+    // Папки в очередях и папки, которые еще не дочитаны (в очереди или в работе)
+    std::atomic<size_t> queued_{0};
+    std::atomic<size_t> outstanding_{0};
+    std::atomic<size_t> idle_{0};
+    std::mutex idleMutex_;
+    std::condition_variable idleCv_;
+
+    std::atomic<uint64_t> dirsScanned_{0};
+    std::atomic<uint64_t> filesScanned_{0};
+    std::atomic<uint64_t> bytesScanned_{0};
+
+    // Найденные папки, которые еще не переданы в onFoldersFound
+    std::mutex reportMutex_;
+    std::condition_variable reportCv_;
+    std::vector<FolderInfo> pendingFolders_;
+    std::exception_ptr callbackError_;
+    // Время в обратных вызовах; их вызывает только один поток
+    Clock::duration callbackTime_{};
+};
+
+} // namespace
+
+ExcludeMatcher::ExcludeMatcher(const std::set<std::string>& patterns) {
+    for (const auto& pattern : patterns) {
+        std::string rule = normalizeRulePath(pattern);
+        size_t slash = rule.rfind('/');
+        if (rule.empty() || rule == "/") {
+            continue;
+        }
+        if (slash != std::string::npos) {
+            paths_[slash ? rule.substr(0, slash) : "/"].insert(rule.substr(slash + 1));
+        } else if (rule.find_first_of("*?") != std::string::npos) {
+            globs_.push_back(rule);
+        } else {
+            names_.insert(rule);
         }
-    } catch (...) {
-        return 0;
     }
-    return totalSize;
 }
 
-bool FolderSearch::isExcluded(const std::string& path, const std::set<std::string>& excludeDirs) {
-    fs::path fsPath(path);
-    for (const auto& part : fsPath) {
-        if (excludeDirs.find(part.string()) != excludeDirs.end()) {
+const std::unordered_set<std::string>* ExcludeMatcher::pathRulesIn(const std::string& dirPath) const {
+    if (paths_.empty()) {
+        return nullptr;
+    }
+    auto it = paths_.find(normalizeRulePath(dirPath));
+    return it == paths_.end() ? nullptr : &it->second;
+}
+
+bool ExcludeMatcher::matches(const std::string& name,
+                             const std::unordered_set<std::string>* pathRules) const {
+    if (names_.empty() && globs_.empty() && !pathRules) {
+        return false;
+    }
+    std::string lowered = asciiLower(name);
+    if (names_.count(lowered) || (pathRules && pathRules->count(lowered))) {
+        return true;
+    }
+    for (const auto& glob : globs_) {
+        if (globMatch(glob, lowered)) {
             return true;
         }
     }
     return false;
 }
 
+bool ExcludeMatcher::excludes(const std::string& path) const {
+    std::string normalized = normalizeRulePath(path);
+    // Проверяем каждый компонент пути вместе с папкой, в которой он лежит
+    std::string parent;
+    size_t start = 0;
+    while (start <= normalized.size()) {
+        size_t end = normalized.find('/', start);
+        if (end == std::string::npos) {
+            end = normalized.size();
+        }
+        std::string name = normalized.substr(start, end - start);
+        if (!name.empty()) {
+            if (matches(name, pathRulesIn(parent.empty() ? "/" : parent))) {
+                return true;
+            }
+        }
+        parent = normalized.substr(0, end);
+        start = end + 1;
+    }
+    return false;
+}
+
+uint64_t FolderSearch::getFolderSize(const std::string& folderPath, unsigned threads) {
+    try {
+        ScanOptions options;
+        options.threads = threads;
+        ScanEngine engine(std::numeric_limits<uint64_t>::max(), {}, options);
+        return engine.run(fs::path(folderPath), true);
+    } catch (...) {
+        return 0;
+    }
+}
+
+std::string DirTree::path(size_t node) const {
+    std::vector<size_t> chain;
+    for (; parents[node] >= 0; node = static_cast<size_t>(parents[node])) {
+        chain.push_back(node);
+    }
+    fs::path path = fs::u8path(name(node));
+    for (auto it = chain.rbegin(); it != chain.rend(); ++it) {
+        path /= fs::u8path(name(*it));
+    }
+    return path.u8string();
+}
+
+bool FolderSearch::isExcluded(const std::string& path, const std::set<std::string>& excludeDirs) {
+    return ExcludeMatcher(excludeDirs).excludes(path);
+}
+
 uint64_t FolderSearch::countFolders(const std::string& rootPath, const std::set<std::string>& excludeDirs) {
     uint64_t total = 0;
     try {
-        for (const auto& entry : fs::recursive_directory_iterator(
-            rootPath,
-            fs::directory_options::skip_permission_denied
-        )) {
-            if (fs::is_directory(entry) && !isExcluded(entry.path().string(), excludeDirs)) {
+        ExcludeMatcher excluder(excludeDirs);
+        std::error_code ec;
+        if (excluder.excludes(fs::absolute(rootPath, ec).u8string())) {
+            return 0;
+        }
+        fs::recursive_directory_iterator it(rootPath, fs::directory_options::skip_permission_denied, ec);
+        for (const fs::recursive_directory_iterator end; !ec && it != end; it.increment(ec)) {
+            std::error_code entryEc;
+            if (it->is_symlink(entryEc) || !it->is_directory(entryEc)) {
+                continue;
+            }
+            const std::unordered_set<std::string>* pathRules = nullptr;
+            if (excluder.hasPathRules()) {
+                std::error_code absoluteEc;
+                pathRules = excluder.pathRulesIn(
+                    fs::absolute(it->path().parent_path(), absoluteEc).u8string());
+            }
+            // В исключенную папку не заходим: все её подпапки тоже исключены
+            if (excluder.matches(it->path().filename().u8string(), pathRules)) {
+                it.disable_recursion_pending();
+            } else {
                 total++;
             }
         }
@@ -55,43 +1364,54 @@ uint64_t FolderSearch::countFolders(const std::string& rootPath, const std::set<
 std::vector<FolderInfo> FolderSearch::findLargeFolders(
     const std::string& rootPath,
     uint64_t sizeThresholdMb,
-    const std::set<std::string>& excludeDirs
+    const std::set<std::string>& excludeDirs,
+    unsigned threads,
+    const ScanCallbacks& callbacks,
+    size_t topK,
+    bool excludeNested
 ) {
-    std::vector<FolderInfo> largeFolders;
-    uint64_t sizeThreshold = sizeThresholdMb * 1024 * 1024;
-    
-    try {
-        // Сначала собираем список всех папок для сканирования
-        std::vector<fs::path> dirsToScan;
-        for (const auto& entry : fs::recursive_directory_iterator(
-            rootPath,
-            fs::directory_options::skip_permission_denied
-        )) {
-            if (fs::is_directory(entry) && !isExcluded(entry.path().string(), excludeDirs)) {
-                dirsToScan.push_back(entry.path());
-            }
-        }
-        
-        // Теперь сканируем каждую папку с возможностью обновления прогресса
-        size_t totalDirs = dirsToScan.size();
-        for (size_t i = 0; i < totalDirs; ++i) {
-            const auto& dir = dirsToScan[i];
-            uint64_t size = getFolderSize(dir.string());
-            if (size > sizeThreshold) {
-                largeFolders.push_back({dir.string(), size});
-            }
-            
-            // Каждые 10 папок делаем небольшую паузу, чтобы GUI мог обработать события
-            if (i % 10 == 0) {
-                std::this_thread::sleep_for(std::chrono::milliseconds(1));
-            }
-        }
-    } catch (...) {}
+    ScanOptions options;
+    options.threads = threads;
+    options.topK = topK;
+    options.excludeNested = excludeNested;
+    return scanFolders(rootPath, sizeThresholdMb, excludeDirs, options, callbacks).folders;
+}
 
-    std::sort(largeFolders.begin(), largeFolders.end(),
-        [](const FolderInfo& a, const FolderInfo& b) {
-            return a.size > b.size;
-        });
+ScanResult FolderSearch::scanFolders(
+    const std::string& rootPath,
+    uint64_t sizeThresholdMb,
+    const std::set<std::string>& excludeDirs,
+    const ScanOptions& options,
+    const ScanCallbacks& callbacks
+) {
+    auto start = Clock::now();
+    uint64_t sizeThreshold = sizeThresholdMb * 1024 * 1024;
 
-    return largeFolders;
+    // Один проход по дереву: размеры поддеревьев собираются снизу вверх,
+    // поэтому каждая папка читается с диска ровно один раз.
+    // Ошибки файловой системы обрабатываются внутри обхода,
+    // наружу выходят только исключения из обратных вызовов.
+    ScanEngine engine(sizeThreshold, excludeDirs, options, &callbacks);
+    ScanResult result;
+    std::error_code ec;
+    bool rootExcluded = isExcluded(fs::absolute(rootPath, ec).u8string(), excludeDirs);
+    result.totalSize = engine.run(fs::path(rootPath), rootExcluded);
+    result.totalAllocated = engine.rootAllocated();
+    result.complete = engine.complete();
+    result.folders = engine.takeLargeFolders();
+    result.stats = engine.takeStats();
+    if (options.collectTree) {
+        auto treeStart = Clock::now();
+        result.tree = engine.takeTree();
+        result.stats.treeTime = seconds(Clock::now() - treeStart);
+    }
+    if (options.largestFiles) {
+        result.largestFiles = engine.takeLargestFiles();
+    }
+    if (options.sizeHistogram) {
+        result.histogram = engine.takeHistogram();
+    }
+    result.skippedMounts = engine.takeSkippedMounts();
+    result.stats.wallTime = seconds(Clock::now() - start);
+    return result;
 }
@@ -2,20 +2,248 @@
 #include <string>
 #include <vector>
 #include <set>
+#include <unordered_map>
+#include <unordered_set>
 #include <utility>
+#include <cstdint>
+#include <functional>
+#include <atomic>
+#include <memory>
+
+// Классы файлов по расширению для разбивки размера папки; порядок совпадает
+// с порядком размеров в FolderInfo::classSizes и DirTree::classSizes
+enum class FileClass : uint8_t { Video, Archive, Log, Binary, Other };
+constexpr size_t kFileClasses = 5;
+
+// Корзины возраста файлов по времени изменения: корзина 0 — файлы моложе
+// kAgeBucketDays[0] дней, корзина i — не моложе kAgeBucketDays[i-1] дней,
+// последняя — старше трех лет. Возраст отсчитывается от начала сканирования
+constexpr size_t kAgeBuckets = 5;
+constexpr uint32_t kAgeBucketDays[kAgeBuckets - 1] = {30, 90, 365, 3 * 365};
 
 struct FolderInfo {
     std::string path;
-    uint64_t size;
+    // Сумма размеров файлов
+    uint64_t size = 0;
+    // Место, которое файлы занимают на диске (с учетом сжатия, разреженности и кластеров)
+    uint64_t allocatedSize = 0;
+    // Размер файлов каждого класса FileClass; пусто, если не задан ScanOptions::fileClasses
+    std::vector<uint64_t> classSizes;
+    // Размер файлов по корзинам возраста и время изменения самого нового файла
+    // в наносекундах от начала эпохи Unix; заполняются, только если задан ScanOptions::fileAges
+    std::vector<uint64_t> ageSizes;
+    int64_t newestMtime = 0;
+};
+
+struct FileInfo {
+    std::string path;
+    uint64_t size = 0;
+    uint64_t allocatedSize = 0;
+};
+
+// Распределение файлов по размеру в логарифмическом масштабе:
+// корзина 0 — пустые файлы, корзина i — файлы от 2^(i-1) до 2^i - 1 байт
+struct SizeHistogram {
+    static constexpr size_t kBuckets = 65;
+    std::vector<uint64_t> counts;
+    // Суммарный размер файлов в корзине
+    std::vector<uint64_t> bytes;
+};
+
+// Сколько уже обработано с начала сканирования
+struct ScanProgress {
+    uint64_t dirsScanned = 0;
+    uint64_t filesScanned = 0;
+    uint64_t bytesScanned = 0;
+};
+
+// Счетчики сканирования: на что ушло время и сколько было ошибок.
+// Время этапов суммируется по всем потокам обхода, поэтому при нескольких
+// потоках может превышать wallTime; оно замеряется, только если задан
+// ScanOptions::timePhases
+struct ScanStats {
+    // Папки, которые удалось открыть, и прочитанные в них записи (файлы, подпапки, ссылки)
+    uint64_t dirsOpened = 0;
+    uint64_t entriesRead = 0;
+    // Запросы атрибутов файлов и папок к файловой системе
+    uint64_t statCalls = 0;
+    // Учтенные файлы и сумма их размеров
+    uint64_t filesCounted = 0;
+    uint64_t bytesSummed = 0;
+    // Проверки подпапок по правилам исключения и подпапки, которые не читались:
+    // исключенные при pruneExcluded, на другом томе, ссылки и повторные пути к папке
+    uint64_t excludeChecks = 0;
+    uint64_t dirsPruned = 0;
+    uint64_t mountsSkipped = 0;
+    uint64_t linksSkipped = 0;
+    // Ошибки по типу: нет доступа, файл или папка исчезли во время обхода, прочие
+    uint64_t permissionErrors = 0;
+    uint64_t notFoundErrors = 0;
+    uint64_t otherErrors = 0;
+    // Время в секундах: чтение папок, запросы атрибутов, проверки исключений
+    double enumerateTime = 0;
+    double statTime = 0;
+    double excludeTime = 0;
+    // Обратные вызовы, сборка дерева и все сканирование целиком; замеряются всегда
+    double callbackTime = 0;
+    double treeTime = 0;
+    double wallTime = 0;
+};
+
+// Обратные вызовы во время сканирования. Вызываются пачками из потока,
+// который запустил сканирование: не реже раза в intervalMs или как только
+// набралось batchSize найденных папок.
+struct ScanCallbacks {
+    std::function<void(const ScanProgress&)> onProgress;
+    std::function<void(const std::vector<FolderInfo>&)> onFoldersFound;
+    unsigned intervalMs = 100;
+    size_t batchSize = 256;
+};
+
+// Флаг отмены сканирования, который можно выставить из другого потока.
+// Обход проверяет его на каждой записи папки.
+class CancellationToken {
+public:
+    void cancel() { cancelled_.store(true); }
+    bool isCancelled() const { return cancelled_.load(std::memory_order_relaxed); }
+
+private:
+    std::atomic<bool> cancelled_{false};
+};
+
+// Полное дерево папок в виде параллельных массивов, узлы в порядке обхода в глубину:
+// узел 0 — корень, родитель всегда раньше потомков, а поддерево каждой папки
+// занимает непрерывный диапазон номеров. Каждое различное имя папки хранится
+// один раз, а полный путь собирается по цепочке родителей только по запросу.
+struct DirTree {
+    std::vector<int32_t> parents;
+    // Номер имени папки в names
+    std::vector<uint32_t> nameIds;
+    // Различные имена папок в UTF-8; первое — полный путь корня
+    std::vector<std::string> names;
+    std::vector<uint64_t> sizes;
+    std::vector<uint64_t> allocated;
+    // Количество файлов во всем поддереве
+    std::vector<uint64_t> fileCounts;
+    // Время изменения папки в наносекундах от начала эпохи Unix
+    std::vector<int64_t> mtimes;
+    // Размеры по классам файлов, kFileClasses значений на узел подряд;
+    // заполняется, только если задан ScanOptions::fileClasses
+    std::vector<uint64_t> classSizes;
+    // Размеры по корзинам возраста, kAgeBuckets значений на узел подряд, и время
+    // изменения самого нового файла поддерева (0 — файлов нет);
+    // заполняются, только если задан ScanOptions::fileAges
+    std::vector<uint64_t> ageSizes;
+    std::vector<int64_t> newestMtimes;
+
+    // Имя папки; у корня — полный путь
+    const std::string& name(size_t node) const { return names[nameIds[node]]; }
+    // Полный путь папки в UTF-8
+    std::string path(size_t node) const;
+};
+
+// Правила исключения папок, разобранные один раз перед обходом. Правило — точное
+// имя папки ("AppData"), шаблон имени с * и ? ("*.tmp", "cache*") или абсолютный
+// путь ("C:\\Windows", "/proc"), который исключает ровно эту папку. Регистр
+// латинских букв не учитывается, исключение наследуется всеми подпапками.
+class ExcludeMatcher {
+public:
+    explicit ExcludeMatcher(const std::set<std::string>& patterns);
+
+    bool hasPathRules() const { return !paths_.empty(); }
+    // Имена подпапок папки dirPath (UTF-8), исключенных правилами-путями, или nullptr.
+    // Вычисляется один раз на папку, а не для каждой её записи
+    const std::unordered_set<std::string>* pathRulesIn(const std::string& dirPath) const;
+    // Исключена ли подпапка с именем name (UTF-8); pathRules — результат pathRulesIn для родителя
+    bool matches(const std::string& name,
+                 const std::unordered_set<std::string>* pathRules = nullptr) const;
+    // Исключена ли папка по полному пути: она сама или любой из её предков
+    bool excludes(const std::string& path) const;
+
+private:
+    std::unordered_set<std::string> names_;
+    std::vector<std::string> globs_;
+    // Папка -> имена исключенных в ней подпапок, по правилам-путям
+    std::unordered_map<std::string, std::unordered_set<std::string>> paths_;
+};
+
+struct ScanOptions {
+    // Количество потоков обхода, 0 — по числу ядер процессора
+    unsigned threads = 1;
+    std::shared_ptr<CancellationToken> cancelToken;
+    // Файл с несколькими жесткими ссылками учитывается один раз — в первой папке,
+    // где его встретил обход
+    bool dedupeHardLinks = false;
+    // Сохранить в результате дерево всех папок, а не только крупные
+    bool collectTree = false;
+    // Вернуть только topK самых больших папок, 0 — все папки крупнее порога.
+    // Найденные папки тогда не передаются в onFoldersFound во время обхода
+    size_t topK = 0;
+    // Не показывать папку, если без своей самой большой показанной подпапки
+    // она не превышает порог: родитель и его единственная крупная подпапка
+    // не попадают в результат вместе
+    bool excludeNested = false;
+    // Собрать столько самых больших файлов (вне исключенных папок), 0 — не собирать
+    size_t largestFiles = 0;
+    // Собрать распределение всех файлов по размеру
+    bool sizeHistogram = false;
+    // Разбить размер каждой папки по классам файлов (видео, архивы, журналы, программы)
+    bool fileClasses = false;
+    // Разбить размер каждой папки по возрасту файлов и найти самый новый файл в ней
+    bool fileAges = false;
+    // Не читать исключенные папки вовсе: их размер не входит в размер родителя.
+    // По умолчанию исключенные папки обходятся и только не попадают в результат
+    bool pruneExcluded = false;
+    // Не выходить за пределы тома корня: подключенные внутри него тома и сетевые
+    // папки не читаются и перечисляются в ScanResult::skippedMounts
+    bool oneFileSystem = false;
+    // Заходить в папки по символическим ссылкам и точкам соединения (junction).
+    // Каждая папка читается один раз, поэтому зацикленные ссылки и повторные
+    // пути к одной папке пропускаются
+    bool followLinks = false;
+    // Замерять время этапов в ScanResult::stats. Часы читаются на каждом файле,
+    // поэтому без необходимости замер лучше не включать
+    bool timePhases = false;
+};
+
+struct ScanResult {
+    // Только папки, которые успели обойти полностью
+    std::vector<FolderInfo> folders;
+    uint64_t totalSize = 0;
+    uint64_t totalAllocated = 0;
+    // Заполняется, только если задан ScanOptions::collectTree
+    DirTree tree;
+    // По убыванию размера; заполняется, только если задан ScanOptions::largestFiles
+    std::vector<FileInfo> largestFiles;
+    // Заполняется, только если задан ScanOptions::sizeHistogram
+    SizeHistogram histogram;
+    // Точки монтирования, в которые сканирование не зашло из-за
+    // ScanOptions::oneFileSystem, по алфавиту
+    std::vector<std::string> skippedMounts;
+    ScanStats stats;
+    // false, если сканирование было отменено и результаты неполные
+    bool complete = true;
 };
 
 class FolderSearch {
 public:
-    static uint64_t getFolderSize(const std::string& folderPath);
+    // threads: количество потоков обхода, 0 — по числу ядер процессора
+    static uint64_t getFolderSize(const std::string& folderPath, unsigned threads = 1);
     static std::vector<FolderInfo> findLargeFolders(
         const std::string& rootPath,
         uint64_t sizeThresholdMb,
-        const std::set<std::string>& excludeDirs
+        const std::set<std::string>& excludeDirs,
+        unsigned threads = 1,
+        const ScanCallbacks& callbacks = ScanCallbacks(),
+        size_t topK = 0,
+        bool excludeNested = false
+    );
+    static ScanResult scanFolders(
+        const std::string& rootPath,
+        uint64_t sizeThresholdMb,
+        const std::set<std::string>& excludeDirs,
+        const ScanOptions& options = ScanOptions(),
+        const ScanCallbacks& callbacks = ScanCallbacks()
     );
     static bool isExcluded(const std::string& path, const std::set<std::string>& excludeDirs);
     static uint64_t countFolders(const std::string& rootPath, const std::set<std::string>& excludeDirs);
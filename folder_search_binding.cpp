@@ -4,14 +4,260 @@
 
 namespace py = pybind11;
 
+namespace {
+
+// Колбэки создаются и уничтожаются под GIL, сам обход идет без него.
+// Python-объекты захватываются по ссылке, чтобы не трогать счетчики ссылок без GIL.
+ScanCallbacks makeCallbacks(const py::object& progressCallback, const py::object& folderCallback,
+                            unsigned intervalMs, size_t batchSize) {
+    ScanCallbacks callbacks;
+    callbacks.intervalMs = intervalMs;
+    callbacks.batchSize = batchSize;
+    if (!progressCallback.is_none()) {
+        callbacks.onProgress = [&progressCallback](const ScanProgress& progress) {
+            py::gil_scoped_acquire gil;
+            progressCallback(progress);
+        };
+    }
+    if (!folderCallback.is_none()) {
+        callbacks.onFoldersFound = [&folderCallback](const std::vector<FolderInfo>& folders) {
+            py::gil_scoped_acquire gil;
+            folderCallback(folders);
+        };
+    }
+    return callbacks;
+}
+
+// Колонка DirTree, отданная в Python без копирования. Держит ссылку на дерево,
+// поэтому memoryview над колонкой остается верным, пока существует сам
+struct ColumnView {
+    py::object owner;
+    const void* data;
+    py::ssize_t size;
+    py::ssize_t itemSize;
+    std::string format;
+};
+
+template <typename T>
+py::memoryview columnView(const py::object& tree, std::vector<T> DirTree::*member) {
+    const std::vector<T>& column = tree.cast<const DirTree&>().*member;
+    return py::memoryview(py::cast(ColumnView{
+        tree, column.data(), static_cast<py::ssize_t>(column.size()),
+        static_cast<py::ssize_t>(sizeof(T)), py::format_descriptor<T>::format()}));
+}
+
+} // namespace
+
 PYBIND11_MODULE(folder_search_cpp, m) {
     py::class_<FolderInfo>(m, "FolderInfo")
         .def(py::init<>())
         .def_readwrite("path", &FolderInfo::path)
-        .def_readwrite("size", &FolderInfo::size);
+        .def_readwrite("size", &FolderInfo::size)
+        .def_readwrite("allocated_size", &FolderInfo::allocatedSize)
+        .def_readwrite("class_sizes", &FolderInfo::classSizes)
+        .def_readwrite("age_sizes", &FolderInfo::ageSizes)
+        .def_readwrite("newest_mtime", &FolderInfo::newestMtime);
+
+    // Имена классов в порядке FileClass
+    m.attr("FILE_CLASSES") = py::make_tuple("video", "archive", "log", "binary", "other");
+    // Границы корзин возраста в днях; корзин на одну больше
+    py::tuple ageBucketDays(kAgeBuckets - 1);
+    for (size_t i = 0; i < kAgeBuckets - 1; ++i) {
+        ageBucketDays[i] = kAgeBucketDays[i];
+    }
+    m.attr("AGE_BUCKET_DAYS") = ageBucketDays;
+
+    py::class_<FileInfo>(m, "FileInfo")
+        .def(py::init<>())
+        .def_readwrite("path", &FileInfo::path)
+        .def_readwrite("size", &FileInfo::size)
+        .def_readwrite("allocated_size", &FileInfo::allocatedSize);
+
+    py::class_<SizeHistogram>(m, "SizeHistogram")
+        .def_readonly("counts", &SizeHistogram::counts)
+        .def_readonly("bytes", &SizeHistogram::bytes);
+
+    py::class_<ScanProgress>(m, "ScanProgress")
+        .def_readonly("dirs_scanned", &ScanProgress::dirsScanned)
+        .def_readonly("files_scanned", &ScanProgress::filesScanned)
+        .def_readonly("bytes_scanned", &ScanProgress::bytesScanned);
+
+    py::class_<ScanStats>(m, "ScanStats")
+        .def_readonly("dirs_opened", &ScanStats::dirsOpened)
+        .def_readonly("entries_read", &ScanStats::entriesRead)
+        .def_readonly("stat_calls", &ScanStats::statCalls)
+        .def_readonly("files_counted", &ScanStats::filesCounted)
+        .def_readonly("bytes_summed", &ScanStats::bytesSummed)
+        .def_readonly("exclude_checks", &ScanStats::excludeChecks)
+        .def_readonly("dirs_pruned", &ScanStats::dirsPruned)
+        .def_readonly("mounts_skipped", &ScanStats::mountsSkipped)
+        .def_readonly("links_skipped", &ScanStats::linksSkipped)
+        .def_readonly("permission_errors", &ScanStats::permissionErrors)
+        .def_readonly("not_found_errors", &ScanStats::notFoundErrors)
+        .def_readonly("other_errors", &ScanStats::otherErrors)
+        .def_readonly("enumerate_time", &ScanStats::enumerateTime)
+        .def_readonly("stat_time", &ScanStats::statTime)
+        .def_readonly("exclude_time", &ScanStats::excludeTime)
+        .def_readonly("callback_time", &ScanStats::callbackTime)
+        .def_readonly("tree_time", &ScanStats::treeTime)
+        .def_readonly("wall_time", &ScanStats::wallTime);
+
+    py::class_<ColumnView>(m, "_ColumnView", py::buffer_protocol())
+        .def_buffer([](ColumnView& column) {
+            return py::buffer_info(const_cast<void*>(column.data), column.itemSize, column.format,
+                                   1, {column.size}, {column.itemSize}, true);
+        });
+
+    // Колонки узлов — memoryview над массивами дерева, names — список различных имен
+    py::class_<DirTree>(m, "DirTree")
+        .def_property_readonly("parents", [](const py::object& tree) {
+            return columnView(tree, &DirTree::parents);
+        })
+        .def_property_readonly("name_ids", [](const py::object& tree) {
+            return columnView(tree, &DirTree::nameIds);
+        })
+        .def_readonly("names", &DirTree::names)
+        .def_property_readonly("sizes", [](const py::object& tree) {
+            return columnView(tree, &DirTree::sizes);
+        })
+        .def_property_readonly("allocated", [](const py::object& tree) {
+            return columnView(tree, &DirTree::allocated);
+        })
+        .def_property_readonly("file_counts", [](const py::object& tree) {
+            return columnView(tree, &DirTree::fileCounts);
+        })
+        .def_property_readonly("mtimes", [](const py::object& tree) {
+            return columnView(tree, &DirTree::mtimes);
+        })
+        .def_property_readonly("class_sizes", [](const py::object& tree) {
+            return columnView(tree, &DirTree::classSizes);
+        })
+        .def_property_readonly("age_sizes", [](const py::object& tree) {
+            return columnView(tree, &DirTree::ageSizes);
+        })
+        .def_property_readonly("newest_mtimes", [](const py::object& tree) {
+            return columnView(tree, &DirTree::newestMtimes);
+        })
+        .def("name", &DirTree::name, "Folder name; the root has its full path", py::arg("node"))
+        .def("path", &DirTree::path, "Full folder path rebuilt from the parent chain",
+             py::arg("node"));
+
+    py::class_<ScanResult>(m, "ScanResult")
+        .def_readonly("folders", &ScanResult::folders)
+        .def_readonly("total_size", &ScanResult::totalSize)
+        .def_readonly("total_allocated", &ScanResult::totalAllocated)
+        .def_readonly("tree", &ScanResult::tree)
+        .def_readonly("largest_files", &ScanResult::largestFiles)
+        .def_readonly("size_histogram", &ScanResult::histogram)
+        .def_readonly("skipped_mounts", &ScanResult::skippedMounts)
+        .def_readonly("stats", &ScanResult::stats)
+        .def_readonly("complete", &ScanResult::complete);
+
+    py::class_<CancellationToken, std::shared_ptr<CancellationToken>>(m, "CancellationToken")
+        .def(py::init<>())
+        .def("cancel", &CancellationToken::cancel, "Request the scan to stop as soon as possible")
+        .def_property_readonly("cancelled", &CancellationToken::isCancelled);
 
-    m.def("get_folder_size", &FolderSearch::getFolderSize, "Get size of a folder in bytes");
-    m.def("find_large_folders", &FolderSearch::findLargeFolders, "Find large folders");
-    m.def("is_excluded", &FolderSearch::isExcluded, "Check if path should be excluded");
-    m.def("count_folders", &FolderSearch::countFolders, "Count total folders for progress bar");
+    // Обход идет без GIL; обратные вызовы захватывают GIL только на время вызова
+    m.def("get_folder_size", &FolderSearch::getFolderSize,
+          "Get size of a folder in bytes",
+          py::arg("folder_path"), py::arg("threads") = 1,
+          py::call_guard<py::gil_scoped_release>());
+    m.def("find_large_folders",
+          [](const std::string& rootPath, uint64_t sizeThresholdMb,
+             const std::set<std::string>& excludeDirs, unsigned threads,
+             py::object progressCallback, py::object folderCallback,
+             unsigned intervalMs, size_t batchSize, size_t topK, bool excludeNested) {
+              ScanCallbacks callbacks = makeCallbacks(
+                  progressCallback, folderCallback, intervalMs, batchSize);
+              py::gil_scoped_release release;
+              return FolderSearch::findLargeFolders(
+                  rootPath, sizeThresholdMb, excludeDirs, threads, callbacks,
+                  topK, excludeNested);
+          },
+          "Find large folders in a single pass; threads=0 uses all CPU cores. "
+          "progress_callback(ScanProgress) and folder_callback(list[FolderInfo]) "
+          "are called in batches every interval_ms or batch_size found folders. "
+          "top_k > 0 returns only the K largest folders (folder_callback is then "
+          "not called); exclude_nested=True drops a folder that is above the "
+          "threshold only because of its largest listed subfolder",
+          py::arg("root_path"), py::arg("size_threshold_mb"), py::arg("exclude_dirs"),
+          py::arg("threads") = 1,
+          py::arg("progress_callback") = py::none(),
+          py::arg("folder_callback") = py::none(),
+          py::arg("interval_ms") = 100,
+          py::arg("batch_size") = 256,
+          py::arg("top_k") = 0,
+          py::arg("exclude_nested") = false);
+    m.def("scan_folders",
+          [](const std::string& rootPath, uint64_t sizeThresholdMb,
+             const std::set<std::string>& excludeDirs, unsigned threads,
+             std::shared_ptr<CancellationToken> cancelToken, bool dedupeHardLinks,
+             bool collectTree, py::object progressCallback, py::object folderCallback,
+             unsigned intervalMs, size_t batchSize, size_t topK, bool excludeNested,
+             size_t largestFiles, bool sizeHistogram, bool fileClasses, bool pruneExcluded,
+             bool oneFileSystem, bool followLinks, bool timePhases, bool fileAges) {
+              ScanOptions options;
+              options.threads = threads;
+              options.cancelToken = std::move(cancelToken);
+              options.dedupeHardLinks = dedupeHardLinks;
+              options.collectTree = collectTree;
+              options.topK = topK;
+              options.excludeNested = excludeNested;
+              options.largestFiles = largestFiles;
+              options.sizeHistogram = sizeHistogram;
+              options.fileClasses = fileClasses;
+              options.pruneExcluded = pruneExcluded;
+              options.oneFileSystem = oneFileSystem;
+              options.followLinks = followLinks;
+              options.timePhases = timePhases;
+              options.fileAges = fileAges;
+              ScanCallbacks callbacks = makeCallbacks(
+                  progressCallback, folderCallback, intervalMs, batchSize);
+              py::gil_scoped_release release;
+              return FolderSearch::scanFolders(
+                  rootPath, sizeThresholdMb, excludeDirs, options, callbacks);
+          },
+          "Like find_large_folders, but returns a ScanResult and can be stopped "
+          "from another thread with cancel_token.cancel(); a cancelled scan "
+          "returns only fully scanned folders and complete=False. "
+          "dedupe_hard_links=True counts a hard-linked file only once; "
+          "collect_tree=True also returns every folder as a DirTree; "
+          "largest_files=N collects the N largest files outside excluded folders "
+          "and size_histogram=True a log2 size histogram in the same pass; "
+          "file_classes=True splits every folder size by FILE_CLASSES "
+          "(FolderInfo.class_sizes, DirTree.class_sizes with len(FILE_CLASSES) values per folder); "
+          "prune_excluded=True skips excluded folders entirely instead of only "
+          "leaving them out of the result; "
+          "one_file_system=True stays on the root's volume and lists the mount points "
+          "it did not enter in skipped_mounts; follow_links=True enters symlinked "
+          "folders and junctions, reading every folder once so link loops are skipped; "
+          "ScanResult.stats counts opened folders, entries, stat calls and errors, "
+          "time_phases=True also times reading, stat calls and exclusion checks; "
+          "file_ages=True splits every folder size by file age (AGE_BUCKET_DAYS, counted "
+          "from the scan start) and finds its newest file (age_sizes, newest_mtime in ns)",
+          py::arg("root_path"), py::arg("size_threshold_mb"), py::arg("exclude_dirs"),
+          py::arg("threads") = 1,
+          py::arg("cancel_token") = nullptr,
+          py::arg("dedupe_hard_links") = false,
+          py::arg("collect_tree") = false,
+          py::arg("progress_callback") = py::none(),
+          py::arg("folder_callback") = py::none(),
+          py::arg("interval_ms") = 100,
+          py::arg("batch_size") = 256,
+          py::arg("top_k") = 0,
+          py::arg("exclude_nested") = false,
+          py::arg("largest_files") = 0,
+          py::arg("size_histogram") = false,
+          py::arg("file_classes") = false,
+          py::arg("prune_excluded") = false,
+          py::arg("one_file_system") = false,
+          py::arg("follow_links") = false,
+          py::arg("time_phases") = false,
+          py::arg("file_ages") = false);
+    m.def("is_excluded", &FolderSearch::isExcluded,
+          "Check if a path or any of its parents matches the exclusion patterns: "
+          "folder names, globs with * and ?, or absolute paths, case-insensitive");
+    m.def("count_folders", &FolderSearch::countFolders, "Count total folders for progress bar",
+          py::call_guard<py::gil_scoped_release>());
 }
@@ -0,0 +1,561 @@
+"""
+Слежение за изменениями в просканированной папке.
+
+После сканирования дерево размеров держится в памяти, а события файловой системы
+превращаются в изменения размеров отдельных папок, которые поднимаются к предкам.
+Так размеры найденных папок остаются актуальными без повторного сканирования.
+
+События поставляет бэкенд (WatchBackend): inotify на Linux и опрос времени изменения
+папок там, где inotify нет, в том числе на Windows. Бэкенда на ReadDirectoryChangesW
+пока нет, поэтому на Windows изменения замечаются с задержкой опроса, а запись
+в существующие файлы (дописанный журнал, растущий образ диска) не замечается вовсе:
+время изменения папки от неё не меняется.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from enum import Enum
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+try:
+    import folder_search_cpp as _scanner
+except ImportError:
+    import folder_scanner as _scanner
+from folder_scanner import ExcludeMatcher, FolderInfo
+
+# Порог, который не превысит ни одна папка: от сканера нужно только дерево
+_NO_FOLDERS_MB = 2**40
+
+
+class ChangeKind(Enum):
+    CREATED = "created"
+    DELETED = "deleted"
+    MODIFIED = "modified"
+    MOVED_FROM = "moved_from"
+    MOVED_TO = "moved_to"
+    # Часть событий потеряна, дерево нужно сверить с диском целиком
+    OVERFLOW = "overflow"
+
+
+@dataclass
+class WatchEvent:
+    """Изменение элемента name в папке directory (пустое имя — изменилась сама папка)"""
+    kind: ChangeKind
+    directory: Optional['SizeNode'] = None
+    name: str = ''
+    is_dir: bool = False
+    # Связывает MOVED_FROM и MOVED_TO одного перемещения
+    cookie: int = 0
+
+
+class SizeNode:
+    """Папка в дереве размеров: собственные файлы и итоги по всему поддереву"""
+    __slots__ = ('name', 'parent', 'children', 'own_size', 'own_allocated', 'own_files',
+                 'size', 'allocated', 'files', 'watch')
+
+    def __init__(self, name: str, parent: Optional['SizeNode'] = None):
+        self.name = name
+        self.parent = parent
+        self.children: Dict[str, SizeNode] = {}
+        self.own_size = 0
+        self.own_allocated = 0
+        self.own_files = 0
+        self.size = 0
+        self.allocated = 0
+        self.files = 0
+        # Данные бэкенда слежения для этой папки
+        self.watch = None
+
+    def path(self) -> str:
+        parts = []
+        node = self
+        while node.parent is not None:
+            parts.append(node.name)
+            node = node.parent
+        return os.path.join(node.name, *reversed(parts))
+
+    def walk(self) -> Iterator['SizeNode']:
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(node.children.values())
+
+
+class SizeTree:
+    """
+    Изменяемое дерево размеров папок.
+
+    Все изменения сводятся к изменению собственных итогов папки, разница которых
+    прибавляется ко всем предкам. Папки, итоги которых поменялись, и удаленные
+    папки накапливаются до вызова take_changes.
+
+    Новые папки добавляются с теми же исключениями и ограничением одним томом,
+    что и при сканировании, поэтому исключенные папки не появляются в дереве
+    и после изменений в их родителе.
+    """
+
+    def __init__(self, root: SizeNode, exclude_dirs: Iterable[str] = (), one_file_system: bool = False):
+        """
+        Args:
+            exclude_dirs: Исключения сканирования, по которому построено дерево
+            one_file_system (bool): Не добавлять папки, подключенные с других томов
+        """
+        self.root = root
+        self.exclude_dirs = set(exclude_dirs)
+        self.one_file_system = one_file_system
+        self._excluder = ExcludeMatcher(self.exclude_dirs)
+        self._changed: Set[SizeNode] = set()
+        self._removed: List[str] = []
+        self._detached: List[SizeNode] = []
+
+    @classmethod
+    def from_columns(cls, parents, names, sizes, allocated, file_counts, **options) -> 'SizeTree':
+        """
+        Строит дерево из параллельных списков в порядке обхода в глубину,
+        как в DirTree: у корня родитель -1, а имя — полный путь.
+        options передаются в конструктор.
+        """
+        nodes: List[SizeNode] = []
+        for i, parent in enumerate(parents):
+            node = SizeNode(names[i], nodes[parent] if parent >= 0 else None)
+            node.size = node.own_size = sizes[i]
+            node.allocated = node.own_allocated = allocated[i]
+            node.files = node.own_files = file_counts[i]
+            if node.parent is not None:
+                parent_node = node.parent
+                parent_node.children[node.name] = node
+                parent_node.own_size -= node.size
+                parent_node.own_allocated -= node.allocated
+                parent_node.own_files -= node.files
+            nodes.append(node)
+        return cls(nodes[0], **options)
+
+    @classmethod
+    def from_dir_tree(cls, tree, **options) -> 'SizeTree':
+        """Строит дерево из ScanResult.tree любого из сканеров."""
+        # Узлы с одинаковыми именами получают один и тот же объект строки
+        names = tree.names
+        return cls.from_columns(tree.parents, [names[name_id] for name_id in tree.name_ids],
+                                tree.sizes, tree.allocated, tree.file_counts, **options)
+
+    @classmethod
+    def from_index(cls, index, node: int, **options) -> 'SizeTree':
+        """Строит дерево из поддерева узла node индекса dir_index.DirIndex."""
+        end = index.ends[node]
+        parents = [-1] + [index.parents[i] - node for i in range(node + 1, end)]
+        names = [index.path(node)] + [index.name(i) for i in range(node + 1, end)]
+        return cls.from_columns(parents, names, index.sizes[node:end].tolist(),
+                                index.allocated[node:end].tolist(),
+                                index.file_counts[node:end].tolist(), **options)
+
+    def contains(self, node: SizeNode) -> bool:
+        """Проверяет, что папка все еще в дереве, а не в удаленном поддереве."""
+        while node.parent is not None:
+            node = node.parent
+        return node is self.root
+
+    def _add_delta(self, node: Optional[SizeNode], size: int, allocated: int, files: int) -> None:
+        if not (size or allocated or files):
+            return
+        while node is not None:
+            node.size += size
+            node.allocated += allocated
+            node.files += files
+            self._changed.add(node)
+            node = node.parent
+
+    def detach(self, node: SizeNode) -> None:
+        """Убирает поддерево из дерева и вычитает его итоги из предков."""
+        parent = node.parent
+        self._removed.append(node.path())
+        self._detached.append(node)
+        del parent.children[node.name]
+        node.parent = None
+        self._add_delta(parent, -node.size, -node.allocated, -node.files)
+
+    def attach(self, node: SizeNode, parent: SizeNode, name: str) -> None:
+        """Вставляет поддерево под parent, заменяя одноименную папку."""
+        existing = parent.children.get(name)
+        if existing is not None:
+            self.detach(existing)
+        node.name = name
+        node.parent = parent
+        parent.children[name] = node
+        self._changed.update(node.walk())
+        self._add_delta(parent, node.size, node.allocated, node.files)
+
+    def move(self, source: SizeNode, source_name: str, target: SizeNode, target_name: str) -> bool:
+        """Переносит подпапку без повторного обхода. False, если её нет в дереве."""
+        node = source.children.get(source_name)
+        if node is None:
+            return False
+        del source.children[source_name]
+        node.parent = None
+        self._removed.append(os.path.join(source.path(), source_name))
+        self._add_delta(source, -node.size, -node.allocated, -node.files)
+        self.attach(node, target, target_name)
+        return True
+
+    def refresh(self, node: SizeNode) -> List[SizeNode]:
+        """
+        Перечитывает одну папку: итоги по её файлам и список подпапок.
+        Исчезнувшие подпапки удаляются, новые сканируются целиком.
+
+        Returns:
+            List[SizeNode]: Корни добавленных поддеревьев
+        """
+        path = node.path()
+        size = allocated = files = 0
+        subdirs = set()
+        path_rules = self._excluder.path_rules_in(path) if self._excluder.has_path_rules else None
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            # Исключенные при сканировании папки в дерево не входят
+                            if not self._excluder.matches(entry.name, path_rules):
+                                subdirs.add(entry.name)
+                        elif entry.is_file(follow_symlinks=False):
+                            st = entry.stat(follow_symlinks=False)
+                            size += st.st_size
+                            # st_blocks есть только на POSIX, на Windows считаем по размеру
+                            blocks = getattr(st, 'st_blocks', None)
+                            allocated += st.st_size if blocks is None else blocks * 512
+                            files += 1
+                    except OSError:
+                        continue
+        except OSError:
+            # Папка удалена: её саму уберет событие в родительской папке
+            pass
+
+        self._add_delta(node, size - node.own_size, allocated - node.own_allocated,
+                        files - node.own_files)
+        node.own_size, node.own_allocated, node.own_files = size, allocated, files
+
+        for name in [name for name in node.children if name not in subdirs]:
+            self.detach(node.children[name])
+        added = []
+        for name in subdirs:
+            if name not in node.children:
+                subdir = os.path.join(path, name)
+                if self.one_file_system and os.path.ismount(subdir):
+                    continue
+                subtree = self.from_dir_tree(_scanner.scan_folders(
+                    subdir, _NO_FOLDERS_MB, self.exclude_dirs, collect_tree=True,
+                    prune_excluded=True, one_file_system=self.one_file_system).tree)
+                self.attach(subtree.root, node, name)
+                added.append(subtree.root)
+        return added
+
+    def take_changes(self):
+        """
+        Забирает накопленные изменения.
+
+        Returns:
+            Папки с новыми размерами (List[FolderInfo], кроме корня),
+            пути исчезнувших папок (List[str], включая старые пути перемещенных)
+            и корни удаленных поддеревьев (List[SizeNode])
+        """
+        changed = [FolderInfo(node.path(), node.size, node.allocated)
+                   for node in self._changed
+                   if node is not self.root and self.contains(node)]
+        removed, detached = self._removed, self._detached
+        self._changed = set()
+        self._removed = []
+        self._detached = []
+        return changed, removed, detached
+
+
+class WatchBackend:
+    """Источник событий файловой системы для FolderWatcher"""
+
+    def add_watch(self, node: SizeNode) -> None:
+        """Начинает следить за содержимым папки (без подпапок)."""
+        raise NotImplementedError
+
+    def remove_watch(self, node: SizeNode) -> None:
+        raise NotImplementedError
+
+    def read_events(self, timeout: float) -> List[WatchEvent]:
+        """Ждет события не дольше timeout секунд."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyBackend(WatchBackend):
+    """События inotify на Linux: по одному наблюдению на каждую папку дерева"""
+
+    _IN_MODIFY = 0x00000002
+    _IN_ATTRIB = 0x00000004
+    _IN_MOVED_FROM = 0x00000040
+    _IN_MOVED_TO = 0x00000080
+    _IN_CREATE = 0x00000100
+    _IN_DELETE = 0x00000200
+    _IN_Q_OVERFLOW = 0x00004000
+    _IN_IGNORED = 0x00008000
+    _IN_ONLYDIR = 0x01000000
+    _IN_DONT_FOLLOW = 0x02000000
+    _IN_EXCL_UNLINK = 0x04000000
+    _IN_ISDIR = 0x40000000
+    _IN_NONBLOCK = os.O_NONBLOCK
+    _IN_CLOEXEC = 0o2000000
+
+    _MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+             | _IN_ONLYDIR | _IN_DONT_FOLLOW | _IN_EXCL_UNLINK)
+    _EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError(errno.ENOSYS, "libc не найдена")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(self._IN_NONBLOCK | self._IN_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._nodes: Dict[int, SizeNode] = {}
+
+    def add_watch(self, node: SizeNode) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(node.path()), self._MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), node.path())
+        node.watch = wd
+        self._nodes[wd] = node
+
+    def remove_watch(self, node: SizeNode) -> None:
+        if node.watch is None:
+            return
+        if self._nodes.pop(node.watch, None) is node:
+            self._libc.inotify_rm_watch(self._fd, node.watch)
+        node.watch = None
+
+    def read_events(self, timeout: float) -> List[WatchEvent]:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & self._IN_Q_OVERFLOW:
+                events.append(WatchEvent(ChangeKind.OVERFLOW))
+                continue
+            if mask & self._IN_IGNORED:
+                # Папка удалена, ядро само сняло наблюдение
+                node = self._nodes.pop(wd, None)
+                if node is not None:
+                    node.watch = None
+                continue
+            node = self._nodes.get(wd)
+            if node is None:
+                continue
+            if mask & self._IN_CREATE:
+                kind = ChangeKind.CREATED
+            elif mask & self._IN_DELETE:
+                kind = ChangeKind.DELETED
+            elif mask & self._IN_MOVED_FROM:
+                kind = ChangeKind.MOVED_FROM
+            elif mask & self._IN_MOVED_TO:
+                kind = ChangeKind.MOVED_TO
+            else:
+                kind = ChangeKind.MODIFIED
+            events.append(WatchEvent(kind, node, name, bool(mask & self._IN_ISDIR), cookie))
+        return events
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+        self._nodes = {}
+
+
+class PollingBackend(WatchBackend):
+    """
+    Периодически сверяет время изменения папок. Работает на любой системе,
+    но замечает только добавление, удаление и переименование элементов,
+    а не запись в существующие файлы.
+    """
+
+    def __init__(self, interval: float = 30.0):
+        self.interval = interval
+        self._mtimes: Dict[SizeNode, int] = {}
+        self._next_poll = time.monotonic() + interval
+
+    @staticmethod
+    def _mtime(node: SizeNode) -> int:
+        try:
+            return os.lstat(node.path()).st_mtime_ns
+        except OSError:
+            return 0
+
+    def add_watch(self, node: SizeNode) -> None:
+        self._mtimes[node] = self._mtime(node)
+
+    def remove_watch(self, node: SizeNode) -> None:
+        self._mtimes.pop(node, None)
+
+    def read_events(self, timeout: float) -> List[WatchEvent]:
+        remaining = self._next_poll - time.monotonic()
+        if remaining > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(remaining, 0))
+        self._next_poll = time.monotonic() + self.interval
+
+        events = []
+        for node, mtime in list(self._mtimes.items()):
+            current = self._mtime(node)
+            if current != mtime:
+                self._mtimes[node] = current
+                events.append(WatchEvent(ChangeKind.MODIFIED, node))
+        return events
+
+
+def create_backend() -> WatchBackend:
+    """Выбирает лучший доступный бэкенд для текущей системы."""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyBackend()
+        except OSError as e:
+            print(f"inotify недоступен, используется опрос: {e}")
+    return PollingBackend()
+
+
+class FolderWatcher:
+    """
+    Поддерживает размеры папок дерева в актуальном состоянии.
+
+    События копятся debounce секунд, после чего каждая затронутая папка
+    перечитывается один раз, а перемещения папок внутри дерева переносят
+    поддерево без повторного обхода. Изменившиеся размеры передаются
+    в on_change из фонового потока: (List[FolderInfo], List[str] удаленных путей).
+    Жесткие ссылки в перечитанных папках учитываются в каждой папке.
+    """
+
+    def __init__(self, tree: SizeTree,
+                 on_change: Callable[[List[FolderInfo], List[str]], None],
+                 backend: Optional[WatchBackend] = None, debounce: float = 1.0):
+        self.tree = tree
+        self.on_change = on_change
+        self.backend = backend
+        self.debounce = debounce
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="FolderWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _watch(self, root: SizeNode, strict: bool = False) -> None:
+        """
+        Args:
+            strict (bool): Пробросить ошибку исчерпания лимита наблюдений
+        """
+        for node in root.walk():
+            try:
+                self.backend.add_watch(node)
+            except OSError as e:
+                if strict and e.errno == errno.ENOSPC:
+                    raise
+                # Недоступная папка: её размер обновится при изменении родителя
+                continue
+
+    def _unwatch(self, root: SizeNode) -> None:
+        for node in root.walk():
+            self.backend.remove_watch(node)
+
+    def _start_backend(self) -> None:
+        if self.backend is None:
+            self.backend = create_backend()
+        try:
+            self._watch(self.tree.root, strict=True)
+        except OSError as e:
+            # Исчерпан лимит fs.inotify.max_user_watches
+            print(f"Слишком много папок для inotify, используется опрос: {e}")
+            self.backend.close()
+            for node in self.tree.root.walk():
+                node.watch = None
+            self.backend = PollingBackend()
+            self._watch(self.tree.root)
+
+    def _run(self) -> None:
+        try:
+            self._start_backend()
+            pending: List[WatchEvent] = []
+            deadline = None
+            while not self._stop.is_set():
+                timeout = 0.5 if deadline is None else max(0.0, min(0.5, deadline - time.monotonic()))
+                events = self.backend.read_events(timeout)
+                if events:
+                    pending.extend(events)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.debounce
+                if pending and time.monotonic() >= deadline:
+                    self._apply(pending)
+                    pending = []
+                    deadline = None
+        except Exception as e:
+            print(f"Ошибка слежения за папками: {e}")
+        finally:
+            if self.backend is not None:
+                self.backend.close()
+
+    def _apply(self, events: List[WatchEvent]) -> None:
+        tree = self.tree
+        dirty: Dict[SizeNode, None] = {}
+        moved_from: Dict[int, WatchEvent] = {}
+        for event in events:
+            if event.kind is ChangeKind.OVERFLOW:
+                # Сверяем с диском каждую папку
+                dirty.update(dict.fromkeys(tree.root.walk()))
+            elif event.kind is ChangeKind.MOVED_FROM and event.is_dir:
+                moved_from[event.cookie] = event
+            elif event.kind is ChangeKind.MOVED_TO and event.is_dir and event.cookie in moved_from:
+                source = moved_from.pop(event.cookie)
+                if not (tree.contains(source.directory) and tree.contains(event.directory)
+                        and tree.move(source.directory, source.name, event.directory, event.name)):
+                    dirty[source.directory] = None
+                    dirty[event.directory] = None
+            else:
+                dirty[event.directory] = None
+        # Папки, перемещенные за пределы дерева
+        for event in moved_from.values():
+            dirty[event.directory] = None
+
+        for node in dirty:
+            if tree.contains(node):
+                for subtree in tree.refresh(node):
+                    self._watch(subtree)
+
+        changed, removed, detached = tree.take_changes()
+        for node in detached:
+            self._unwatch(node)
+        if changed or removed:
+            self.on_change(changed, removed)
@@ -1,7 +1,32 @@
+"""
+Общие функции программы и сканирование из командной строки без окна.
+
+    python main.py C:\\ D:\\ --threshold 500 --threads 4 > folders.ndjson
+    python main.py /srv --exclude node_modules --top-k 100 --progress | jq .
+    python main.py /srv --index-dir /var/lib/skripclean --since 7   # что выросло за неделю
+
+Результат выводится построчно в формате NDJSON (одна запись JSON на строку)
+по мере обхода, поэтому вывод можно сразу передавать другим программам.
+"""
+import argparse
+import json
+import os
 import shutil
+import sys
+import threading
 import time
+from dataclasses import asdict
 from pathlib import Path
 
+import folder_scanner
+from dir_index import DirIndexStore, diff_indexes, scan_options_digest
+from scan_session import ProgressEstimator, ScanSession, combined_fraction, merge_results
+
+try:
+    import folder_search_cpp
+except ImportError:
+    folder_search_cpp = None
+
 
 def format_size(size):
     """Форматирует размер в читаемый вид."""
@@ -13,8 +38,8 @@ def format_size(size):
 
 
 def is_excluded(path, exclude_dirs):
-    """Проверяет, нужно ли исключить папку."""
-    return any(part in exclude_dirs for part in path.parts)
+    """Проверяет, нужно ли исключить папку (имена, шаблоны и пути, см. folder_scanner.ExcludeMatcher)."""
+    return folder_scanner.is_excluded(str(path), exclude_dirs)
 
 
 
@@ -42,4 +67,215 @@ def log_action(message):
     """Логирует действия."""
     with open("folder_cleaner.log", "a", encoding="utf-8") as log_file:
         timestamp = time.strftime("[%Y-%m-%d %H:%M:%S]")
-        log_file.write(f"{timestamp} {message}\n")
\ No newline at end of file
+        log_file.write(f"{timestamp} {message}\n")
+
+
+def default_exclude_dirs():
+    """
+    Папки, которые не показываются при сканировании и поиске дубликатов.
+    Системные папки исключаются по абсолютному пути, а не по имени,
+    чтобы не прятать одноименные папки пользователя.
+    """
+    exclude_dirs = {'System Volume Information', '$Recycle.Bin', 'AppData'}
+    for variable in ('SystemRoot', 'ProgramFiles', 'ProgramFiles(x86)', 'ProgramData'):
+        path = os.environ.get(variable)
+        if path:
+            exclude_dirs.add(path)
+    return exclude_dirs
+
+
+class RecordWriter:
+    """
+    Пишет записи NDJSON в поток; вызывается из потоков разных корней.
+
+    Если читатель закрыл вывод (например, head), запись прекращается,
+    а сканирование отменяется через on_closed.
+    """
+
+    def __init__(self, stream, on_closed=None):
+        self.stream = stream
+        self.on_closed = on_closed
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def write(self, records):
+        lines = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+        with self._lock:
+            if self.closed:
+                return
+            try:
+                self.stream.write(lines)
+                # Запись должна дойти до читателя сразу, а не по заполнении буфера
+                self.stream.flush()
+            except (BrokenPipeError, ValueError):
+                self.closed = True
+                if self.on_closed is not None:
+                    self.on_closed()
+
+
+def _folder_record(root, folder):
+    record = {'type': 'folder', 'root': root, 'path': folder.path,
+              'size': folder.size, 'allocated_size': folder.allocated_size}
+    if folder.class_sizes:
+        record['classes'] = dict(zip(folder_scanner.FILE_CLASSES, folder.class_sizes))
+    return record
+
+
+def _change_records(store, root, days, size_threshold, exclude_dirs, top_k, options):
+    """Записи о папках корня, изменившихся со снимка не моложе days дней."""
+    current = store.open(root, include_stale=True, options=options)
+    if current is None:
+        return []
+    with current:
+        moment = current.scan_time - days * 86400 if days else current.scan_time - 0.01
+        snapshot = store.snapshot_before(root, moment, options)
+        if snapshot is None:
+            return [{'type': 'error', 'root': root, 'message': "нет снимка для сравнения"}]
+        with snapshot.open() as old:
+            diff = diff_indexes(old, current, size_threshold, exclude_dirs, top_k=top_k)
+    # С ограничением top_k самые быстрорастущие в разах могут не попасть в список по байтам
+    grown = {change.path: change for change in diff.grown + diff.grown_relative}
+    records = []
+    for kind, listed in (('grown', sorted(grown.values(), key=lambda change: change.growth, reverse=True)),
+                         ('appeared', diff.appeared), ('vanished', diff.vanished)):
+        records.extend({'type': 'change', 'kind': kind, 'root': root, 'path': change.path,
+                        'old_size': change.old_size, 'new_size': change.new_size,
+                        'growth': change.growth, 'since': diff.old_time} for change in listed)
+    return records
+
+
+def run_cli(argv=None):
+    """
+    Сканирует папки из командной строки и выводит результат в NDJSON.
+
+    Записи различаются полем type: folder — папка крупнее порога (во время обхода,
+    в порядке завершения; с --top-k — после обхода по убыванию размера),
+    progress — ход сканирования (с --progress), change — папка, которая выросла,
+    появилась или исчезла со времени снимка (с --since), file — самые большие файлы
+    (с --largest-files), error — корень, который не удалось просканировать,
+    summary — итог в последней строке.
+
+    Returns:
+        int: Код выхода: 0 — успешно, 1 — есть ошибки или вывод закрыт, 130 — прервано
+    """
+    parser = argparse.ArgumentParser(description="Поиск больших папок без окна программы, вывод в NDJSON")
+    parser.add_argument('roots', nargs='+', help="Диски или папки для сканирования")
+    parser.add_argument('-t', '--threshold', type=int, default=100, help="Минимальный размер папки в МБ")
+    parser.add_argument('-x', '--exclude', action='append', default=[],
+                        help="Исключить папки по имени, шаблону или пути; можно указать несколько раз")
+    parser.add_argument('--no-default-excludes', action='store_true',
+                        help="Не исключать системные папки, как это делает окно программы")
+    parser.add_argument('-j', '--threads', type=int, default=min(4, os.cpu_count() or 1),
+                        help="Потоков обхода на корень (на жестком диске всегда один)")
+    parser.add_argument('--top-k', type=int, default=0, help="Вывести только столько самых больших папок")
+    parser.add_argument('--exclude-nested', action='store_true',
+                        help="Не выводить папку, которая крупнее порога только за счет своей подпапки")
+    parser.add_argument('--largest-files', type=int, default=0, help="Вывести столько самых больших файлов")
+    parser.add_argument('--one-file-system', action='store_true',
+                        help="Не заходить в другие диски и сетевые папки, подключенные внутри корня")
+    parser.add_argument('--dedupe-hard-links', action='store_true', help="Учитывать жесткие ссылки один раз")
+    parser.add_argument('--progress', action='store_true', help="Выводить записи о ходе сканирования")
+    parser.add_argument('--python', action='store_true', help="Сканер на Python, даже если собран нативный")
+    parser.add_argument('--index-dir', help="Сохранять индексы и ежедневные снимки сканирований в эту папку")
+    parser.add_argument('--keep-snapshots', type=int, default=10, help="Сколько снимков хранить для каждого корня")
+    parser.add_argument('--since', type=float, metavar='DAYS',
+                        help="Вывести, что выросло, появилось и исчезло со снимка не моложе DAYS дней "
+                             "(0 — с прошлого снимка); нужен --index-dir")
+    args = parser.parse_args(argv)
+    if args.since is not None and not args.index_dir:
+        parser.error("--since требует --index-dir")
+
+    missing = [root for root in args.roots if not os.path.isdir(root)]
+    if missing:
+        parser.error(f"папки не найдены: {', '.join(missing)}")
+    scanner = folder_scanner if args.python or folder_search_cpp is None else folder_search_cpp
+    exclude_dirs = set(args.exclude)
+    if not args.no_default_excludes:
+        exclude_dirs |= default_exclude_dirs()
+
+    # NDJSON — всегда UTF-8 и \n между записями, в том числе в консоли Windows
+    sys.stdout.reconfigure(encoding='utf-8', newline='\n')
+    cancel_token = scanner.CancellationToken()
+    writer = RecordWriter(sys.stdout, cancel_token.cancel)
+    session = ScanSession(args.roots, args.threads)
+    store = DirIndexStore(Path(args.index_dir), max_snapshots=args.keep_snapshots) if args.index_dir else None
+    changes = {}
+    # Снимки сравниваются только со снимками сканирований с теми же исключениями
+    scan_options = scan_options_digest(exclude_dirs, prune_excluded=True, one_file_system=args.one_file_system,
+                                       dedupe_hard_links=args.dedupe_hard_links)
+    # Оценка объема для прогресса читает папки корня, поэтому делается только по
+    # запросу и уже в очереди корня на устройстве (scan_root)
+    estimators = {}
+    progress = {}
+    progress_lock = threading.Lock()
+
+    def on_progress(root, scan_progress):
+        with progress_lock:
+            estimators[root].update(scan_progress.dirs_scanned, scan_progress.bytes_scanned)
+            progress[root] = (scan_progress.dirs_scanned, scan_progress.bytes_scanned)
+            record = {'type': 'progress',
+                      'dirs': sum(dirs for dirs, _ in progress.values()),
+                      'bytes': sum(size for _, size in progress.values()),
+                      'percent': round(100 * combined_fraction(
+                          estimators.values(), len(session.roots) - len(estimators)), 1)}
+        writer.write([record])
+
+    def scan_root(root, threads):
+        options = {}
+        if args.progress:
+            estimator = ProgressEstimator(root, exclude_dirs=exclude_dirs, cancel_token=cancel_token)
+            with progress_lock:
+                estimators[root] = estimator
+            options['progress_callback'] = lambda scan_progress: on_progress(root, scan_progress)
+        if not args.top_k:
+            # Без ограничения папки выводятся пачками прямо во время обхода
+            options['folder_callback'] = lambda folders: writer.write(
+                [_folder_record(root, folder) for folder in folders])
+        scan_time = time.time()
+        result = scanner.scan_folders(
+            root, args.threshold, exclude_dirs, threads=threads, cancel_token=cancel_token,
+            dedupe_hard_links=args.dedupe_hard_links, top_k=args.top_k,
+            exclude_nested=args.exclude_nested, largest_files=args.largest_files,
+            file_classes=True, prune_excluded=True, one_file_system=args.one_file_system,
+            # Дерево нужно только для индекса: без него в памяти остаются лишь крупные папки
+            collect_tree=store is not None, file_ages=store is not None, **options)
+        if store is not None and result.complete:
+            store.save(root, result.tree, scan_time, scan_options)
+            if args.since is not None:
+                changes[root] = _change_records(store, root, args.since, args.threshold * 1024 * 1024,
+                                                exclude_dirs, args.top_k, scan_options)
+        return result
+
+    start = time.perf_counter()
+    try:
+        results = session.run(scan_root, cancel=cancel_token.cancel)
+    except KeyboardInterrupt:
+        return 130
+    merged = merge_results(list(results.values()), largest_files=args.largest_files)
+    merged.stats.wall_time = time.perf_counter() - start
+
+    records = []
+    if args.top_k:
+        # Каждый корень вернул свои top_k папок, а вывести нужно top_k из всех
+        records = sorted((_folder_record(root, folder) for root, result in results.items()
+                          for folder in result.folders),
+                         key=lambda record: record['size'], reverse=True)[:args.top_k]
+    for root in session.roots:
+        records.extend(changes.get(root, ()))
+    records.extend({'type': 'file', 'path': file.path, 'size': file.size,
+                    'allocated_size': file.allocated_size} for file in merged.largest_files)
+    records.extend({'type': 'error', 'root': root, 'message': str(error)}
+                   for root, error in session.errors.items())
+    records.append({'type': 'summary', 'roots': session.roots,
+                    'complete': merged.complete and not session.errors and not writer.closed,
+                    'total_size': merged.total_size, 'total_allocated': merged.total_allocated,
+                    'skipped_mounts': merged.skipped_mounts, 'stats': asdict(merged.stats)})
+    writer.write(records)
+    if writer.closed:
+        # Вывод закрыт читателем: не даем Python сообщить об ошибке при сбросе буфера на выходе
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    return 0 if records[-1]['complete'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(run_cli())
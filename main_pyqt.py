@@ -5,6 +5,7 @@ import time
 from pathlib import Path
 from tqdm import tqdm
 import threading
+import sqlite3
 import psutil
 
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
@@ -13,16 +14,29 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QH
                              QComboBox, QStyle, QStyledItemDelegate, QAbstractItemView,
                              QTabWidget, QDialog, QTreeWidget, QTreeWidgetItem, QGroupBox,
                              QCheckBox, QSystemTrayIcon, QMenu, QAction, QLineEdit)
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QSize, QTimer, QSettings, QEvent
-from PyQt5.QtGui import QIcon, QColor, QFont, QPalette, QBrush, QLinearGradient
+from PyQt5.QtCore import Qt, QThread, QObject, pyqtSignal, QSize, QTimer, QSettings, QEvent, QPointF
+from PyQt5.QtGui import QIcon, QColor, QFont, QPalette, QBrush, QLinearGradient, QPainter, QPen, QPolygonF
 
 # Импортируем функции из main.py и C++ модуля
-from main import format_size, is_excluded, delete_folder, log_action
-import folder_search_cpp as fs_cpp
+from main import format_size, delete_folder, log_action, default_exclude_dirs
+try:
+    import folder_search_cpp as fs_cpp
+except ImportError:
+    # Нативный модуль не собран — используем сканер на чистом Python
+    import folder_scanner as fs_cpp
+# Повторное сканирование по индексу выполняет сканер на Python
+import folder_scanner
 # Импортируем функции из ai_consultant.py
 from ai_consultant import show_ai_assistant_dialog
 # Импортируем систему кеширования
 from path_cache import PathCache
+from dir_index import DirIndexStore, diff_indexes, scan_options_digest
+from size_history import SizeHistory, downsample
+from folder_watcher import FolderWatcher, SizeTree
+from scan_session import ProgressEstimator, ScanHistory, ScanSession, combined_fraction, merge_results
+from treemap import TreemapLayout
+from treemap_view import TreemapView
+from duplicate_finder import HashCache, find_duplicates
 # Импортируем функцию для добавления вкладки восстановления файлов
 from autorun_manager import AutorunManager
 # Импортируем диалог отказа от ответственности
@@ -34,6 +48,18 @@ from program_uninstaller import ProgramUninstallerWidget
 
 # Создаем глобальный экземпляр кеша
 path_cache = PathCache()
+# Индексы размеров папок храним рядом с кешем и с тем же сроком жизни,
+# а снимки прошлых сканирований — по одному в день за последние полторы недели
+dir_index_store = DirIndexStore(path_cache.cache_dir / 'index', path_cache.cache_ttl,
+                                max_snapshots=10, snapshot_interval=86400)
+# Повторное сканирование по индексу выполняет сканер на Python. Он не читает файлы
+# неизменившихся папок, но все равно проверяет каждую папку, поэтому полный обход
+# нативным сканером быстрее, пока в папках в среднем мало файлов (scan_benchmark:
+# при 1–4 файлах на папку повторное в 1,2–2 раза медленнее, при 100 — в 6 раз быстрее)
+INCREMENTAL_MIN_FILES_PER_DIR = 16
+# Размеры верхних папок при каждом сканировании: неделю по часам, дальше по дням
+size_history = SizeHistory(str(path_cache.cache_dir / 'history.sqlite'))
+
 
 # Стили и цвета
 PRIMARY_COLOR = "#4a6fa5"
@@ -140,95 +166,269 @@ class CustomTrayIcon(QSystemTrayIcon):
         except Exception:
             return "Н/Д"
 
+# Передает изменения от наблюдателя за папками из его потока в интерфейс
+class FolderWatcherSignals(QObject):
+    folders_changed = pyqtSignal(object, object)  # Изменившиеся папки, удаленные пути
+
+
+# Поиск файлов-дубликатов в отдельном потоке
+class DuplicateWorker(QThread):
+    progress = pyqtSignal(str, int, int)  # Этап, сделано, всего
+    duplicates_found = pyqtSignal(object)  # List[DuplicateGroup]
+    
+    def __init__(self, root_path, exclude_dirs, threads=1, min_size=1024 * 1024):
+        super().__init__()
+        self.root_path = root_path
+        self.exclude_dirs = exclude_dirs
+        self.threads = threads
+        self.min_size = min_size
+        self.cancel_token = fs_cpp.CancellationToken()
+        
+    def run(self):
+        cache = None
+        try:
+            # Хеши сохраняются между запусками, поэтому повторный поиск почти не читает файлы
+            cache = HashCache(str(path_cache.cache_dir / 'hashes.sqlite'))
+            groups = find_duplicates(
+                str(self.root_path), self.exclude_dirs, self.min_size, self.threads,
+                cache, self.cancel_token,
+                lambda progress: self.progress.emit(progress.stage, progress.done, progress.total))
+            if not self.cancel_token.cancelled:
+                self.duplicates_found.emit(groups)
+        except Exception as e:
+            print(f"Ошибка поиска дубликатов: {e}")
+        finally:
+            if cache is not None:
+                cache.close()
+    
+    def stop(self):
+        self.cancel_token.cancel()
+
+
 # Класс для выполнения сканирования в отдельном потоке
 class ScanWorker(QThread):
     progress_update = pyqtSignal(int)
-    folder_found = pyqtSignal(object, object)
+    folder_found = pyqtSignal(object, object, object, object)  # Путь, размер, место на диске, размеры по классам файлов
     scan_complete = pyqtSignal()
     folder_count_update = pyqtSignal(int)
+    scan_progress = pyqtSignal(int, object)  # Просканировано папок и байт
+    size_tree_ready = pyqtSignal(object)  # SizeTree для слежения за изменениями, по одному на корень
+    file_stats_ready = pyqtSignal(object, object)  # Самые большие файлы и SizeHistogram
+    mounts_skipped = pyqtSignal(object)  # Точки монтирования, в которые сканирование не зашло
+    stats_ready = pyqtSignal(object)  # ScanStats: сколько прочитано папок и записей, ошибки и время
     
-    def __init__(self, root_path, size_threshold_mb, exclude_dirs):
+    def __init__(self, roots, size_threshold_mb, exclude_dirs, threads=1,
+                 dedupe_hard_links=False, incremental=False, build_size_tree=False,
+                 top_k=0, exclude_nested=False, largest_files=0, one_file_system=False):
         super().__init__()
-        self.root_path = root_path
+        # Корни сканируются параллельно, но по одному за раз на каждом жестком диске
+        self.roots = list(roots)
         self.size_threshold_mb = size_threshold_mb
         self.size_threshold = size_threshold_mb * 1024 * 1024
         self.exclude_dirs = exclude_dirs
+        self.threads = threads
+        self.dedupe_hard_links = dedupe_hard_links
+        # Повторно сканировать по устаревшему индексу только изменившиеся папки.
+        # Дописанные на месте файлы не меняют время изменения папки и так не замечаются.
+        # Свежий индекс используется всегда
+        self.incremental = incremental
+        # Построить дерево размеров, чтобы затем следить за изменениями
+        self.build_size_tree = build_size_tree
+        # Показать только top_k самых больших папок (0 — все) и без вложенных дублей
+        self.top_k = top_k
+        self.exclude_nested = exclude_nested
+        # Сколько самых больших файлов собрать вместе с распределением по размеру
+        self.largest_files = largest_files
+        # Не заходить на другие тома и сетевые папки, подключенные внутри корня
+        self.one_file_system = one_file_system
+        # Индекс годится только для сканирования с теми же исключениями и параметрами обхода
+        self.scan_options = scan_options_digest(exclude_dirs, prune_excluded=True, one_file_system=one_file_system,
+                                                dedupe_hard_links=dedupe_hard_links)
         self.is_running = True
-        self.path_cache = path_cache  # Используем глобальный экземпляр
+        # Позволяет прервать обход даже внутри одной огромной папки; общий для всех корней
+        self.cancel_token = fs_cpp.CancellationToken()
+        self.index_store = dir_index_store  # Используем глобальный экземпляр
+        # Прогресс и число папок по корням: корни сообщают о них из разных потоков
+        self._lock = threading.Lock()
+        self._progress = {}
+        self._estimators = {}
+        self._root_count = 0
+        self._folder_count = 0
         
     def run(self):
         try:
-            # Проверяем наличие кешированных данных
-            cached_folders = self.path_cache.get_cached_folders(str(self.root_path))
-            if cached_folders is not None:
-                # Используем кешированные данные
-                total_folders = len(cached_folders)
-                self.folder_count_update.emit(total_folders)
-                
-                for folder_data in cached_folders:
-                    if not self.is_running:
-                        return
-                    folder_path = Path(folder_data['path'])
-                    folder_size = folder_data['size']
-                    if folder_size > self.size_threshold:
-                        self.folder_found.emit(folder_path, folder_size)
-                
+            start = time.perf_counter()
+            session = ScanSession(self.roots, self.threads)
+            # Оценщики объема создаются корнями в своей очереди (scan_root), а до
+            # того корень считается невыполненным
+            self._estimators = {}
+            self._root_count = len(session.roots)
+            scans = session.run(self.scan_root, cancel=self.cancel_token.cancel)
+            for root, error in session.errors.items():
+                print(f"Ошибка сканирования {root}: {error}")
+            # Корни, взятые из индекса целиком, результата сканирования не дают
+            scans = [scan for scan in scans.values() if scan is not None]
+            if scans:
+                merged = merge_results([result for result, _ in scans])
+                # Корни шли параллельно: время сеанса, а не сумма времени корней
+                merged.stats.wall_time = time.perf_counter() - start
+                if merged.skipped_mounts:
+                    self.mounts_skipped.emit(merged.skipped_mounts)
+                self.stats_ready.emit(merged.stats)
+            if self.largest_files:
+                # Повторное сканирование и индекс не читают файлы неизменившихся папок
+                full = [result for result, full_scan in scans if full_scan]
+                if full:
+                    files = merge_results(full, largest_files=self.largest_files)
+                    self.file_stats_ready.emit(files.largest_files, files.size_histogram)
+                else:
+                    self.file_stats_ready.emit(None, None)
+            if self.is_running:
                 self.progress_update.emit(100)
-                return
-            
-            # Если кеш отсутствует или устарел, выполняем сканирование
-            all_folders = []
-            for dirpath, dirnames, _ in os.walk(self.root_path):
-                path = Path(dirpath)
-                if not is_excluded(path, self.exclude_dirs):
-                    all_folders.append(path)
-                if not self.is_running:
-                    return
-            
-            total_folders = len(all_folders)
-            self.folder_count_update.emit(total_folders)
-            
-            # Сохраняем результаты сканирования для кеширования
-            folders_to_cache = []
-            
-            # Теперь сканируем каждую папку с обновлением прогресса
-            processed = 0
-            for folder in all_folders:
-                if not self.is_running:
-                    break
-                    
-                try:
-                    # Используем правильное имя функции из C++ модуля
-                    size = fs_cpp.get_folder_size(str(folder))
-                    # Переводим порог в байты (MB * 1024 * 1024)
-                    size_threshold_bytes = self.size_threshold_mb * 1024 * 1024
-                    if size > size_threshold_bytes:
-                        self.folder_found.emit(folder, size)
-                        # Добавляем папку в список для кеширования
-                        folders_to_cache.append({
-                            'path': str(folder),
-                            'size': size
-                        })
-                except Exception as e:
-                    print(f"Ошибка при обработке папки {folder}: {e}")
-                    continue
-                    
-                processed += 1
-                self.progress_update.emit(int(processed * 100 / total_folders))
-                
-                # Даем время для обработки событий GUI
-                QThread.msleep(1)
-                
-            # Сохраняем результаты в кеш после успешного сканирования
-            self.path_cache.cache_folders(str(self.root_path), folders_to_cache)
-                
+
         except Exception as e:
             print(f"Ошибка сканирования: {e}")
         finally:
             self.scan_complete.emit()
-        
+
+    def scan_root(self, root, threads):
+        """
+        Сканирует один корень; вызывается ScanSession из своего потока.
+
+        Returns:
+            Результат сканирования и признак полного обхода (файлы прочитаны)
+            или None, если ответ целиком взят из индекса
+        """
+        if not self.is_running:
+            return None
+        # Сначала пробуем ответить из индекса размеров: он подходит и при другом
+        # пороге, и для любой подпапки ранее просканированной папки, но только если
+        # исключения и параметры обхода те же — иначе в дереве не хватает папок
+        hit = self.index_store.lookup(str(root), include_stale=True, options=self.scan_options)
+        previous = None
+        history = None
+        if hit is not None:
+            index, node = hit
+            # Прошлое сканирование дает и ожидаемый объем работы для прогресса
+            history = ScanHistory(index.ends[node] - node, index.sizes[node])
+            if not self.index_store.is_fresh(index):
+                # Устаревший индекс служит основой для повторного сканирования, если
+                # оно включено и быстрее полного обхода нативным сканером
+                files_per_dir = index.file_counts[node] / (index.ends[node] - node)
+                if self.incremental and (fs_cpp is folder_scanner
+                                         or files_per_dir >= INCREMENTAL_MIN_FILES_PER_DIR):
+                    previous = index
+                else:
+                    index.close()
+            else:
+                with index:
+                    folders = index.large_folders(self.size_threshold, self.exclude_dirs, node,
+                                                  self.top_k, self.exclude_nested)
+                    if self.build_size_tree:
+                        self.size_tree_ready.emit(SizeTree.from_index(index, node, **self.size_tree_options()))
+                with self._lock:
+                    self._folder_count += len(folders)
+                    self.folder_count_update.emit(self._folder_count)
+                self.on_folders_found(folders)
+                estimator = ProgressEstimator(root, history)
+                estimator.finish()
+                with self._lock:
+                    self._estimators[root] = estimator
+                self.progress_update.emit(self._percent())
+                return None
+
+        # Оценка объема без истории читает папки корня, поэтому делается здесь,
+        # под ограничением сеанса на устройство, и прекращается при остановке
+        estimator = ProgressEstimator(root, history, self.exclude_dirs, self.cancel_token)
+        with self._lock:
+            self._estimators[root] = estimator
+        if not self.is_running:
+            if previous is not None:
+                previous.close()
+            return None
+
+        # Сканер обходит дерево один раз и сам собирает размеры папок,
+        # а найденные папки и прогресс передает пачками прямо во время обхода.
+        # Заодно собираем полное дерево папок для индекса. Если есть прежний
+        # индекс, заново читаются только папки, которые с тех пор изменились
+        scan_time = time.time()
+        scanner = folder_scanner if previous is not None else fs_cpp
+        options = {'previous': previous} if previous is not None else {}
+        try:
+            result = scanner.scan_folders(
+                str(root), self.size_threshold_mb, self.exclude_dirs,
+                threads=threads,
+                cancel_token=self.cancel_token,
+                dedupe_hard_links=self.dedupe_hard_links,
+                collect_tree=True,
+                progress_callback=lambda progress: self.on_scan_progress(root, progress),
+                folder_callback=self.on_folders_found,
+                top_k=self.top_k,
+                exclude_nested=self.exclude_nested,
+                largest_files=self.largest_files,
+                size_histogram=self.largest_files > 0,
+                # Состав папок по типам файлов и возрасту попадает и в индекс
+                file_classes=True,
+                file_ages=True,
+                # Исключенные папки не читаются вовсе
+                prune_excluded=True,
+                one_file_system=self.one_file_system,
+                **options)
+        finally:
+            if previous is not None:
+                previous.close()
+        # С ограничением top_k папки известны только после обхода
+        if self.top_k:
+            self.on_folders_found(result.folders)
+        # Неполное дерево остановленного сканирования не сохраняем
+        if self.is_running and result.complete:
+            # Сохраняем дерево в индекс после успешного сканирования
+            self.index_store.save(str(root), result.tree, scan_time, self.scan_options)
+            self.record_history(root)
+            if self.build_size_tree:
+                self.size_tree_ready.emit(SizeTree.from_dir_tree(result.tree, **self.size_tree_options()))
+        return result, previous is None
+        
+    def size_tree_options(self):
+        """Параметры, с которыми наблюдатель добавляет в дерево новые папки."""
+        return {'exclude_dirs': self.exclude_dirs, 'one_file_system': self.one_file_system}
+
+    def record_history(self, root):
+        """Записывает размеры верхних папок корня по только что сохраненному индексу."""
+        try:
+            index = self.index_store.open(str(root), include_stale=True, options=self.scan_options)
+            if index is None:
+                return
+            with index:
+                size_history.record_index(index, min_size=self.size_threshold)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f"Ошибка записи истории размеров {root}: {e}")
+
+    def on_scan_progress(self, root, progress):
+        with self._lock:
+            self._progress[root] = (progress.dirs_scanned, progress.bytes_scanned)
+            self._estimators[root].update(progress.dirs_scanned, progress.bytes_scanned)
+            dirs_scanned = sum(dirs for dirs, _ in self._progress.values())
+            bytes_scanned = sum(size for _, size in self._progress.values())
+        self.scan_progress.emit(dirs_scanned, bytes_scanned)
+        self.progress_update.emit(self._percent())
+
+    def _percent(self):
+        """Общий прогресс сеанса в процентах."""
+        with self._lock:
+            return int(100 * combined_fraction(self._estimators.values(),
+                                               self._root_count - len(self._estimators)))
+
+    def on_folders_found(self, folders):
+        if not self.is_running:
+            return
+        for folder in folders:
+            self.folder_found.emit(Path(folder.path), folder.size, folder.allocated_size,
+                                   folder.class_sizes)
+
     def stop(self):
         self.is_running = False
+        self.cancel_token.cancel()
 
 # Делегат для стилизации ячеек таблицы
 class ColorDelegate(QStyledItemDelegate):
@@ -242,6 +442,32 @@ class ColorDelegate(QStyledItemDelegate):
         
         super().paint(painter, option, index)
 
+# Рисует в ячейке график размера папки по точкам (время, размер) из Qt.UserRole
+class SparklineDelegate(QStyledItemDelegate):
+    def paint(self, painter, option, index):
+        super().paint(painter, option, index)
+        points = index.data(Qt.UserRole)
+        if not points or len(points) < 2:
+            return
+        rect = option.rect.adjusted(4, 4, -4, -4)
+        points = downsample(points, max(2, rect.width()))
+        start, end = points[0][0], points[-1][0]
+        low = min(size for _, size in points)
+        high = max(size for _, size in points)
+        polygon = QPolygonF()
+        for moment, size in points:
+            x = rect.left() + rect.width() * (moment - start) / ((end - start) or 1)
+            y = rect.bottom() - rect.height() * (size - low) / ((high - low) or 1)
+            polygon.append(QPointF(x, y))
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(QPen(QColor(PRIMARY_COLOR), 1.5))
+        painter.drawPolyline(polygon)
+        painter.restore()
+
+    def sizeHint(self, option, index):
+        return QSize(160, 28)
+
 class CleanerThread(QThread):
     progress_updated = pyqtSignal(dict)
     finished = pyqtSignal()
@@ -764,7 +990,21 @@ class MainWindow(QMainWindow):
         
         self.init_ui()
         self.scan_worker = None
+        self.duplicate_worker = None
         self.large_folders = []
+        # Наблюдатели поддерживают размеры найденных папок актуальными после сканирования,
+        # по одному на каждый просканированный корень
+        self.folder_watchers = []
+        self.watcher_signals = FolderWatcherSignals()
+        self.watcher_signals.folders_changed.connect(self.apply_folder_changes)
+        self.results_threshold = 0
+        self.results_roots = []
+        self.results_exclude_dirs = set()
+        # Отпечаток параметров последнего сканирования: по нему выбираются подходящие индексы
+        self.results_options = None
+        self.results_top_k = 0
+        self.skipped_mounts = []
+        self.scan_stats = None
         
     def init_ui(self):
         # Создаем центральный виджет
@@ -807,6 +1047,12 @@ class MainWindow(QMainWindow):
         self.folder_button.setIcon(self.style().standardIcon(QStyle.SP_DirIcon))
         self.folder_button.clicked.connect(self.select_folder)
         
+        # Несколько дисков и сетевых папок сканируются параллельно, а результаты сводятся в одну таблицу
+        self.all_roots_check = QCheckBox("Все из списка")
+        self.all_roots_check.setToolTip(
+            "Сканировать сразу все диски и папки из списка. Папки на одном жестком диске "
+            "сканируются по очереди, разные диски — одновременно")
+        
         # Выбор минимального размера
         size_label = QLabel("Минимальный размер папки (МБ):")
         self.size_spin = QSpinBox()
@@ -814,13 +1060,77 @@ class MainWindow(QMainWindow):
         self.size_spin.setValue(100)
         self.size_spin.setSuffix(" МБ")
         
+        # Количество потоков обхода: на SSD несколько потоков заметно ускоряют сканирование,
+        # на HDD лучше оставить один поток
+        threads_label = QLabel("Потоки:")
+        self.threads_spin = QSpinBox()
+        self.threads_spin.setRange(1, 64)
+        self.threads_spin.setValue(min(4, os.cpu_count() or 1))
+        self.threads_spin.setToolTip("Количество потоков сканирования (для HDD рекомендуется 1)")
+        
+        # Жесткие ссылки (WinSxS, кеши сборки) иначе учитываются в каждой папке, где они есть
+        self.dedupe_links_check = QCheckBox("Учитывать жесткие ссылки один раз")
+        self.dedupe_links_check.setChecked(True)
+        
+        # Подключенные в папку тома и сетевые папки иначе превращают сканирование диска в многочасовое
+        self.one_file_system_check = QCheckBox("Только этот диск")
+        self.one_file_system_check.setChecked(True)
+        self.one_file_system_check.setToolTip(
+            "Не заходить в другие диски и сетевые папки, подключенные внутри выбранной папки")
+        
+        # Повторное сканирование по индексу читает с диска только изменившиеся папки
+        self.incremental_check = QCheckBox("Только изменения (быстро, без учета дописанных файлов)")
+        self.incremental_check.setChecked(False)
+        self.incremental_check.setToolTip(
+            "Когда результаты прошлого сканирования устарели, заново читать только "
+            "изменившиеся папки. Файлы, дописанные или перезаписанные на месте (журналы, "
+            "образы виртуальных машин), не меняют время изменения папки и так не обнаруживаются; "
+            "их рост не попадет и в историю размеров")
+        
+        # Ограничение числа строк: таблица с сотнями тысяч папок работает медленно
+        top_k_label = QLabel("Не больше:")
+        self.top_k_spin = QSpinBox()
+        self.top_k_spin.setRange(0, 100000)
+        self.top_k_spin.setValue(1000)
+        self.top_k_spin.setSpecialValueText("все")
+        self.top_k_spin.setToolTip("Сколько самых больших папок показать (0 — все)")
+        
+        # Родитель и его единственная крупная подпапка показываются одной строкой
+        self.exclude_nested_check = QCheckBox("Без вложенных дублей")
+        self.exclude_nested_check.setToolTip(
+            "Не показывать папку, которая крупнее порога только за счет своей подпапки")
+        
+        # После сканирования размеры папок обновляются по событиям файловой системы
+        self.watch_changes_check = QCheckBox("Следить за изменениями")
+        self.watch_changes_check.setChecked(True)
+        if sys.platform.startswith('linux'):
+            self.watch_changes_check.setToolTip("Обновлять размеры папок по событиям файловой системы")
+        else:
+            # Без inotify наблюдатель опрашивает время изменения папок
+            self.watch_changes_check.setToolTip(
+                "Размеры папок проверяются раз в 30 секунд. Замечаются новые, удаленные "
+                "и переименованные файлы и папки, но не запись в существующие файлы")
+        
         # Добавляем виджеты в layout
         settings_layout.addWidget(drive_label)
         settings_layout.addWidget(self.drive_combo)
         settings_layout.addWidget(self.folder_button)
+        settings_layout.addWidget(self.all_roots_check)
         settings_layout.addSpacing(20)
         settings_layout.addWidget(size_label)
         settings_layout.addWidget(self.size_spin)
+        settings_layout.addSpacing(20)
+        settings_layout.addWidget(threads_label)
+        settings_layout.addWidget(self.threads_spin)
+        settings_layout.addSpacing(20)
+        settings_layout.addWidget(top_k_label)
+        settings_layout.addWidget(self.top_k_spin)
+        settings_layout.addWidget(self.exclude_nested_check)
+        settings_layout.addSpacing(20)
+        settings_layout.addWidget(self.dedupe_links_check)
+        settings_layout.addWidget(self.one_file_system_check)
+        settings_layout.addWidget(self.incremental_check)
+        settings_layout.addWidget(self.watch_changes_check)
         
         disk_cleanup_layout.addLayout(settings_layout)
         
@@ -841,8 +1151,14 @@ class MainWindow(QMainWindow):
         self.ai_button.clicked.connect(self.show_ai_assistant)
         self.ai_button.setEnabled(False)
         
+        self.duplicates_button = QPushButton("Найти дубликаты")
+        self.duplicates_button.setIcon(self.style().standardIcon(QStyle.SP_FileDialogDetailedView))
+        self.duplicates_button.clicked.connect(self.start_duplicate_search)
+        self.duplicates_button.setToolTip("Найти одинаковые файлы от 1 МБ в выбранной папке")
+        
         scan_layout.addWidget(self.scan_button)
         scan_layout.addWidget(self.stop_button)
+        scan_layout.addWidget(self.duplicates_button)
         scan_layout.addWidget(self.ai_button)
         disk_cleanup_layout.addLayout(scan_layout)
         
@@ -858,16 +1174,132 @@ class MainWindow(QMainWindow):
         disk_cleanup_layout.addLayout(progress_layout)
         
         # Таблица с результатами
-        self.results_table = QTableWidget(0, 3)
-        self.results_table.setHorizontalHeaderLabels(["Путь", "Размер", "Действия"])
+        self.results_table = QTableWidget(0, 5)
+        self.results_table.setHorizontalHeaderLabels(["Путь", "Размер", "На диске", "Содержимое", "Действия"])
         self.results_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
         self.results_table.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeToContents)
         self.results_table.horizontalHeader().setSectionResizeMode(2, QHeaderView.ResizeToContents)
+        self.results_table.horizontalHeader().setSectionResizeMode(3, QHeaderView.ResizeToContents)
+        self.results_table.horizontalHeader().setSectionResizeMode(4, QHeaderView.ResizeToContents)
         self.results_table.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.results_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
         self.results_table.setItemDelegate(ColorDelegate())
         
-        disk_cleanup_layout.addWidget(self.results_table)
+        # Самые большие файлы: переполненный диск чаще всего занимают дампы, образы и логи
+        self.files_table = QTableWidget(0, 3)
+        self.files_table.setHorizontalHeaderLabels(["Путь", "Размер", "На диске"])
+        self.files_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.files_table.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeToContents)
+        self.files_table.horizontalHeader().setSectionResizeMode(2, QHeaderView.ResizeToContents)
+        self.files_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.files_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        
+        # Распределение файлов по размеру с шагом в степень двойки
+        self.histogram_table = QTableWidget(0, 4)
+        self.histogram_table.setHorizontalHeaderLabels(["Размер файлов", "Файлов", "Объем", "Доля объема"])
+        self.histogram_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeToContents)
+        self.histogram_table.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeToContents)
+        self.histogram_table.horizontalHeader().setSectionResizeMode(2, QHeaderView.ResizeToContents)
+        self.histogram_table.horizontalHeader().setSectionResizeMode(3, QHeaderView.Stretch)
+        self.histogram_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        
+        self.results_tabs = QTabWidget()
+        self.results_tabs.addTab(self.results_table, "Папки")
+        self.results_tabs.addTab(self.files_table, "Самые большие файлы")
+        self.results_tabs.addTab(self.histogram_table, "Размеры файлов")
+        
+        # Давно не менявшиеся данные: их удаление освобождает больше всего места с меньшим риском
+        cold_widget = QWidget()
+        cold_layout = QVBoxLayout(cold_widget)
+        cold_age_layout = QHBoxLayout()
+        cold_age_layout.addWidget(QLabel("Файлы не изменялись не меньше:"))
+        self.cold_age_combo = QComboBox()
+        for days, name in zip(folder_scanner.AGE_BUCKET_DAYS, ("30 дней", "90 дней", "года", "3 лет")):
+            self.cold_age_combo.addItem(name, days)
+        self.cold_age_combo.setCurrentIndex(2)
+        self.cold_age_combo.currentIndexChanged.connect(self.update_cold_folders)
+        cold_age_layout.addWidget(self.cold_age_combo)
+        cold_age_layout.addStretch()
+        cold_layout.addLayout(cold_age_layout)
+        self.cold_table = QTableWidget(0, 5)
+        self.cold_table.setHorizontalHeaderLabels(
+            ["Путь", "Давно не менялись", "Доля папки", "Последнее изменение", "Размер папки"])
+        self.cold_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        for column in range(1, 5):
+            self.cold_table.horizontalHeader().setSectionResizeMode(column, QHeaderView.ResizeToContents)
+        self.cold_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.cold_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        cold_layout.addWidget(self.cold_table)
+        self.results_tabs.addTab(cold_widget, "Давно не менялись")
+        
+        # Что выросло с прошлого раза: сравнение снимков без повторного сканирования
+        growth_widget = QWidget()
+        growth_layout = QVBoxLayout(growth_widget)
+        growth_options_layout = QHBoxLayout()
+        growth_options_layout.addWidget(QLabel("Сравнить с:"))
+        self.growth_base_combo = QComboBox()
+        for name, days in (("прошлым сканированием", 0), ("неделей раньше", 7), ("месяцем раньше", 30)):
+            self.growth_base_combo.addItem(name, days)
+        self.growth_base_combo.currentIndexChanged.connect(self.update_growth)
+        growth_options_layout.addWidget(self.growth_base_combo)
+        growth_options_layout.addWidget(QLabel("Упорядочить:"))
+        self.growth_order_combo = QComboBox()
+        self.growth_order_combo.addItem("по приросту в байтах", 'grown')
+        self.growth_order_combo.addItem("по приросту в разах", 'grown_relative')
+        self.growth_order_combo.currentIndexChanged.connect(self.update_growth)
+        growth_options_layout.addWidget(self.growth_order_combo)
+        self.growth_base_label = QLabel("")
+        growth_options_layout.addWidget(self.growth_base_label)
+        growth_options_layout.addStretch()
+        growth_layout.addLayout(growth_options_layout)
+        self.growth_table = QTableWidget(0, 5)
+        self.growth_table.setHorizontalHeaderLabels(["Путь", "Изменение", "Было", "Стало", "Прирост"])
+        self.growth_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        for column in range(1, 5):
+            self.growth_table.horizontalHeader().setSectionResizeMode(column, QHeaderView.ResizeToContents)
+        self.growth_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.growth_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        growth_layout.addWidget(self.growth_table)
+        self.results_tabs.addTab(growth_widget, "Что выросло")
+
+        # Быстрее всего растущие папки по истории размеров всех сканирований
+        trend_widget = QWidget()
+        trend_layout = QVBoxLayout(trend_widget)
+        trend_options_layout = QHBoxLayout()
+        trend_options_layout.addWidget(QLabel("За период:"))
+        self.trend_period_combo = QComboBox()
+        for name, days in (("неделя", 7), ("месяц", 30), ("год", 365), ("все время", 0)):
+            self.trend_period_combo.addItem(name, days)
+        self.trend_period_combo.setCurrentIndex(1)
+        self.trend_period_combo.currentIndexChanged.connect(self.update_trends)
+        trend_options_layout.addWidget(self.trend_period_combo)
+        trend_options_layout.addStretch()
+        trend_layout.addLayout(trend_options_layout)
+        self.trend_table = QTableWidget(0, 5)
+        self.trend_table.setHorizontalHeaderLabels(["Путь", "Размер за период", "В сутки", "За период", "Сейчас"])
+        self.trend_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.trend_table.horizontalHeader().setSectionResizeMode(1, QHeaderView.Fixed)
+        self.trend_table.setColumnWidth(1, 160)
+        for column in range(2, 5):
+            self.trend_table.horizontalHeader().setSectionResizeMode(column, QHeaderView.ResizeToContents)
+        self.trend_table.setItemDelegateForColumn(1, SparklineDelegate(self.trend_table))
+        self.trend_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.trend_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        trend_layout.addWidget(self.trend_table)
+        self.results_tabs.addTab(trend_widget, "Динамика")
+        
+        # Карта папок: куда уходит место, видно по площади прямоугольников
+        self.treemap_view = TreemapView()
+        self.results_tabs.addTab(self.treemap_view, "Карта")
+        
+        # Группы одинаковых файлов: сколько места освободится, если оставить одну копию
+        self.duplicates_tree = QTreeWidget()
+        self.duplicates_tree.setHeaderLabels(["Файлы", "Размер", "Можно освободить"])
+        self.duplicates_tree.header().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.duplicates_tree.header().setSectionResizeMode(1, QHeaderView.ResizeToContents)
+        self.duplicates_tree.header().setSectionResizeMode(2, QHeaderView.ResizeToContents)
+        self.results_tabs.addTab(self.duplicates_tree, "Дубликаты")
+        disk_cleanup_layout.addWidget(self.results_tabs)
         
         # Статус
         self.status_label = QLabel("")
@@ -908,50 +1340,92 @@ class MainWindow(QMainWindow):
             self.drive_combo.setCurrentText(folder)
     
     def start_scan(self):
-        # Получаем выбранный путь и минимальный размер
-        root_path = self.drive_combo.currentText()
+        # Получаем выбранные пути и минимальный размер
+        if self.all_roots_check.isChecked():
+            roots = [self.drive_combo.itemText(i) for i in range(self.drive_combo.count())]
+        else:
+            roots = [self.drive_combo.currentText()]
         size_threshold_mb = self.size_spin.value()
         
-        # Проверяем, существует ли путь
-        if not os.path.exists(root_path):
+        # Проверяем, существуют ли пути; недоступные диски из списка пропускаем
+        roots = [root for root in roots if os.path.exists(root)]
+        if not roots:
             QMessageBox.warning(self, "Ошибка", "Указанный путь не существует.")
             return
         
         # Очищаем предыдущие результаты
+        self.stop_folder_watcher()
         self.results_table.setRowCount(0)
+        self.files_table.setRowCount(0)
+        self.histogram_table.setRowCount(0)
+        self.cold_table.setRowCount(0)
+        self.growth_table.setRowCount(0)
+        self.growth_base_label.setText("")
+        self.trend_table.setRowCount(0)
+        # Карта держит индекс открытым, а сканирование его перезапишет
+        self.treemap_view.clear()
         self.large_folders = []
+        self.skipped_mounts = []
+        self.scan_stats = None
         
         # Устанавливаем исключенные папки
-        exclude_dirs = {
-            'Windows', 'Program Files', 'Program Files (x86)', 'ProgramData',
-            'System Volume Information', '$Recycle.Bin', 'AppData'
-        }
+        exclude_dirs = default_exclude_dirs()
+        self.results_threshold = size_threshold_mb * 1024 * 1024
+        self.results_roots = roots
+        # Правила разбираются один раз и потом проверяются для каждого изменения
+        self.results_exclude_dirs = folder_scanner.ExcludeMatcher(exclude_dirs)
+        self.results_top_k = self.top_k_spin.value()
         
         # Обновляем интерфейс
         self.scan_button.setEnabled(False)
         self.stop_button.setEnabled(True)
+        # Доля выполненной работы оценивается по прошлому сканированию тех же папок
+        self.progress_bar.setRange(0, 100)
         self.progress_bar.setValue(0)
-        self.progress_label.setText("Подготовка к сканированию...")
+        self.progress_label.setText("Сканирование папок...")
         self.status_label.setText("Сканирование запущено...")
         
         # Запускаем сканирование в отдельном потоке
-        self.scan_worker = ScanWorker(root_path, size_threshold_mb, exclude_dirs)
+        self.scan_worker = ScanWorker(roots, size_threshold_mb, exclude_dirs,
+                                      threads=self.threads_spin.value(),
+                                      dedupe_hard_links=self.dedupe_links_check.isChecked(),
+                                      incremental=self.incremental_check.isChecked(),
+                                      build_size_tree=self.watch_changes_check.isChecked(),
+                                      top_k=self.results_top_k,
+                                      exclude_nested=self.exclude_nested_check.isChecked(),
+                                      largest_files=100,
+                                      one_file_system=self.one_file_system_check.isChecked())
+        self.results_options = self.scan_worker.scan_options
         self.scan_worker.progress_update.connect(self.update_progress)
+        self.scan_worker.size_tree_ready.connect(self.start_folder_watcher)
+        self.scan_worker.file_stats_ready.connect(self.show_file_stats)
+        self.scan_worker.mounts_skipped.connect(self.set_skipped_mounts)
+        self.scan_worker.stats_ready.connect(self.set_scan_stats)
         self.scan_worker.folder_found.connect(self.add_folder_to_results)
         self.scan_worker.scan_complete.connect(self.scan_finished)
         self.scan_worker.folder_count_update.connect(self.update_folder_count)
+        self.scan_worker.scan_progress.connect(self.update_scan_progress)
         self.scan_worker.start()
     
     def update_folder_count(self, count):
         self.progress_label.setText(f"Сканирование папок: найдено {count} папок для проверки")
     
+    def update_scan_progress(self, dirs_scanned, bytes_scanned):
+        self.progress_label.setText(
+            f"Просканировано папок: {dirs_scanned} ({format_size(bytes_scanned)})")
+    
     def update_progress(self, value):
         self.progress_bar.setValue(value)
     
-    def add_folder_to_results(self, path, size):
+    def add_folder_to_results(self, path, size, allocated_size, class_sizes):
         # Добавляем папку в список
-        self.large_folders.append((path, size))
+        self.large_folders.append((path, size, allocated_size, class_sizes))
+        self.add_result_row(path, size, allocated_size, class_sizes)
         
+        # Обновляем статус
+        self.status_label.setText(f"Найдено папок: {len(self.large_folders)}")
+    
+    def add_result_row(self, path, size, allocated_size, class_sizes):
         # Добавляем строку в таблицу
         row = self.results_table.rowCount()
         self.results_table.insertRow(row)
@@ -965,26 +1439,139 @@ class MainWindow(QMainWindow):
         size_item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
         self.results_table.setItem(row, 1, size_item)
         
+        # Место на диске: столько освободится после удаления
+        allocated_item = QTableWidgetItem(format_size(allocated_size))
+        allocated_item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+        self.results_table.setItem(row, 2, allocated_item)
+        
+        # Из чего состоит папка: собрано при сканировании, диск заново не читается
+        contents_item = QTableWidgetItem(folder_scanner.describe_class_sizes(class_sizes))
+        if class_sizes:
+            contents_item.setToolTip("\n".join(
+                f"{name}: {format_size(class_size)}"
+                for name, class_size in zip(folder_scanner.FILE_CLASS_NAMES, class_sizes) if class_size))
+        self.results_table.setItem(row, 3, contents_item)
+        
         # Кнопка удаления
         delete_button = QPushButton("Удалить")
         delete_button.setObjectName("deleteButton")
         delete_button.setIcon(self.style().standardIcon(QStyle.SP_TrashIcon))
         delete_button.clicked.connect(lambda: self.delete_folder(row))
         
-        self.results_table.setCellWidget(row, 2, delete_button)
+        self.results_table.setCellWidget(row, 4, delete_button)
+    
+    def sort_results(self):
+        """Упорядочивает найденные папки по убыванию размера."""
+        # Во время сканирования папки приходят в порядке завершения обхода
+        self.large_folders.sort(key=lambda folder: folder[1], reverse=True)
+        # Каждый корень отдает свои top_k папок, а показать нужно top_k из всех
+        if self.results_top_k:
+            del self.large_folders[self.results_top_k:]
+        self.results_table.setUpdatesEnabled(False)
+        self.results_table.setRowCount(0)
+        for path, size, allocated_size, class_sizes in self.large_folders:
+            self.add_result_row(path, size, allocated_size, class_sizes)
+        self.results_table.setUpdatesEnabled(True)
+    
+    def show_file_stats(self, largest_files, histogram):
+        """Заполняет вкладки с самыми большими файлами и распределением по размеру."""
+        self.files_table.setRowCount(0)
+        self.histogram_table.setRowCount(0)
+        if largest_files is None:
+            # Результат взят из индекса или повторного сканирования, файлы не читались
+            self.files_table.setRowCount(1)
+            self.files_table.setSpan(0, 0, 1, 3)
+            self.files_table.setItem(0, 0, QTableWidgetItem(
+                "Файлы учитываются только при полном сканировании: снимите флажок «Только изменения»"))
+            return
         
-        # Обновляем статус
-        self.status_label.setText(f"Найдено папок: {len(self.large_folders)}")
+        self.files_table.clearSpans()
+        for file in largest_files:
+            row = self.files_table.rowCount()
+            self.files_table.insertRow(row)
+            self.files_table.setItem(row, 0, QTableWidgetItem(file.path))
+            for column, size in ((1, file.size), (2, file.allocated_size)):
+                item = QTableWidgetItem(format_size(size))
+                item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.files_table.setItem(row, column, item)
+        
+        total_bytes = sum(histogram.bytes) or 1
+        for bucket, count in enumerate(histogram.counts):
+            if not count:
+                continue
+            if bucket == 0:
+                label = "пустые"
+            else:
+                label = f"{format_size(2 ** (bucket - 1))} – {format_size(2 ** bucket)}"
+            row = self.histogram_table.rowCount()
+            self.histogram_table.insertRow(row)
+            self.histogram_table.setItem(row, 0, QTableWidgetItem(label))
+            count_item = QTableWidgetItem(str(count))
+            count_item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+            self.histogram_table.setItem(row, 1, count_item)
+            bytes_item = QTableWidgetItem(format_size(histogram.bytes[bucket]))
+            bytes_item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+            self.histogram_table.setItem(row, 2, bytes_item)
+            share = QProgressBar()
+            share.setRange(0, 1000)
+            share.setValue(histogram.bytes[bucket] * 1000 // total_bytes)
+            share.setFormat(f"{histogram.bytes[bucket] * 100 / total_bytes:.1f}%")
+            self.histogram_table.setCellWidget(row, 3, share)
+    
+    def start_folder_watcher(self, size_tree):
+        watcher = FolderWatcher(size_tree, self.watcher_signals.folders_changed.emit)
+        watcher.start()
+        self.folder_watchers.append(watcher)
+    
+    def stop_folder_watcher(self):
+        for watcher in self.folder_watchers:
+            watcher.stop()
+        self.folder_watchers = []
+    
+    def apply_folder_changes(self, changed, removed):
+        """Применяет к результатам изменения размеров, найденные наблюдателем."""
+        if not self.folder_watchers:
+            return
+        folders = {os.path.normpath(str(folder[0])): folder for folder in self.large_folders}
+        for removed_path in removed:
+            removed_path = os.path.normpath(removed_path)
+            prefix = os.path.join(removed_path, '')
+            for key in [key for key in folders if key == removed_path or key.startswith(prefix)]:
+                del folders[key]
+        for folder in changed:
+            if folder_scanner.is_excluded(folder.path, self.results_exclude_dirs):
+                continue
+            key = os.path.normpath(folder.path)
+            if folder.size > self.results_threshold:
+                # Наблюдатель не читает файлы, поэтому состав папки
+                # остается известным, только пока не изменился её размер
+                old = folders.get(key)
+                class_sizes = old[3] if old is not None and old[1] == folder.size else []
+                folders[key] = (Path(folder.path), folder.size, folder.allocated_size, class_sizes)
+            else:
+                folders.pop(key, None)
+        # Между сканированиями история пополняется размерами от наблюдателя;
+        # частые изменения в пределах часа хранятся одной записью
+        try:
+            size_history.record(((folder.path, folder.size) for folder in changed), tracked_only=True)
+        except sqlite3.Error as e:
+            print(f"Ошибка записи истории размеров: {e}")
+        self.large_folders = sorted(folders.values(), key=lambda folder: folder[1], reverse=True)
+        if self.results_top_k:
+            del self.large_folders[self.results_top_k:]
+        self.sort_results()
+        self.status_label.setText(f"Найдено {len(self.large_folders)} папок, превышающих указанный размер")
     
     def delete_folder(self, row):
         path = self.results_table.item(row, 0).text()
         size = self.results_table.item(row, 1).text()
+        allocated_size = self.results_table.item(row, 2).text()
         
         # Запрашиваем подтверждение
         reply = QMessageBox.question(
             self, 
             "Подтверждение удаления", 
-            f"Вы уверены, что хотите удалить папку:\n{path}\nРазмер: {size}",
+            f"Вы уверены, что хотите удалить папку:\n{path}\nРазмер: {size} (на диске {allocated_size})",
             QMessageBox.Yes | QMessageBox.No, 
             QMessageBox.No
         )
@@ -1001,7 +1588,60 @@ class MainWindow(QMainWindow):
             else:
                 QMessageBox.warning(self, "Ошибка", f"Не удалось удалить папку {path}")
     
+    def start_duplicate_search(self):
+        root_path = self.drive_combo.currentText()
+        if not os.path.exists(root_path):
+            QMessageBox.warning(self, "Ошибка", "Указанный путь не существует.")
+            return
+        
+        exclude_dirs = default_exclude_dirs()
+        self.duplicates_tree.clear()
+        self.results_tabs.setCurrentWidget(self.duplicates_tree)
+        self.duplicates_button.setEnabled(False)
+        self.stop_button.setEnabled(True)
+        self.progress_bar.setRange(0, 0)
+        self.status_label.setText("Поиск дубликатов запущен...")
+        
+        self.duplicate_worker = DuplicateWorker(root_path, exclude_dirs,
+                                                threads=self.threads_spin.value())
+        self.duplicate_worker.progress.connect(self.update_duplicate_progress)
+        self.duplicate_worker.duplicates_found.connect(self.show_duplicates)
+        self.duplicate_worker.finished.connect(self.duplicate_search_finished)
+        self.duplicate_worker.start()
+    
+    def update_duplicate_progress(self, stage, done, total):
+        if stage == "scan":
+            self.progress_label.setText(f"Поиск дубликатов: найдено файлов {done}")
+            return
+        stage_name = "сравнение начала и конца файлов" if stage == "partial" else "сравнение содержимого"
+        self.progress_bar.setRange(0, max(total, 1))
+        self.progress_bar.setValue(done)
+        self.progress_label.setText(f"Поиск дубликатов: {stage_name} ({done} из {total})")
+    
+    def show_duplicates(self, groups):
+        self.duplicates_tree.setUpdatesEnabled(False)
+        for group in groups:
+            group_item = QTreeWidgetItem(self.duplicates_tree, [
+                f"Одинаковых файлов: {len(group.paths)}", format_size(group.size),
+                format_size(group.reclaimable)])
+            for path in group.paths:
+                QTreeWidgetItem(group_item, [path, format_size(group.size), ""])
+        self.duplicates_tree.setUpdatesEnabled(True)
+        reclaimable = sum(group.reclaimable for group in groups)
+        self.status_label.setText(
+            f"Найдено групп дубликатов: {len(groups)}, можно освободить {format_size(reclaimable)}")
+    
+    def duplicate_search_finished(self):
+        self.duplicates_button.setEnabled(True)
+        self.stop_button.setEnabled(self.scan_worker is not None and self.scan_worker.isRunning())
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setValue(100)
+        self.progress_label.setText("Поиск дубликатов завершен")
+    
     def stop_scan(self):
+        if self.duplicate_worker and self.duplicate_worker.isRunning():
+            self.duplicate_worker.stop()
+            self.status_label.setText("Поиск дубликатов остановлен пользователем")
         if self.scan_worker and self.scan_worker.isRunning():
             self.scan_worker.stop()
             self.status_label.setText("Сканирование остановлено пользователем")
@@ -1019,15 +1659,209 @@ class MainWindow(QMainWindow):
     def scan_finished(self):
         self.scan_button.setEnabled(True)
         self.stop_button.setEnabled(False)
+        self.progress_bar.setRange(0, 100)
         self.progress_bar.setValue(100)
+        self.sort_results()
         self.progress_label.setText("Сканирование завершено")
         
         if not self.large_folders:
-            self.status_label.setText("Папки, превышающие указанный размер, не найдены")
+            status = "Папки, превышающие указанный размер, не найдены"
             self.ai_button.setEnabled(False)  # Отключаем кнопку AI, если нет результатов
         else:
-            self.status_label.setText(f"Найдено {len(self.large_folders)} папок, превышающих указанный размер")
+            status = f"Найдено {len(self.large_folders)} папок, превышающих указанный размер"
             self.ai_button.setEnabled(True)  # Включаем кнопку AI, если есть результаты
+        if self.skipped_mounts:
+            status += f"; пропущено подключенных дисков: {len(self.skipped_mounts)}"
+        details = []
+        stats = self.scan_stats
+        if stats is not None:
+            errors = stats.permission_errors + stats.not_found_errors + stats.other_errors
+            status += f"; прочитано папок: {stats.dirs_opened} за {stats.wall_time:.1f} с"
+            if errors:
+                status += f", ошибок: {errors}"
+            details = [
+                f"Папок прочитано: {stats.dirs_opened}, записей: {stats.entries_read}",
+                f"Файлов учтено: {stats.files_counted} ({format_size(stats.bytes_summed)})",
+                f"Запросов атрибутов: {stats.stat_calls}, проверок исключений: {stats.exclude_checks}",
+                f"Не прочитано: исключенных папок {stats.dirs_pruned}, "
+                f"подключенных дисков {stats.mounts_skipped}, ссылок {stats.links_skipped}",
+                f"Ошибки: нет доступа {stats.permission_errors}, "
+                f"исчезли во время обхода {stats.not_found_errors}, прочие {stats.other_errors}",
+                f"Время: всего {stats.wall_time:.2f} с, обновление окна {stats.callback_time:.2f} с, "
+                f"сборка дерева {stats.tree_time:.2f} с",
+            ]
+        self.status_label.setText(status)
+        self.status_label.setToolTip("\n".join(details + self.skipped_mounts))
+        self.update_cold_folders()
+        self.update_growth()
+        self.update_trends()
+        self.show_treemap()
+    
+    def show_treemap(self):
+        """Строит карту папок по индексу, сохраненному после сканирования."""
+        if not self.results_roots:
+            return
+        # Карта строится по одному дереву: при сканировании нескольких корней — по первому
+        hit = dir_index_store.lookup(str(self.results_roots[0]), include_stale=True, options=self.results_options)
+        if hit is None:
+            return
+        index, node = hit
+        self.treemap_view.set_treemap(TreemapLayout(index), node)
+    
+    def update_cold_folders(self):
+        """Заполняет вкладку папок, в которых больше всего давно не менявшихся файлов."""
+        self.cold_table.setRowCount(0)
+        self.cold_table.clearSpans()
+        min_age_days = self.cold_age_combo.currentData()
+        # Возраст файлов есть только в индексе: он сохраняется после каждого сканирования
+        hits = [hit for hit in (dir_index_store.lookup(str(root), include_stale=True, options=self.results_options)
+                                for root in self.results_roots) if hit is not None]
+        if not hits:
+            return
+        folders = []
+        for index, node in hits:
+            with index:
+                folders.extend((folder, index.scan_time) for folder in index.cold_folders(
+                    min_age_days, self.results_threshold, self.results_exclude_dirs, node, top_k=100))
+        # Папки всех корней сводятся в один список по объему давно не менявшихся данных
+        folders.sort(key=lambda item: folder_scanner.cold_size(item[0].age_sizes, min_age_days), reverse=True)
+        del folders[100:]
+        if not folders:
+            self.cold_table.setRowCount(1)
+            self.cold_table.setSpan(0, 0, 1, 5)
+            self.cold_table.setItem(0, 0, QTableWidgetItem(
+                "Нет папок, где давно не менявшиеся файлы занимают больше указанного размера"))
+            return
+        
+        for folder, scan_time in folders:
+            cold = folder_scanner.cold_size(folder.age_sizes, min_age_days)
+            row = self.cold_table.rowCount()
+            self.cold_table.insertRow(row)
+            self.cold_table.setItem(row, 0, QTableWidgetItem(folder.path))
+            share = QProgressBar()
+            share.setRange(0, 1000)
+            share.setValue(cold * 1000 // (folder.size or 1))
+            share.setFormat(f"{cold * 100 / (folder.size or 1):.0f}%")
+            self.cold_table.setCellWidget(row, 2, share)
+            # Возраст считается от времени сканирования, а не от текущего момента
+            days = int(scan_time - folder.newest_mtime / 1e9) // 86400
+            newest = time.strftime("%d.%m.%Y", time.localtime(folder.newest_mtime / 1e9))
+            for column, text in ((1, format_size(cold)), (3, f"{newest} ({days} дн. назад)"),
+                                 (4, format_size(folder.size))):
+                item = QTableWidgetItem(text)
+                item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.cold_table.setItem(row, column, item)
+    
+    def update_growth(self):
+        """Заполняет вкладку с папками, которые выросли, появились или исчезли со времени снимка."""
+        self.growth_table.setRowCount(0)
+        self.growth_table.clearSpans()
+        self.growth_base_label.setText("")
+        days = self.growth_base_combo.currentData()
+        grown, appeared, vanished = [], [], []
+        base_times = []
+        for root in self.results_roots:
+            hit = dir_index_store.lookup(str(root), include_stale=True, options=self.results_options)
+            if hit is None:
+                continue
+            new, new_node = hit
+            with new:
+                # Снимки хранятся для корня индекса, который может быть родителем папки сканирования
+                moment = new.scan_time - days * 86400 if days else new.scan_time - 0.01
+                snapshot = dir_index_store.snapshot_before(new.root_path, moment, new.options)
+                if snapshot is None:
+                    continue
+                try:
+                    old = snapshot.open()
+                except (OSError, ValueError) as e:
+                    print(f"Ошибка при загрузке снимка {snapshot.file}: {e}")
+                    continue
+                with old:
+                    old_node = old.find(new.path(new_node))
+                    if old_node is None:
+                        continue
+                    diff = diff_indexes(old, new, self.results_threshold, self.results_exclude_dirs,
+                                        old_node, new_node, top_k=100)
+                base_times.append(diff.old_time)
+                grown.extend(getattr(diff, self.growth_order_combo.currentData()))
+                appeared.extend(diff.appeared)
+                vanished.extend(diff.vanished)
+
+        if not base_times:
+            self.growth_table.setRowCount(1)
+            self.growth_table.setSpan(0, 0, 1, 5)
+            self.growth_table.setItem(0, 0, QTableWidgetItem(
+                "Нет более раннего сканирования этой папки для сравнения"))
+            return
+        self.growth_base_label.setText(
+            "снимок от " + time.strftime("%d.%m.%Y %H:%M", time.localtime(min(base_times))))
+        if self.growth_order_combo.currentData() == 'grown':
+            grown.sort(key=lambda change: change.growth, reverse=True)
+        else:
+            grown.sort(key=lambda change: change.ratio, reverse=True)
+        appeared.sort(key=lambda change: change.new_size, reverse=True)
+        vanished.sort(key=lambda change: change.old_size, reverse=True)
+        
+        rows = ([(change, "выросла") for change in grown[:100]] +
+                [(change, "новая") for change in appeared[:100]] +
+                [(change, "исчезла") for change in vanished[:100]])
+        for change, kind in rows:
+            row = self.growth_table.rowCount()
+            self.growth_table.insertRow(row)
+            self.growth_table.setItem(row, 0, QTableWidgetItem(change.path))
+            self.growth_table.setItem(row, 1, QTableWidgetItem(kind))
+            growth = format_size(abs(change.growth))
+            if change.old_size and change.new_size:
+                growth = f"+{growth} (×{change.ratio:.1f})"
+            else:
+                growth = ("+" if change.growth > 0 else "−") + growth
+            for column, text in ((2, format_size(change.old_size) if change.old_size else "—"),
+                                 (3, format_size(change.new_size) if change.new_size else "—"),
+                                 (4, growth)):
+                item = QTableWidgetItem(text)
+                item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.growth_table.setItem(row, column, item)
+    
+    def update_trends(self):
+        """Заполняет вкладку с папками, которые по истории размеров растут быстрее всего."""
+        self.trend_table.setRowCount(0)
+        self.trend_table.clearSpans()
+        if not self.results_roots:
+            return
+        days = self.trend_period_combo.currentData()
+        since = time.time() - days * 86400 if days else 0
+        try:
+            trends = size_history.fastest_growing(since, 100, [str(root) for root in self.results_roots])
+        except sqlite3.Error as e:
+            print(f"Ошибка чтения истории размеров: {e}")
+            trends = []
+        if not trends:
+            self.trend_table.setRowCount(1)
+            self.trend_table.setSpan(0, 0, 1, 5)
+            self.trend_table.setItem(0, 0, QTableWidgetItem(
+                "Растущих папок нет: история появляется после нескольких сканирований"))
+            return
+        for trend in trends:
+            row = self.trend_table.rowCount()
+            self.trend_table.insertRow(row)
+            self.trend_table.setRowHeight(row, 28)
+            self.trend_table.setItem(row, 0, QTableWidgetItem(trend.path))
+            sparkline = QTableWidgetItem()
+            sparkline.setData(Qt.UserRole, trend.points)
+            sparkline.setToolTip(" → ".join(format_size(size) for _, size in downsample(trend.points, 8)))
+            self.trend_table.setItem(row, 1, sparkline)
+            for column, text in ((2, "+" + format_size(int(trend.rate))),
+                                 (3, ("+" if trend.growth >= 0 else "−") + format_size(abs(trend.growth))),
+                                 (4, format_size(trend.size))):
+                item = QTableWidgetItem(text)
+                item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.trend_table.setItem(row, column, item)
+
+    def set_skipped_mounts(self, mounts):
+        self.skipped_mounts = mounts
+    
+    def set_scan_stats(self, stats):
+        self.scan_stats = stats
     
     def show_ai_assistant(self):
         """Показывает диалоговое окно AI ассистента для анализа папок."""
@@ -1037,9 +1871,10 @@ class MainWindow(QMainWindow):
         
         # Подготавливаем список папок для анализа в формате, который ожидает AI ассистент
         folders_for_analysis = []
-        for path, size in self.large_folders:
+        for path, size, _, class_sizes in self.large_folders:
             formatted_size = format_size(size)
-            folders_for_analysis.append((str(path), size, formatted_size))
+            contents = folder_scanner.describe_class_sizes(class_sizes, limit=len(class_sizes))
+            folders_for_analysis.append((str(path), size, formatted_size, contents))
         
         # Вызываем диалоговое окно AI ассистента
         show_ai_assistant_dialog(self, folders_for_analysis)
@@ -1544,6 +2379,7 @@ class MainWindow(QMainWindow):
                 if reply == QMessageBox.Yes:
                     try:
                         self.settings.sync()
+                        self.stop_folder_watcher()
                         if global_tray_icon:
                             global_tray_icon.hide()
                         event.accept()
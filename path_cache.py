@@ -31,6 +31,7 @@ class PathCache:
             cache_dir = Path(os.getenv('APPDATA')) / 'SkripClean' / 'cache'
             cache_dir.mkdir(parents=True, exist_ok=True)
             
+        self.cache_dir = cache_dir
         self.cache_file = str(cache_dir / 'path_cache.json')
         self.cache_ttl = cache_ttl
         self.cache: Dict[str, dict] = {}
@@ -0,0 +1,392 @@
+"""
+Замеры скорости сканера на синтетических деревьях папок.
+
+Деревья генерируются воспроизводимо (одинаковые seed и масштаб дают одинаковые
+имена и размеры) и описываются формой TreeShape: глубокое и узкое, широкое
+и плоское, много мелких файлов, несколько огромных разреженных файлов.
+Каждый замер запускается в отдельном процессе, чтобы пиковая память относилась
+только к нему, а результаты выводятся в JSON для сравнения между версиями:
+
+    python scan_benchmark.py --output bench.json
+    python scan_benchmark.py --trees wide,tiny_files --threads 1,4 --repeat 5
+
+Диск не сбрасывается между повторами, поэтому замеряется обход с прогретым
+кешем файловой системы: он показывает стоимость самого сканера, а не диска.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import folder_scanner
+from dir_index import DirIndex
+
+try:
+    import folder_search_cpp
+except ImportError:
+    folder_search_cpp = None
+
+# Файл в корне сгенерированного дерева: по нему дерево той же формы не создается заново
+_MARKER = '.scan_benchmark.json'
+# Порог крупных папок для find_large_folders и сканирования, как у окна программы по умолчанию
+_THRESHOLD_MB = 1
+
+
+@dataclass(frozen=True)
+class TreeShape:
+    """
+    Форма синтетического дерева.
+
+    fanouts[i] — сколько подпапок у каждой папки уровня i; в каждой папке
+    files_per_dir файлов размером до max_file_size байт, а в корне еще
+    sparse_files разреженных файлов размером sparse_size.
+    """
+    name: str
+    fanouts: Tuple[int, ...]
+    files_per_dir: int = 0
+    max_file_size: int = 0
+    sparse_files: int = 0
+    sparse_size: int = 0
+
+    def scaled(self, scale: float) -> 'TreeShape':
+        """Та же форма, у которой число папок верхнего уровня умножено на scale."""
+        first = max(1, round(self.fanouts[0] * scale))
+        return TreeShape(self.name, (first,) + self.fanouts[1:], self.files_per_dir,
+                         self.max_file_size, self.sparse_files, self.sparse_size)
+
+
+SHAPES: Dict[str, TreeShape] = {shape.name: shape for shape in (
+    # 50 цепочек по 60 папок: длинные пути и мало работы на каждую папку
+    TreeShape('deep', (50,) + (1,) * 59, files_per_dir=4, max_file_size=64 * 1024),
+    # Одна папка с 20 000 подпапок: стоимость очереди и словаря имен
+    TreeShape('wide', (20000,), files_per_dir=1, max_file_size=16 * 1024),
+    # 1000 папок по 100 файлов до 4 КБ: стоимость stat на каждый файл
+    TreeShape('tiny_files', (20, 50), files_per_dir=100, max_file_size=4096),
+    # Несколько файлов по 16 ГБ, которые почти не занимают места на диске
+    TreeShape('sparse', (4,), files_per_dir=2, max_file_size=4096,
+              sparse_files=2, sparse_size=16 * 1024 ** 3),
+)}
+
+OPERATIONS = ('find_large_folders', 'get_folder_size', 'count_folders',
+              'scan_worker', 'scan_worker_incremental')
+
+
+@dataclass
+class TreeStats:
+    """Сколько папок, файлов и байт в сгенерированном дереве (без служебного файла)"""
+    dirs: int = 0
+    files: int = 0
+    bytes: int = 0
+
+
+@dataclass
+class BenchmarkResult:
+    """Замер одной операции на одном дереве"""
+    tree: str
+    operation: str
+    # "native" или "python"
+    backend: str
+    threads: int
+    dirs: int
+    files: int
+    # Медиана времени повторов в секундах
+    wall_time: float
+    # Записей папок (файлов и подпапок) в секунду по медиане
+    entries_per_s: float
+    # Пиковая память процесса замера в байтах; None, если её не узнать
+    peak_rss: Optional[int]
+    wall_times: List[float] = field(default_factory=list)
+
+
+def _make_sparse(f) -> None:
+    """На NTFS файл без этого флага при увеличении размера занимает место целиком."""
+    if os.name != 'nt':
+        return
+    import ctypes
+    import msvcrt
+    from ctypes import wintypes
+    fsctl_set_sparse = 0x000900C4
+    returned = wintypes.DWORD()
+    ctypes.windll.kernel32.DeviceIoControl(
+        wintypes.HANDLE(msvcrt.get_osfhandle(f.fileno())), fsctl_set_sparse,
+        None, 0, None, 0, ctypes.byref(returned), None)
+
+
+def generate_tree(root: str, shape: TreeShape, seed: int = 0) -> TreeStats:
+    """
+    Создает дерево формы shape в папке root.
+
+    Если в root уже лежит дерево той же формы и seed (по служебному файлу),
+    оно используется повторно. Иначе root очищается и создается заново.
+
+    Returns:
+        TreeStats: Размер созданного дерева
+    """
+    spec = {'shape': asdict(shape), 'seed': seed}
+    marker = os.path.join(root, _MARKER)
+    try:
+        with open(marker, encoding='utf-8') as f:
+            saved = json.load(f)
+        if saved.get('spec') == spec:
+            return TreeStats(**saved['stats'])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    shutil.rmtree(root, ignore_errors=True)
+    os.makedirs(root)
+    rng = random.Random(seed)
+    stats = TreeStats(dirs=1)
+
+    def fill(path: str) -> None:
+        for i in range(shape.files_per_dir):
+            size = rng.randint(0, shape.max_file_size)
+            with open(os.path.join(path, f'file{i:03d}.dat'), 'wb') as f:
+                f.write(b'\0' * size)
+            stats.files += 1
+            stats.bytes += size
+
+    # Обход в ширину по уровням, чтобы генератор случайных чисел шел в одном порядке
+    level = [root]
+    fill(root)
+    for fanout in shape.fanouts:
+        next_level = []
+        for parent in level:
+            for i in range(fanout):
+                path = os.path.join(parent, f'dir{i:05d}')
+                os.mkdir(path)
+                stats.dirs += 1
+                fill(path)
+                next_level.append(path)
+        level = next_level
+
+    for i in range(shape.sparse_files):
+        with open(os.path.join(root, f'sparse{i}.img'), 'wb') as f:
+            _make_sparse(f)
+            f.truncate(shape.sparse_size)
+        stats.files += 1
+        stats.bytes += shape.sparse_size
+
+    with open(marker, 'w', encoding='utf-8') as f:
+        json.dump({'spec': spec, 'stats': asdict(stats)}, f)
+    return stats
+
+
+def _peak_rss() -> Optional[int]:
+    """Пиковая память текущего процесса в байтах."""
+    # В Linux ru_maxrss наследуется через fork и exec, и замер получал бы пик
+    # родительского процесса; VmHWM относится только к памяти самого замера
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux отдает килобайты, macOS — байты
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+    except (ImportError, AttributeError):
+        return None
+
+
+def _scan_worker_options() -> dict:
+    """Параметры, с которыми сканирует окно программы (ScanWorker)."""
+    return {'collect_tree': True, 'top_k': 1000, 'largest_files': 100,
+            'size_histogram': True, 'file_classes': True, 'prune_excluded': True,
+            'one_file_system': True}
+
+
+def _operation(case: dict):
+    """Функция без аргументов, выполняющая замеряемую операцию."""
+    root = case['root']
+    threads = case['threads']
+    scanner = folder_search_cpp if case['backend'] == 'native' else folder_scanner
+    operation = case['operation']
+    if operation == 'find_large_folders':
+        return lambda: scanner.find_large_folders(root, _THRESHOLD_MB, set(), threads)
+    if operation == 'get_folder_size':
+        return lambda: scanner.get_folder_size(root, threads)
+    if operation == 'count_folders':
+        return lambda: scanner.count_folders(root, set())
+    if operation == 'scan_worker':
+        return lambda: scanner.scan_folders(root, _THRESHOLD_MB, set(), threads=threads,
+                                            **_scan_worker_options())
+    if operation == 'scan_worker_incremental':
+        # Как и в окне программы, повторное сканирование по индексу выполняет сканер на Python
+        def rescan():
+            with DirIndex(case['index']) as previous:
+                folder_scanner.scan_folders(root, _THRESHOLD_MB, set(), threads=threads,
+                                            previous=previous, **_scan_worker_options())
+        return rescan
+    raise ValueError(f"Неизвестная операция: {operation}")
+
+
+def run_case(case: dict) -> dict:
+    """
+    Выполняет один замер в текущем процессе: прогревочный запуск и case['repeat'] повторов.
+
+    Returns:
+        dict: Времена повторов и пиковая память процесса
+    """
+    run = _operation(case)
+    run()
+    times = []
+    for _ in range(case['repeat']):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return {'wall_times': times, 'peak_rss': _peak_rss()}
+
+
+def _run_isolated(case: dict) -> dict:
+    """Выполняет замер в отдельном процессе, чтобы пиковая память не копилась между замерами."""
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--run-case', json.dumps(case)],
+        capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Замер {case['operation']} завершился с ошибкой:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _write_index(root: str, path: str) -> None:
+    """Индекс первого сканирования для scan_worker_incremental."""
+    scanner = folder_search_cpp or folder_scanner
+    result = scanner.scan_folders(root, _THRESHOLD_MB, set(), collect_tree=True, file_classes=True)
+    DirIndex.write(path, root, result.tree)
+
+
+def run_benchmarks(base_dir: str, shapes: List[TreeShape], operations: List[str],
+                   threads: List[int], repeat: int = 3, seed: int = 0,
+                   backends: Optional[List[str]] = None,
+                   log=None) -> List[BenchmarkResult]:
+    """
+    Генерирует деревья в base_dir и замеряет на них операции.
+
+    Args:
+        base_dir (str): Папка для деревьев; дерево каждой формы лежит в своей подпапке
+        shapes: Формы деревьев
+        operations: Операции из OPERATIONS
+        threads: Количества потоков; count_folders однопоточный и замеряется один раз
+        repeat (int): Сколько раз повторить каждый замер после прогревочного запуска
+        seed (int): Seed генератора деревьев
+        backends: "native" и/или "python"; по умолчанию — все доступные
+        log: Получает строку о каждом шаге
+
+    Returns:
+        List[BenchmarkResult]: Результаты в порядке замеров
+    """
+    if backends is None:
+        backends = (['native'] if folder_search_cpp is not None else []) + ['python']
+    results = []
+    for shape in shapes:
+        root = os.path.join(base_dir, shape.name)
+        if log:
+            log(f"Дерево {shape.name}...")
+        stats = generate_tree(root, shape, seed)
+        index_path = os.path.join(base_dir, f'{shape.name}.idx')
+        if 'scan_worker_incremental' in operations:
+            _write_index(root, index_path)
+
+        for operation in operations:
+            # Повторное сканирование по индексу есть только у сканера на Python
+            operation_backends = ['python'] if operation == 'scan_worker_incremental' else backends
+            operation_threads = threads[:1] if operation == 'count_folders' else threads
+            for backend in operation_backends:
+                for thread_count in operation_threads:
+                    case = {'root': root, 'index': index_path, 'operation': operation,
+                            'backend': backend, 'threads': thread_count, 'repeat': repeat}
+                    measured = _run_isolated(case)
+                    wall_time = statistics.median(measured['wall_times'])
+                    result = BenchmarkResult(
+                        shape.name, operation, backend, thread_count, stats.dirs, stats.files,
+                        wall_time, (stats.dirs + stats.files) / wall_time if wall_time else 0.0,
+                        measured['peak_rss'], measured['wall_times'])
+                    results.append(result)
+                    if log:
+                        log(f"  {operation} {backend} x{thread_count}: {wall_time:.3f} с, "
+                            f"{result.entries_per_s:,.0f} записей/с")
+    return results
+
+
+def report(results: List[BenchmarkResult], shapes: List[TreeShape], seed: int) -> dict:
+    """Отчет для JSON: окружение, формы деревьев и результаты."""
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'native': folder_search_cpp is not None,
+        'seed': seed,
+        'shapes': [asdict(shape) for shape in shapes],
+        'results': [asdict(result) for result in results],
+    }
+
+
+def _parse_list(text: str) -> List[str]:
+    return [item.strip() for item in text.split(',') if item.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Замеры скорости сканера на синтетических деревьях")
+    parser.add_argument('--dir', help="Папка для деревьев; по умолчанию временная, удаляется после замеров")
+    parser.add_argument('--trees', default=','.join(SHAPES), help="Формы деревьев через запятую")
+    parser.add_argument('--operations', default=','.join(OPERATIONS), help="Операции через запятую")
+    parser.add_argument('--backends', help="native и/или python через запятую")
+    parser.add_argument('--threads', default=f"1,{os.cpu_count() or 1}", help="Количества потоков через запятую")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--scale', type=float, default=1.0, help="Множитель числа папок верхнего уровня")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Файл для JSON; по умолчанию — стандартный вывод")
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case))))
+        return 0
+
+    unknown = [name for name in _parse_list(args.trees) if name not in SHAPES]
+    unknown += [name for name in _parse_list(args.operations) if name not in OPERATIONS]
+    if unknown:
+        parser.error(f"неизвестные деревья или операции: {', '.join(unknown)}")
+    backends = _parse_list(args.backends) if args.backends else None
+    if backends and 'native' in backends and folder_search_cpp is None:
+        parser.error("нативный модуль folder_search_cpp не собран")
+
+    shapes = [SHAPES[name].scaled(args.scale) for name in _parse_list(args.trees)]
+    threads = sorted({int(count) for count in _parse_list(args.threads)})
+    base_dir = args.dir or tempfile.mkdtemp(prefix='scan_benchmark_')
+    try:
+        results = run_benchmarks(base_dir, shapes, _parse_list(args.operations), threads,
+                                 args.repeat, args.seed, backends,
+                                 log=lambda line: print(line, file=sys.stderr))
+    finally:
+        if not args.dir:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    text = json.dumps(report(results, shapes, args.seed), ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,533 @@
+"""
+Сканирование нескольких корней (дисков, папок, сетевых ресурсов) за один сеанс.
+
+Корни сканируются параллельно, но не больше нескольких одновременно на одном
+физическом устройстве: два обхода одного жесткого диска гоняют головку между
+папками и вместе идут дольше, чем по очереди, а разные SSD и диски друг другу
+не мешают. Для этого каждый корень сопоставляется с физическим диском
+(разделы и тома одного диска дают один ключ), а диск — с типом носителя.
+Внутри корня на жестком диске обход идет в один поток по той же причине.
+
+Результаты корней объединяются в один список папок по убыванию размера.
+ProgressEstimator оценивает долю выполненной работы без отдельного прохода
+для подсчета папок. Модуль не зависит от Qt.
+"""
+import heapq
+import math
+import os
+import random
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from itertools import chain
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+import folder_scanner
+from folder_scanner import ExcludeMatcher, ScanResult, ScanStats
+
+T = TypeVar('T')
+
+
+@dataclass(frozen=True)
+class DeviceInfo:
+    """Физическое устройство, на котором лежит корень сканирования"""
+    # Одинаков у всех разделов и томов одного диска
+    key: str
+    # True — жесткий диск, False — SSD, None — неизвестно (сеть, виртуальные ФС)
+    rotational: Optional[bool] = None
+    # Сетевая папка или файловая система: ключ — сервер
+    network: bool = False
+
+
+# Типы файловых систем Linux, которые лежат на другом компьютере
+NETWORK_FILESYSTEMS = frozenset((
+    'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'ncpfs', 'afs', '9p', 'ceph', 'glusterfs', 'lustre', 'gpfs',
+    'davfs', 'fuse.sshfs', 'fuse.glusterfs', 'fuse.davfs2', 'fuse.rclone', 'fuse.s3fs'))
+
+
+def _read_sys(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _mount_source(st_dev: int) -> Optional[Tuple[str, str]]:
+    """Тип и источник из /proc/self/mountinfo для файловой системы с анонимным номером (btrfs, сеть)."""
+    wanted = f"{os.major(st_dev)}:{os.minor(st_dev)}"
+    try:
+        with open('/proc/self/mountinfo') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 10 or parts[2] != wanted:
+                    continue
+                # После разделителя «-» идут тип файловой системы и источник
+                separator = parts.index('-', 6)
+                return parts[separator + 1], parts[separator + 2]
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _linux_device(path: str) -> DeviceInfo:
+    st_dev = os.stat(path).st_dev
+    if os.major(st_dev) == 0:
+        # Сетевые, виртуальные и btrfs: номер устройства ненастоящий, ищем источник монтирования
+        fstype, source = _mount_source(st_dev) or (None, None)
+        if fstype in NETWORK_FILESYSTEMS:
+            return DeviceInfo(f"net:{_network_host(source)}", network=True)
+        try:
+            st_dev = os.stat(source).st_rdev if source and source.startswith('/dev/') else 0
+        except OSError:
+            st_dev = 0
+        if not st_dev:
+            return DeviceInfo(f"mount:{source or os.stat(path).st_dev}")
+
+    block = os.path.realpath(f"/sys/dev/block/{os.major(st_dev)}:{os.minor(st_dev)}")
+    # LVM и шифрованные тома лежат поверх одного диска: спускаемся к нему
+    while True:
+        slaves = os.path.join(block, 'slaves')
+        try:
+            under = os.listdir(slaves)
+        except OSError:
+            break
+        if len(under) != 1:
+            break
+        block = os.path.realpath(os.path.join(slaves, under[0]))
+    # Раздел — подпапка своего диска в /sys
+    if os.path.exists(os.path.join(block, 'partition')):
+        block = os.path.dirname(block)
+    rotational = _read_sys(os.path.join(block, 'queue', 'rotational'))
+    return DeviceInfo(f"block:{os.path.basename(block)}",
+                      None if rotational is None else rotational == '1')
+
+
+def _network_host(source: str) -> str:
+    """Сервер из источника сетевого монтирования: //сервер/ресурс, сервер:/путь или user@сервер:путь."""
+    if source.startswith(('//', '\\\\')):
+        return source.replace('\\', '/').split('/')[2].lower()
+    if ':' in source:
+        return source.split(':', 1)[0].rsplit('@', 1)[-1].lower()
+    return source
+
+
+def _windows_device(path: str) -> DeviceInfo:
+    import ctypes
+    from ctypes import wintypes
+
+    drive = os.path.splitdrive(os.path.abspath(path))[0]
+    if drive.startswith('\\\\'):
+        # Сетевая папка \\сервер\ресурс: все ресурсы сервера — одно устройство
+        return DeviceInfo(drive.split('\\')[2].lower(), network=True)
+
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    kernel32.CreateFileW.restype = wintypes.HANDLE
+    kernel32.CreateFileW.argtypes = (wintypes.LPCWSTR, wintypes.DWORD, wintypes.DWORD, wintypes.LPVOID,
+                                     wintypes.DWORD, wintypes.DWORD, wintypes.HANDLE)
+    kernel32.DeviceIoControl.argtypes = (wintypes.HANDLE, wintypes.DWORD, wintypes.LPVOID, wintypes.DWORD,
+                                         wintypes.LPVOID, wintypes.DWORD, ctypes.POINTER(wintypes.DWORD),
+                                         wintypes.LPVOID)
+    kernel32.GetDriveTypeW.argtypes = (wintypes.LPCWSTR,)
+    invalid_handle = wintypes.HANDLE(-1).value
+
+    if kernel32.GetDriveTypeW(drive + '\\') == 4:  # DRIVE_REMOTE
+        # Сетевой диск с буквой: тот же сервер, что и у его пути \\сервер\ресурс
+        remote = ctypes.create_unicode_buffer(1024)
+        length = wintypes.DWORD(len(remote))
+        if (ctypes.WinDLL('mpr').WNetGetConnectionW(drive, remote, ctypes.byref(length)) == 0
+                and remote.value.startswith('\\\\')):
+            return DeviceInfo(remote.value.split('\\')[2].lower(), network=True)
+        return DeviceInfo(drive.upper(), network=True)
+
+    def ioctl(device: str, code: int, query: bytes, size: int) -> Optional[bytes]:
+        # Без прав на чтение: для запросов о устройстве администратор не нужен
+        handle = kernel32.CreateFileW(device, 0, 3, None, 3, 0, None)  # FILE_SHARE_READ | FILE_SHARE_WRITE, OPEN_EXISTING
+        if handle == invalid_handle:
+            return None
+        try:
+            output = ctypes.create_string_buffer(size)
+            returned = wintypes.DWORD()
+            query_buffer = ctypes.create_string_buffer(query, len(query)) if query else None
+            if not kernel32.DeviceIoControl(handle, code, query_buffer, len(query), output, size,
+                                            ctypes.byref(returned), None):
+                return None
+            return output.raw[:returned.value]
+        finally:
+            kernel32.CloseHandle(handle)
+
+    key = drive.upper()
+    # IOCTL_VOLUME_GET_VOLUME_DISK_EXTENTS: номер диска у тома на одном диске
+    extents = ioctl(f"\\\\.\\{drive}", 0x560000, b'', 32)
+    if extents is None or len(extents) < 12 or int.from_bytes(extents[:4], 'little') != 1:
+        return DeviceInfo(key)
+    disk = int.from_bytes(extents[8:12], 'little')
+    # IOCTL_STORAGE_QUERY_PROPERTY, StorageDeviceSeekPenaltyProperty: есть ли задержка позиционирования
+    penalty = ioctl(f"\\\\.\\PhysicalDrive{disk}", 0x2D1400,
+                    (7).to_bytes(4, 'little') + bytes(8), 12)
+    rotational = bool(penalty[8]) if penalty is not None and len(penalty) > 8 else None
+    return DeviceInfo(f"disk:{disk}", rotational)
+
+
+def device_info(path: str) -> DeviceInfo:
+    """
+    Физическое устройство, на котором лежит папка.
+
+    Если устройство определить не удалось, ключом служит сам том или точка
+    монтирования, а тип носителя неизвестен.
+    """
+    try:
+        if os.name == 'nt':
+            return _windows_device(path)
+        if sys.platform.startswith('linux'):
+            return _linux_device(path)
+        return DeviceInfo(f"dev:{os.stat(path).st_dev}")
+    except OSError:
+        return DeviceInfo(os.path.splitdrive(os.path.abspath(path))[0] or path)
+
+
+def outermost_roots(roots: Iterable[str]) -> List[str]:
+    """Корни без повторов и без папок, вложенных в другие корни: их папки и так попадут в результат."""
+    unique = []
+    seen = set()
+    for root in roots:
+        key = os.path.normcase(os.path.abspath(root))
+        if key not in seen:
+            seen.add(key)
+            unique.append((key, root))
+    result = []
+    for key, root in unique:
+        nested = False
+        for other, _ in unique:
+            if other == key:
+                continue
+            try:
+                nested = os.path.commonpath([key, other]) == other
+            except ValueError:
+                # Разные диски Windows
+                nested = False
+            if nested:
+                break
+        if not nested:
+            result.append(root)
+    return result
+
+
+@dataclass(frozen=True)
+class ScanHistory:
+    """Сколько папок и байт было в корне при прошлом сканировании"""
+    dirs: int
+    bytes: int
+
+
+def _probe(path: str, excluder: ExcludeMatcher, rng: random.Random, max_reads: int) -> Tuple[Optional[float], int]:
+    """
+    Одна проба: спуск в случайную подпапку до листа; произведения числа подпапок на пути.
+
+    Returns:
+        Оценка (None, если лист не достигнут за max_reads чтений) и число прочитанных папок
+    """
+    # Сколько папок на текущей глубине приходится на одну папку на пути пробы
+    weight = 1.0
+    estimate = 1.0
+    reads = 0
+    while reads < max_reads:
+        subdirs = _subdirs(path, excluder)
+        reads += 1
+        if not subdirs:
+            return estimate, reads
+        weight *= len(subdirs)
+        estimate += weight
+        path = rng.choice(subdirs)
+    return None, reads
+
+
+def _subdirs(path: str, excluder: ExcludeMatcher) -> List[str]:
+    path_rules = excluder.path_rules_in(os.path.abspath(path)) if excluder.has_path_rules else None
+    try:
+        with os.scandir(path) as entries:
+            return [entry.path for entry in entries
+                    if entry.is_dir(follow_symlinks=False) and not excluder.matches(entry.name, path_rules)]
+    except OSError:
+        return []
+
+
+def estimate_dirs(root: str, exclude_dirs: Iterable[str] = (), probes: int = 128, max_reads: int = 256,
+                  rng: Optional[random.Random] = None, cancel_token=None) -> int:
+    """
+    Оценивает число папок в дереве, не обходя его (оценка Кнута).
+
+    Проба спускается от корня в случайную подпапку до листа; произведение
+    числа подпапок на пути — несмещенная оценка числа папок на каждой глубине.
+    Подпапки корня читаются все и пробы идут по ним по кругу: так разброс
+    между крупными и мелкими ветвями не попадает в оценку. Проба читает
+    столько папок, какова глубина дерева, поэтому всего читается не больше
+    max_reads папок: на глубоком дереве проб меньше, и оценка грубее. На
+    неравномерных деревьях она ошибается в разы.
+
+    Args:
+        probes (int): Сколько проб сделать, если хватит max_reads
+        max_reads (int): Сколько папок прочитать всего, считая корень
+        cancel_token: Флаг отмены сканирования (свойство cancelled); после
+            отмены новые пробы не начинаются
+    """
+    excluder = exclude_dirs if isinstance(exclude_dirs, ExcludeMatcher) else ExcludeMatcher(exclude_dirs)
+    rng = rng or random.Random()
+    children = _subdirs(root, excluder)
+    reads = 1
+    if not children:
+        return 1
+    # Если подпапок больше, чем проб, пробуем случайную часть и пересчитываем на все
+    sampled = children if len(children) <= probes else rng.sample(children, probes)
+    totals = [0.0] * len(sampled)
+    counts = [0] * len(sampled)
+    for attempt in range(max(1, probes // len(sampled)) * len(sampled)):
+        if reads >= max_reads or (cancel_token is not None and cancel_token.cancelled):
+            break
+        child = attempt % len(sampled)
+        estimate, used = _probe(sampled[child], excluder, rng, max_reads - reads)
+        reads += used
+        # Проба, оборванная на середине, занизила бы оценку
+        if estimate is not None:
+            totals[child] += estimate
+            counts[child] += 1
+    averages = [total / count for total, count in zip(totals, counts) if count]
+    if not averages:
+        return 1 + len(children)
+    return 1 + round(sum(averages) / len(averages) * len(children))
+
+
+# Выше этой доли индикатор только подползает к концу: оценка могла оказаться заниженной
+_EASE_FROM = 0.9
+# Пока обход не закончен, индикатор не доходит до конца
+_MAX_FRACTION = 0.99
+
+
+class ProgressEstimator:
+    """
+    Доля выполненной работы при сканировании одного корня.
+
+    Ожидаемый объем берется из прошлого сканирования того же корня: число папок
+    и байт. Без истории для корня тома ожидаемый объем — занятое на нем место,
+    а для обычной папки — оценка числа папок по случайным пробам (estimate_dirs).
+    Оценка читает папки корня, поэтому создавать оценщик лучше там же, где
+    корень сканируется: под ограничением сеанса на устройство.
+    Доля никогда не уменьшается, чтобы индикатор не шел назад.
+    """
+
+    def __init__(self, root: str, history: Optional[ScanHistory] = None,
+                 exclude_dirs: Iterable[str] = (), cancel_token=None):
+        self.expected_dirs = 0
+        self.expected_bytes = 0
+        if history is not None:
+            self.expected_dirs = history.dirs
+            self.expected_bytes = history.bytes
+        elif os.path.ismount(root):
+            try:
+                self.expected_bytes = shutil.disk_usage(root).used
+            except OSError:
+                pass
+        if not self.expected_dirs and not self.expected_bytes:
+            self.expected_dirs = estimate_dirs(root, exclude_dirs, cancel_token=cancel_token)
+        self.fraction = 0.0
+
+    def update(self, dirs_scanned: int, bytes_scanned: int) -> float:
+        """Пересчитывает долю по прогрессу сканирования и возвращает её."""
+        parts = []
+        if self.expected_dirs:
+            parts.append(dirs_scanned / self.expected_dirs)
+        if self.expected_bytes:
+            parts.append(bytes_scanned / self.expected_bytes)
+        fraction = sum(parts) / len(parts) if parts else 0.0
+        if fraction > _EASE_FROM:
+            # Дерево выросло с прошлого раза или оценка занижена: приближаемся к концу все медленнее
+            fraction = _EASE_FROM + (_MAX_FRACTION - _EASE_FROM) * (
+                1 - math.exp((_EASE_FROM - fraction) / (_MAX_FRACTION - _EASE_FROM)))
+        self.fraction = max(self.fraction, fraction)
+        return self.fraction
+
+    def finish(self) -> None:
+        self.fraction = 1.0
+
+
+def combined_fraction(estimators: Iterable[ProgressEstimator], pending: int = 0) -> float:
+    """
+    Общая доля выполненной работы нескольких корней с весом по ожидаемому объему в байтах.
+
+    Args:
+        pending (int): Сколько корней еще ждут своей очереди и оценщика не имеют;
+            они не выполнены и весят как средний корень
+    """
+    estimators = list(estimators)
+    # Корень без оценки объема в байтах весит как средний из остальных
+    known = [estimator.expected_bytes for estimator in estimators if estimator.expected_bytes]
+    default = sum(known) / len(known) if known else 1
+    weights = [estimator.expected_bytes or default for estimator in estimators]
+    done = sum(estimator.fraction * weight for estimator, weight in zip(estimators, weights))
+    return done / ((sum(weights) + pending * default) or 1)
+
+
+class ScanSession:
+    """
+    Параллельное сканирование нескольких корней с ограничением на физическое устройство.
+
+    Сеанс не знает, как сканировать корень: run вызывает переданную функцию
+    для каждого корня в отдельном потоке, поэтому можно сканировать сразу или
+    брать результат из индекса размеров.
+    """
+
+    def __init__(self, roots: Iterable[str], threads: int = 1,
+                 hdd_limit: int = 1, ssd_limit: int = 2):
+        """
+        Args:
+            roots: Корни сканирования; вложенные в другие корни и повторы отбрасываются
+            threads (int): Потоков обхода внутри одного корня не на жестком диске
+            hdd_limit (int): Сколько корней одного жесткого диска сканировать одновременно;
+                относится и к локальным устройствам неизвестного типа
+            ssd_limit (int): Сколько корней одного SSD или сетевого сервера сканировать одновременно
+        """
+        self.roots = outermost_roots(roots)
+        self.threads = threads
+        self.hdd_limit = hdd_limit
+        self.ssd_limit = ssd_limit
+        self.devices: Dict[str, DeviceInfo] = {root: device_info(root) for root in self.roots}
+        # Ошибки корней, которые не удалось просканировать
+        self.errors: Dict[str, Exception] = {}
+
+    def limit_for(self, device: DeviceInfo) -> int:
+        """Сколько корней устройства сканировать одновременно."""
+        fast = device.rotational is False or device.network
+        return max(1, self.ssd_limit if fast else self.hdd_limit)
+
+    def threads_for(self, root: str) -> int:
+        """
+        Сколько потоков обхода дать корню: на жестком диске лишние потоки только мешают.
+
+        Один поток получает только устройство, определенное как жесткий диск.
+        Сетевой папке потоки нужны больше всех: время уходит на ожидание ответов
+        сервера, а не на позиционирование головки.
+        """
+        return 1 if self.devices[root].rotational else self.threads
+
+    def run(self, scan_root: Callable[[str, int], T],
+            cancel: Optional[Callable[[], None]] = None) -> Dict[str, T]:
+        """
+        Сканирует все корни.
+
+        Args:
+            scan_root: Функция (корень, число потоков) -> результат; вызывается
+                из разных потоков одновременно
+            cancel: Отменяет сканирование корней. Если ожидание прервано (Ctrl+C),
+                run вызывает cancel и дожидается корней, прежде чем передать исключение:
+                иначе интерпретатор может завершиться, пока нативный сканер еще работает
+
+        Returns:
+            Dict[str, T]: Результаты по корням в порядке roots; корни с ошибкой
+            отсутствуют и перечислены в errors
+        """
+        self.errors = {}
+        if not self.roots:
+            return {}
+        semaphores: Dict[str, threading.Semaphore] = {}
+        for device in self.devices.values():
+            if device.key not in semaphores:
+                semaphores[device.key] = threading.Semaphore(self.limit_for(device))
+
+        def task(root: str) -> T:
+            with semaphores[self.devices[root].key]:
+                return scan_root(root, self.threads_for(root))
+
+        # Поток на корень: ждущие своей очереди на устройстве просто спят на семафоре
+        pool = ThreadPoolExecutor(max_workers=len(self.roots))
+        futures = {root: pool.submit(task, root) for root in self.roots}
+        try:
+            wait(futures.values())
+        except BaseException:
+            if cancel is not None:
+                cancel()
+            pool.shutdown(wait=True)
+            raise
+        pool.shutdown()
+        results = {}
+        for root, future in futures.items():
+            try:
+                results[root] = future.result()
+            except Exception as e:
+                self.errors[root] = e
+        return results
+
+
+def merge_results(results: Sequence[ScanResult], top_k: int = 0, largest_files: int = 0) -> ScanResult:
+    """
+    Объединяет результаты сканирования непересекающихся корней.
+
+    Args:
+        top_k (int): Оставить только top_k самых больших папок (0 — все)
+        largest_files (int): Оставить столько самых больших файлов (0 — все найденные)
+
+    Returns:
+        ScanResult: Папки и файлы всех корней по убыванию размера; дерево не заполняется —
+        у каждого корня оно свое. Время сканирования — самое долгое из корней
+    """
+    folders = sorted(chain.from_iterable(result.folders for result in results),
+                     key=lambda folder: folder.size, reverse=True)
+    if top_k:
+        folders = folders[:top_k]
+    files = chain.from_iterable(result.largest_files for result in results)
+    if largest_files:
+        files = heapq.nlargest(largest_files, files, key=lambda file: file.size)
+    else:
+        files = sorted(files, key=lambda file: file.size, reverse=True)
+
+    merged = ScanResult(folders, sum(result.total_size for result in results),
+                        sum(result.total_allocated for result in results),
+                        complete=all(result.complete for result in results),
+                        largest_files=files,
+                        skipped_mounts=sorted(chain.from_iterable(result.skipped_mounts for result in results)))
+    histogram = merged.size_histogram
+    for result in results:
+        counts, sizes = result.size_histogram.counts, result.size_histogram.bytes
+        if len(histogram.counts) < len(counts):
+            histogram.counts.extend([0] * (len(counts) - len(histogram.counts)))
+            histogram.bytes.extend([0] * (len(sizes) - len(histogram.bytes)))
+        for i, (count, size) in enumerate(zip(counts, sizes)):
+            histogram.counts[i] += count
+            histogram.bytes[i] += size
+    for result in results:
+        merged.stats.add(result.stats)
+    merged.stats.wall_time = max((result.stats.wall_time for result in results), default=0.0)
+    return merged
+
+
+def scan_roots(roots: Iterable[str], size_threshold_mb: int,
+               exclude_dirs: Optional[Iterable[str]] = None, threads: int = 1,
+               hdd_limit: int = 1, ssd_limit: int = 2, scanner=None, **options) -> ScanResult:
+    """
+    Сканирует несколько корней за один сеанс и объединяет результаты.
+
+    Args:
+        roots: Корни сканирования
+        threads (int): Потоков обхода внутри корня не на жестком диске
+        hdd_limit (int), ssd_limit (int): Сколько корней одного устройства сканировать одновременно
+        scanner: Модуль со scan_folders (folder_search_cpp или folder_scanner, по умолчанию folder_scanner)
+        **options: Остальные параметры scan_folders; обратные вызовы вызываются из потоков разных корней
+
+    Returns:
+        ScanResult: Объединенный результат (см. merge_results); время — всего сеанса.
+        Корни, которые не удалось просканировать, пропускаются, а результат считается неполным
+    """
+    scanner = scanner or folder_scanner
+    exclude_dirs = set(exclude_dirs or ())
+    session = ScanSession(roots, threads, hdd_limit, ssd_limit)
+    start = time.perf_counter()
+    results = session.run(lambda root, root_threads: scanner.scan_folders(
+        root, size_threshold_mb, exclude_dirs, threads=root_threads, **options),
+        cancel=options['cancel_token'].cancel if options.get('cancel_token') else None)
+    merged = merge_results(list(results.values()), options.get('top_k', 0), options.get('largest_files', 0))
+    merged.stats.wall_time = time.perf_counter() - start
+    if session.errors:
+        merged.complete = False
+    return merged
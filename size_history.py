@@ -0,0 +1,234 @@
+"""
+История размеров крупных папок.
+
+При каждом сканировании (и при обновлении размеров наблюдателем) записываются
+размеры верхних папок корня. Чтобы история годами оставалась маленькой, старые
+записи прореживаются: за последнюю неделю хранится одна запись в час, раньше —
+одна в день (последняя в часе или дне). Прореживание затрагивает только записи,
+перешедшие границу с прошлого раза, поэтому запись остается дешевой.
+
+По истории строятся графики размера и список быстрее всего растущих папок:
+скорость роста — наклон прямой, проведенной по записям методом наименьших
+квадратов, поэтому разовый всплеск (временный архив) не выводит папку в лидеры.
+"""
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# (возраст, с которого действует уровень, размер корзины) в секундах:
+# неделю одна запись в час, дальше одна в день
+HISTORY_TIERS = ((0, 3600), (7 * 86400, 86400))
+
+
+def _key(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+@dataclass
+class FolderTrend:
+    """Как менялся размер папки за период"""
+    path: str
+    # Последний известный размер
+    size: int
+    # Изменение от первой записи периода до последней
+    growth: int
+    # Скорость роста в байтах в сутки
+    rate: float
+    # (время, размер) от старых к новым — для графика
+    points: List[Tuple[float, int]] = field(default_factory=list)
+
+
+def _slope(points: Sequence[Tuple[float, int]]) -> float:
+    """Наклон прямой по методу наименьших квадратов в байтах в сутки."""
+    count = len(points)
+    if count < 2:
+        return 0.0
+    # Время считается от первой записи, иначе квадраты меток времени теряют точность
+    start = points[0][0]
+    mean_t = sum(moment - start for moment, _ in points) / count
+    mean_s = sum(size for _, size in points) / count
+    covariance = sum((moment - start - mean_t) * (size - mean_s) for moment, size in points)
+    variance = sum((moment - start - mean_t) ** 2 for moment, _ in points)
+    if variance <= 0:
+        return 0.0
+    return covariance / variance * 86400
+
+
+class SizeHistory:
+    """
+    Записи размеров папок в SQLite.
+
+    Пользоваться можно из нескольких потоков: корни сканируются параллельно,
+    а читает историю окно.
+    """
+
+    def __init__(self, db_path: str, tiers: Sequence[Tuple[float, float]] = HISTORY_TIERS):
+        """
+        Args:
+            db_path (str): Файл базы истории
+            tiers: (возраст, размер корзины) по возрастанию возраста, см. HISTORY_TIERS
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.tiers = tiers
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS folders (id INTEGER PRIMARY KEY, key TEXT UNIQUE, path TEXT)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS samples (folder INTEGER, time REAL, size INTEGER, "
+            "PRIMARY KEY (folder, time)) WITHOUT ROWID")
+        self._db.execute("CREATE INDEX IF NOT EXISTS samples_time ON samples (time)")
+        self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _folder_ids(self, root: Optional[str] = None) -> Dict[str, int]:
+        """Отслеживаемые папки (все или внутри root): нормализованный путь -> id."""
+        rows = self._db.execute("SELECT key, id FROM folders").fetchall()
+        if root is None:
+            return dict(rows)
+        root = _key(root)
+        prefix = os.path.join(root, '')
+        return {key: folder for key, folder in rows if key == root or key.startswith(prefix)}
+
+    def tracked(self, root: Optional[str] = None) -> List[str]:
+        """Пути отслеживаемых папок, все или внутри root."""
+        with self._lock:
+            wanted = self._folder_ids(root)
+            rows = self._db.execute("SELECT key, path FROM folders").fetchall()
+        return [path for key, path in rows if key in wanted]
+
+    def record(self, sizes: Iterable[Tuple[str, int]], moment: Optional[float] = None,
+               tracked_only: bool = False) -> None:
+        """
+        Записывает размеры папок на момент moment и прореживает старые записи.
+
+        Args:
+            sizes: Пары (путь, размер)
+            moment (float): Время замера (по умолчанию — сейчас)
+            tracked_only (bool): Записывать только папки, которые уже есть в истории;
+                так размеры от наблюдателя не добавляют в историю мелкие папки
+        """
+        moment = time.time() if moment is None else moment
+        with self._lock:
+            previous = self._db.execute("SELECT MAX(time) FROM samples").fetchone()[0]
+            folders = self._folder_ids()
+            rows = []
+            for path, size in sizes:
+                key = _key(path)
+                folder = folders.get(key)
+                if folder is None:
+                    if tracked_only:
+                        continue
+                    folder = self._db.execute(
+                        "INSERT INTO folders (key, path) VALUES (?, ?)", (key, path)).lastrowid
+                    folders[key] = folder
+                rows.append((folder, moment, size))
+            self._db.executemany("INSERT OR REPLACE INTO samples (folder, time, size) VALUES (?, ?, ?)", rows)
+            self._compact(previous, moment)
+            self._db.commit()
+
+    def _compact(self, previous: Optional[float], moment: float) -> None:
+        """
+        Оставляет по последней записи в каждой корзине своего уровня.
+
+        Записи старше прошлого раза уже прорежены, поэтому просматриваются только
+        те, что с тех пор перешли границу уровня, и корзина на самой границе.
+        """
+        for age, bucket in self.tiers:
+            high = moment - age
+            low = -float('inf') if previous is None else min(previous, moment) - age - bucket
+            self._db.execute(
+                "DELETE FROM samples WHERE time >= ? AND time <= ? AND EXISTS ("
+                "SELECT 1 FROM samples AS later WHERE later.folder = samples.folder "
+                "AND later.time > samples.time AND later.time < (CAST(samples.time / ? AS INTEGER) + 1) * ?)",
+                (low, high, bucket, bucket))
+
+    def record_index(self, index, node: int = 0, min_size: int = 0, max_depth: int = 2,
+                     max_folders: int = 200, moment: Optional[float] = None) -> None:
+        """
+        Записывает размеры верхних папок из индекса (dir_index.DirIndex).
+
+        Записываются сама папка node, крупнейшие из папок не глубже max_depth
+        уровней от неё и все папки, которые уже отслеживаются внутри неё, даже
+        если они стали меньше min_size: иначе в истории не было бы видно, как
+        папка уменьшилась.
+
+        Args:
+            min_size (int): Более мелкие папки не начинают отслеживаться
+            max_folders (int): Сколько папок ниже node может начать отслеживаться
+        """
+        sizes = index.sizes
+        candidates = []
+        level = [node]
+        for _ in range(max_depth):
+            level = [child for parent in level for child in index.children(parent) if sizes[child] >= min_size]
+            candidates.extend(level)
+        candidates.sort(key=lambda child: sizes[child], reverse=True)
+
+        folders = {_key(index.path(node)): (index.path(node), sizes[node])}
+        for child in candidates[:max_folders]:
+            path = index.path(child)
+            folders[_key(path)] = (path, sizes[child])
+        for path in self.tracked(index.path(node)):
+            if _key(path) not in folders:
+                found = index.find(path)
+                # Исчезнувшая или исключенная папка просто перестает записываться
+                if found is not None:
+                    folders[_key(path)] = (path, sizes[found])
+        self.record(folders.values(), index.scan_time if moment is None else moment)
+
+    def series(self, path: str, since: float = 0) -> List[Tuple[float, int]]:
+        """Записи размера папки начиная с since: (время, размер) от старых к новым."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT samples.time, samples.size FROM samples JOIN folders ON folders.id = samples.folder "
+                "WHERE folders.key = ? AND samples.time >= ? ORDER BY samples.time",
+                (_key(path), since)).fetchall()
+
+    def trends(self, since: float = 0, roots: Optional[Iterable[str]] = None) -> List[FolderTrend]:
+        """
+        Изменение размера каждой папки с хотя бы двумя записями после since.
+
+        Args:
+            roots: Только папки внутри этих корней (по умолчанию — все)
+        """
+        with self._lock:
+            if roots is None:
+                wanted = self._folder_ids()
+            else:
+                wanted = {}
+                for root in roots:
+                    wanted.update(self._folder_ids(root))
+            paths = dict(self._db.execute("SELECT id, path FROM folders").fetchall())
+            rows = self._db.execute(
+                "SELECT folder, time, size FROM samples WHERE time >= ? ORDER BY folder, time",
+                (since,)).fetchall()
+
+        ids = set(wanted.values())
+        points: Dict[int, List[Tuple[float, int]]] = {}
+        for folder, moment, size in rows:
+            if folder in ids:
+                points.setdefault(folder, []).append((moment, size))
+        return [FolderTrend(paths[folder], series[-1][1], series[-1][1] - series[0][1], _slope(series), series)
+                for folder, series in points.items() if len(series) >= 2]
+
+    def fastest_growing(self, since: float = 0, limit: int = 50,
+                        roots: Optional[Iterable[str]] = None) -> List[FolderTrend]:
+        """Папки, быстрее всего растущие после since, по убыванию скорости роста."""
+        growing = [trend for trend in self.trends(since, roots) if trend.rate > 0]
+        growing.sort(key=lambda trend: trend.rate, reverse=True)
+        return growing[:limit] if limit else growing
+
+
+def downsample(points: Sequence[Tuple[float, int]], count: int) -> List[Tuple[float, int]]:
+    """Сокращает ряд до count равномерно взятых точек для графика; первая и последняя сохраняются."""
+    if len(points) <= count or count < 2:
+        return list(points)
+    step = (len(points) - 1) / (count - 1)
+    return [points[round(i * step)] for i in range(count)]
@@ -0,0 +1,20 @@
+import os
+import sys
+
+# Модули программы лежат в корне репозитория, а не в пакете
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_files(root, files):
+    """
+    Создает файлы по словарю относительный путь -> размер в байтах.
+
+    Промежуточные папки создаются сами; путь, оканчивающийся на /, создает пустую папку.
+    """
+    for relative, size in files.items():
+        path = root.joinpath(*relative.rstrip('/').split('/'))
+        if relative.endswith('/'):
+            path.mkdir(parents=True, exist_ok=True)
+            continue
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'\0' * size)
@@ -0,0 +1,113 @@
+import shutil
+
+import pytest
+
+import folder_scanner
+from conftest import make_files
+from dir_index import DirIndex, DirIndexStore, diff_indexes, scan_options_digest
+
+KB = 1024
+
+
+def scan_tree(root):
+    return folder_scanner.scan_folders(str(root), 0, set(), collect_tree=True).tree
+
+
+@pytest.fixture
+def snapshots(tmp_path):
+    """Снимки одной папки до и после изменений: old и new."""
+    root = tmp_path / 'root'
+    make_files(root, {
+        'stable/file': 50 * KB,
+        'growing/file': 10 * KB,
+        'growing/inner/file': 10 * KB,
+        'parent/child/file': 10 * KB,
+        'gone/file': 40 * KB,
+        'small/file': 1 * KB,
+        'cache/file': 10 * KB,
+    })
+
+    def snapshot(name, scan_time):
+        path = str(tmp_path / f'{name}.idx')
+        DirIndex.write(path, str(root), scan_tree(root), scan_time)
+        return DirIndex(path)
+
+    old = snapshot('old', 1000.0)
+    shutil.rmtree(root / 'gone')
+    make_files(root, {
+        'growing/more': 35 * KB,
+        'parent/child/more': 30 * KB,
+        'new/file': 25 * KB,
+        'small/more': 1 * KB,
+        'cache/more': 90 * KB,
+    })
+    new = snapshot('new', 2000.0)
+    yield root, old, new
+    old.close()
+    new.close()
+
+
+def test_diff_reports_grown_appeared_and_vanished_folders(snapshots):
+    root, old, new = snapshots
+
+    diff = diff_indexes(old, new, 20 * KB)
+
+    assert (diff.old_time, diff.new_time) == (1000.0, 2000.0)
+    assert diff.total_growth == (35 + 30 + 25 + 1 + 90 - 40) * KB
+    assert [(change.path, change.growth) for change in diff.grown] == [
+        (str(root / 'cache'), 90 * KB),
+        (str(root / 'growing'), 35 * KB),
+        (str(root / 'parent' / 'child'), 30 * KB),
+    ]
+    # Прирост в разах: cache выросла в 10 раз, child — в 4, growing — в 2,75
+    assert [change.path for change in diff.grown_relative] == [
+        str(root / 'cache'), str(root / 'parent' / 'child'), str(root / 'growing')]
+    assert [(change.path, change.new_size) for change in diff.appeared] == [(str(root / 'new'), 25 * KB)]
+    assert [(change.path, change.old_size) for change in diff.vanished] == [(str(root / 'gone'), 40 * KB)]
+
+
+def test_diff_hides_parents_grown_only_through_a_listed_child(snapshots):
+    root, old, new = snapshots
+
+    nested = {change.path for change in diff_indexes(old, new, 20 * KB).grown}
+    everything = {change.path for change in diff_indexes(old, new, 20 * KB, exclude_nested=False).grown}
+
+    assert str(root / 'parent') not in nested
+    assert everything - nested == {str(root / 'parent')}
+
+
+def test_diff_skips_excluded_folders_and_respects_top_k(snapshots):
+    root, old, new = snapshots
+
+    diff = diff_indexes(old, new, 20 * KB, exclude_dirs={'cache', 'gone'}, top_k=1)
+
+    assert [change.path for change in diff.grown] == [str(root / 'growing')]
+    assert diff.vanished == []
+    assert [change.path for change in diff.appeared] == [str(root / 'new')]
+
+
+def test_diff_of_subfolder(snapshots):
+    root, old, new = snapshots
+
+    diff = diff_indexes(old, new, 20 * KB, old_node=old.find(str(root / 'parent')),
+                        new_node=new.find(str(root / 'parent')))
+
+    assert diff.total_growth == 30 * KB
+    assert [change.path for change in diff.grown] == [str(root / 'parent' / 'child')]
+
+
+def test_snapshot_before_skips_snapshots_with_other_options(tmp_path):
+    root = tmp_path / 'root'
+    make_files(root, {'a/file': KB})
+    store = DirIndexStore(tmp_path / 'index', max_snapshots=5, snapshot_interval=0)
+    plain = scan_options_digest(set())
+    pruned = scan_options_digest({'a'}, prune_excluded=True)
+    tree = scan_tree(root)
+    store.save(str(root), tree, 1000.0, plain)
+    store.save(str(root), tree, 2000.0, pruned)
+    store.save(str(root), tree, 3000.0, plain)
+
+    assert [snapshot.scan_time for snapshot in store.snapshots(str(root))] == [1000.0, 2000.0, 3000.0]
+    assert store.snapshot_before(str(root), 2500.0).scan_time == 2000.0
+    assert store.snapshot_before(str(root), 2500.0, plain).scan_time == 1000.0
+    assert store.snapshot_before(str(root), 500.0, plain) is None
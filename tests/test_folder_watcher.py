@@ -0,0 +1,101 @@
+import os
+import shutil
+
+import folder_scanner
+from conftest import make_files
+from folder_watcher import SizeTree
+
+
+def build_tree(root, **options):
+    result = folder_scanner.scan_folders(str(root), 0, options.get('exclude_dirs', ()),
+                                         collect_tree=True, prune_excluded=True)
+    return SizeTree.from_dir_tree(result.tree, **options)
+
+
+def totals_by_path(tree):
+    return {node.path(): (node.size, node.files) for node in tree.root.walk()}
+
+
+def test_refresh_picks_up_new_files(tmp_path):
+    make_files(tmp_path, {'a/one': 100, 'b/sub/two': 200})
+    tree = build_tree(tmp_path)
+    a = tree.root.children['a']
+    tree.take_changes()
+
+    make_files(tmp_path, {'a/three': 50})
+    assert tree.refresh(a) == []
+
+    assert (a.size, a.files) == (150, 2)
+    assert (tree.root.size, tree.root.files) == (350, 3)
+    changed, removed, _ = tree.take_changes()
+    # Корень в изменения не попадает
+    assert [folder.path for folder in changed] == [str(tmp_path / 'a')]
+    assert changed[0].size == 150
+    assert removed == []
+
+
+def test_refresh_adds_new_and_drops_vanished_subfolders(tmp_path):
+    make_files(tmp_path, {'a/one': 100, 'b/sub/two': 200})
+    tree = build_tree(tmp_path)
+    tree.take_changes()
+
+    shutil.rmtree(tmp_path / 'b')
+    make_files(tmp_path, {'c/d/three': 300, 'c/four': 10})
+    added = tree.refresh(tree.root)
+
+    assert [node.path() for node in added] == [str(tmp_path / 'c')]
+    assert set(tree.root.children) == {'a', 'c'}
+    assert tree.root.size == 410
+    # Добавленное поддерево совпадает с новым сканированием
+    assert totals_by_path(tree) == totals_by_path(build_tree(tmp_path))
+    _, removed, detached = tree.take_changes()
+    assert removed == [str(tmp_path / 'b')]
+    assert [node.name for node in detached] == ['b']
+
+
+def test_refresh_skips_excluded_folders(tmp_path):
+    make_files(tmp_path, {'a/one': 100})
+    tree = build_tree(tmp_path, exclude_dirs={'node_modules'})
+
+    make_files(tmp_path, {'a/node_modules/pkg/big': 1000, 'a/src/small': 10})
+    tree.refresh(tree.root.children['a'])
+
+    assert set(tree.root.children['a'].children) == {'src'}
+    assert tree.root.size == 110
+
+
+def test_move_keeps_totals_without_rescanning(tmp_path):
+    make_files(tmp_path, {'a/one': 100, 'a/inner/two': 20, 'b/three': 300})
+    tree = build_tree(tmp_path)
+    a, b = tree.root.children['a'], tree.root.children['b']
+    tree.take_changes()
+
+    # Дерево меняется без обращения к диску
+    assert tree.move(tree.root, 'a', b, 'moved')
+
+    assert 'a' not in tree.root.children
+    assert b.children['moved'] is a
+    assert a.path() == os.path.join(str(tmp_path), 'b', 'moved')
+    assert (b.size, b.files) == (420, 3)
+    assert (tree.root.size, tree.root.files) == (420, 3)
+    changed, removed, detached = tree.take_changes()
+    assert removed == [str(tmp_path / 'a')]
+    assert detached == []
+    assert {folder.path for folder in changed} >= {str(tmp_path / 'b'),
+                                                    os.path.join(str(tmp_path), 'b', 'moved', 'inner')}
+
+
+def test_move_replaces_existing_target_and_ignores_unknown_source(tmp_path):
+    make_files(tmp_path, {'a/one': 100, 'b/two': 200})
+    tree = build_tree(tmp_path)
+    a = tree.root.children['a']
+    tree.take_changes()
+
+    assert not tree.move(tree.root, 'missing', a, 'x')
+    assert tree.move(tree.root, 'a', tree.root, 'b')
+
+    assert tree.root.children == {'b': a}
+    assert tree.root.size == 100
+    _, removed, detached = tree.take_changes()
+    assert set(removed) == {str(tmp_path / 'a'), str(tmp_path / 'b')}
+    assert [node.name for node in detached] == ['b']
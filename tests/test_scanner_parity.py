@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+import folder_scanner
+from conftest import make_files
+
+folder_search_cpp = pytest.importorskip('folder_search_cpp')
+
+FILES = {
+    'docs/report.pdf': 5000,
+    'docs/notes.txt': 120,
+    'docs/old/archive.zip': 70000,
+    'media/photos/Отпуск 2024/img_001.jpg': 30000,
+    'media/photos/Отпуск 2024/img_002.jpg': 31000,
+    'media/video/clip.mp4': 90000,
+    'src/app/main.py': 800,
+    'src/app/node_modules/lib/index.js': 40000,
+    'src/app/node_modules/lib/deep/more.js': 1000,
+    'src/build/out.o': 6000,
+    'empty/': 0,
+    'ü/日本/ファイル.bin': 2500,
+}
+
+
+@pytest.fixture
+def tree_root(tmp_path):
+    make_files(tmp_path, FILES)
+    # Ссылки в одной папке: какая из них посчитана первой, на размеры папок не влияет
+    os.link(tmp_path / 'media' / 'video' / 'clip.mp4', tmp_path / 'media' / 'video' / 'clip-link.mp4')
+    return tmp_path
+
+
+def folders_of(result):
+    return sorted((folder.path, folder.size, folder.allocated_size, list(folder.class_sizes))
+                  for folder in result.folders)
+
+
+def tree_of(tree):
+    return {tree.path(node): (tree.sizes[node], tree.allocated[node], tree.file_counts[node])
+            for node in range(len(tree.parents))}
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+@pytest.mark.parametrize('options', [
+    {},
+    {'prune_excluded': True},
+    {'dedupe_hard_links': True},
+], ids=['default', 'prune_excluded', 'dedupe_hard_links'])
+def test_native_scanner_matches_python(tree_root, threads, options):
+    exclude_dirs = {'node_modules'}
+    results = [scanner.scan_folders(str(tree_root), 0, set(exclude_dirs), threads=threads, collect_tree=True,
+                                    file_classes=True, **options)
+               for scanner in (folder_scanner, folder_search_cpp)]
+
+    python, native = results
+    assert folders_of(native) == folders_of(python)
+    assert tree_of(native.tree) == tree_of(python.tree)
+    assert (native.total_size, native.total_allocated) == (python.total_size, python.total_allocated)
+    assert native.complete and python.complete
+    # Имена вне ASCII доходят до результата без потерь
+    assert str(tree_root / 'ü' / '日本') in {folder.path for folder in native.folders}
+
+
+def test_native_largest_files_match_python(tree_root):
+    results = [scanner.scan_folders(str(tree_root), 0, {'node_modules'}, largest_files=3)
+               for scanner in (folder_scanner, folder_search_cpp)]
+
+    python, native = (sorted((file.path, file.size) for file in result.largest_files) for result in results)
+    assert native == python
+    assert native == [(str(tree_root / 'docs' / 'old' / 'archive.zip'), 70000),
+                      (str(tree_root / 'media' / 'video' / 'clip-link.mp4'), 90000),
+                      (str(tree_root / 'media' / 'video' / 'clip.mp4'), 90000)]
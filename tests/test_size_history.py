@@ -0,0 +1,103 @@
+import random
+
+import pytest
+
+from size_history import HISTORY_TIERS, SizeHistory, downsample
+
+HOUR = 3600
+DAY = 86400
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = SizeHistory(str(tmp_path / 'history.sqlite'))
+    yield history
+    history.close()
+
+
+def expected_retention(moments, now, tiers=HISTORY_TIERS):
+    """Записи, которые должны остаться: на каждом пройденном уровне — последняя в своей корзине."""
+    kept = []
+    for moment in moments:
+        if all(not any(later > moment and int(later // bucket) == int(moment // bucket) for later in moments)
+               for age, bucket in tiers if moment <= now - age):
+            kept.append(moment)
+    return kept
+
+
+def test_compact_keeps_hourly_then_daily_samples(history, tmp_path):
+    folder = str(tmp_path / 'folder')
+    start = 100 * DAY
+    # Три недели замеров каждые 15 минут
+    moments = [start + step * 900 for step in range(21 * 96)]
+    for size, moment in enumerate(moments):
+        history.record([(folder, size)], moment)
+
+    now = moments[-1]
+    kept = [moment for moment, _ in history.series(folder)]
+    assert kept == expected_retention(moments, now)
+    # Последняя неделя — одна запись в час, раньше — одна в день
+    recent = [moment for moment in kept if moment > now - 7 * DAY]
+    old = [moment for moment in kept if moment <= now - 7 * DAY]
+    assert len({int(moment // HOUR) for moment in recent}) == len(recent)
+    assert len({int(moment // DAY) for moment in old}) == len(old)
+    assert 14 <= len(old) <= 15
+    assert kept[-1] == now
+    # В корзине остается последняя запись
+    assert all((moment + 900) % HOUR == 0 for moment in recent[:-1])
+
+
+def test_compact_with_irregular_scans_matches_full_compaction(history, tmp_path):
+    rng = random.Random(7)
+    folders = [str(tmp_path / name) for name in ('a', 'b')]
+    moment = 50 * DAY
+    moments = {folder: [] for folder in folders}
+    for _ in range(400):
+        # Пропуски от минут до нескольких дней, папки записываются не всегда вместе
+        moment += rng.choice((60, 600, 2 * HOUR, 20 * HOUR, 3 * DAY))
+        recorded = [folder for folder in folders if rng.random() < 0.7] or folders[:1]
+        history.record([(folder, int(moment)) for folder in recorded], moment)
+        for folder in recorded:
+            moments[folder].append(moment)
+
+    for folder in folders:
+        assert [time for time, _ in history.series(folder)] == expected_retention(moments[folder], moment)
+
+
+def test_tracked_only_does_not_start_new_folders(history, tmp_path):
+    known, unknown = str(tmp_path / 'known'), str(tmp_path / 'unknown')
+    history.record([(known, 1)], 1000.0)
+
+    history.record([(known, 2), (unknown, 3)], 2000.0 + DAY, tracked_only=True)
+
+    assert history.tracked() == [known]
+    assert history.series(known) == [(1000.0, 1), (2000.0 + DAY, 2)]
+
+
+def test_fastest_growing_ranks_by_trend_not_spikes(history, tmp_path):
+    steady, spike, shrinking = (str(tmp_path / name) for name in ('steady', 'spike', 'shrinking'))
+    for day in range(10):
+        history.record([
+            (steady, 1000 + 100 * day),
+            # Разовый всплеск посередине и возврат к прежнему размеру
+            (spike, 5000 if day == 5 else 1000),
+            (shrinking, 5000 - 100 * day),
+        ], day * DAY)
+
+    growing = history.fastest_growing()
+
+    assert [trend.path for trend in growing][0] == steady
+    assert growing[0].rate == pytest.approx(100)
+    assert growing[0].growth == 900
+    assert shrinking not in {trend.path for trend in growing}
+    assert history.fastest_growing(roots=[str(tmp_path / 'other')]) == []
+
+
+def test_downsample_keeps_ends():
+    points = [(float(i), i) for i in range(100)]
+
+    sampled = downsample(points, 5)
+
+    assert sampled[0] == points[0] and sampled[-1] == points[-1]
+    assert len(sampled) == 5
+    assert downsample(points[:3], 5) == points[:3]
@@ -0,0 +1,230 @@
+"""
+Раскладка карты папок (treemap) по индексу размеров.
+
+Каждая папка — прямоугольник с площадью по размеру, подпапки вложены в родителя
+и разложены «квадратично» (squarified, Bruls и др.): ряды подбираются так, чтобы
+прямоугольники были как можно ближе к квадрату и легко читались.
+
+Раскладывается только видимое: уровень строится от папки, в которую приблизили
+карту, на несколько уровней вниз, а папки, которые получились бы меньше
+нескольких пикселей, отбрасываются. Поэтому время раскладки зависит от размера
+окна, а не от числа папок в индексе. Готовые уровни кешируются, и возврат
+к уже показанной папке не требует новой раскладки.
+
+Модуль не зависит от Qt: раскладку можно вызывать из любого потока.
+"""
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
+
+
+@dataclass
+class TreemapRect:
+    """Папка на карте"""
+    # Узел в индексе
+    node: int
+    x: float
+    y: float
+    width: float
+    height: float
+    # 0 — подпапки папки, в которую приближена карта
+    depth: int
+    name: str
+    size: int
+    # Номер преобладающего класса FILE_CLASSES или -1, если разбивки нет
+    file_class: int = -1
+    # Есть ли у папки подпапки, в которые можно приблизить карту
+    has_children: bool = False
+
+
+@dataclass
+class TreemapLevel:
+    """Раскладка одной папки для окна заданного размера"""
+    node: int
+    width: int
+    height: int
+    # Родители раньше потомков, поэтому при отрисовке по порядку вложенные папки оказываются сверху
+    rects: List[TreemapRect] = field(default_factory=list)
+
+    def rect_at(self, x: float, y: float, depth: Optional[int] = None) -> Optional[TreemapRect]:
+        """
+        Самая глубоко вложенная папка под точкой.
+
+        Args:
+            depth (int): Искать только среди папок этого уровня вложенности
+        """
+        found = None
+        for rect in self.rects:
+            if depth is not None and rect.depth != depth:
+                continue
+            if rect.x <= x < rect.x + rect.width and rect.y <= y < rect.y + rect.height:
+                found = rect
+        return found
+
+
+def _worst(largest: float, smallest: float, row_area: float, side: float) -> float:
+    """Наихудшее соотношение сторон в ряду, уложенном вдоль стороны side."""
+    side2 = side * side
+    row2 = row_area * row_area
+    return max(side2 * largest / row2, row2 / (side2 * smallest))
+
+
+def squarify(sizes: Sequence[float], x: float, y: float,
+             width: float, height: float) -> List[Tuple[float, float, float, float]]:
+    """
+    Раскладывает прямоугольник на части с площадями, пропорциональными sizes.
+
+    Args:
+        sizes: Положительные размеры по убыванию
+
+    Returns:
+        List[Tuple[float, float, float, float]]: (x, y, ширина, высота) для каждого размера по порядку
+    """
+    total = sum(sizes)
+    if total <= 0 or width <= 0 or height <= 0:
+        return []
+    scale = width * height / total
+    areas = [size * scale for size in sizes]
+    rects = []
+    start = 0
+    while start < len(areas):
+        side = min(width, height)
+        # Ряд растет, пока от нового прямоугольника худшее соотношение сторон не ухудшается.
+        # Площади идут по убыванию, поэтому самый большой в ряду — первый, самый маленький — последний
+        end = start + 1
+        row_area = areas[start]
+        worst = _worst(areas[start], areas[start], row_area, side)
+        while end < len(areas):
+            candidate = _worst(areas[start], areas[end], row_area + areas[end], side)
+            if candidate > worst:
+                break
+            row_area += areas[end]
+            worst = candidate
+            end += 1
+
+        # Ряд ложится вдоль короткой стороны и отрезает от оставшейся площади полосу
+        thickness = row_area / side
+        offset = 0.0
+        for area in areas[start:end]:
+            length = area / thickness
+            if width >= height:
+                rects.append((x, y + offset, thickness, length))
+            else:
+                rects.append((x + offset, y, length, thickness))
+            offset += length
+        if width >= height:
+            x += thickness
+            width -= thickness
+        else:
+            y += thickness
+            height -= thickness
+        start = end
+    return rects
+
+
+class TreemapLayout:
+    """
+    Раскладки карты по индексу (dir_index.DirIndex) с кешем готовых уровней.
+
+    Раскладку можно строить в фоновом потоке: индекс только читается,
+    а кеш защищен блокировкой.
+    """
+
+    def __init__(self, index, max_depth: int = 3, min_side: float = 4.0,
+                 padding: float = 2.0, header: float = 16.0, max_levels: int = 32):
+        """
+        Args:
+            index: Индекс размеров, которым раскладка владеет и который закрывает в close
+            max_depth (int): Сколько уровней подпапок показывать сразу
+            min_side (float): Папки с меньшей стороной в пикселях не показываются
+            padding (float): Отступ подпапок от края родителя
+            header (float): Полоса под названием папки над её подпапками
+            max_levels (int): Сколько разложенных уровней хранить в кеше
+        """
+        self.index = index
+        self.max_depth = max_depth
+        self.min_side = min_side
+        self.padding = padding
+        self.header = header
+        self.max_levels = max_levels
+        self._levels: 'OrderedDict[Tuple[int, int, int], TreemapLevel]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        self.index.close()
+
+    def path(self, node: int) -> str:
+        return self.index.path(node)
+
+    def parent(self, node: int) -> int:
+        """Родитель узла или -1 у корня индекса."""
+        return self.index.parents[node] if node > 0 else -1
+
+    def cached(self, node: int, width: int, height: int) -> Optional[TreemapLevel]:
+        """Готовая раскладка уровня или None, если её еще не строили."""
+        key = (node, width, height)
+        with self._lock:
+            level = self._levels.get(key)
+            if level is not None:
+                self._levels.move_to_end(key)
+            return level
+
+    def level(self, node: int, width: int, height: int) -> TreemapLevel:
+        """Раскладка папки node для окна width x height; берется из кеша, если уже строилась."""
+        level = self.cached(node, width, height)
+        if level is not None:
+            return level
+        level = TreemapLevel(node, width, height, self._layout(node, width, height))
+        with self._lock:
+            self._levels[(node, width, height)] = level
+            while len(self._levels) > self.max_levels:
+                self._levels.popitem(last=False)
+        return level
+
+    def _dominant_class(self, node: int) -> int:
+        class_sizes = self.index.class_sizes_of(node)
+        if not class_sizes:
+            return -1
+        return max(range(len(class_sizes)), key=class_sizes.__getitem__)
+
+    def _layout(self, root: int, width: int, height: int) -> List[TreemapRect]:
+        index = self.index
+        sizes = index.sizes
+        min_area = self.min_side * self.min_side
+        rects = []
+        # Папка, её область и глубина её подпапок
+        stack = [(root, 0.0, 0.0, float(width), float(height), 0)]
+        while stack:
+            node, x, y, w, h, depth = stack.pop()
+            total = sizes[node]
+            if total <= 0 or w < self.min_side or h < self.min_side:
+                continue
+            # Подпапки, которые получились бы меньше min_side, и файлы самой папки
+            # остаются пустым местом: площадь папки все равно делится честно
+            scale = w * h / total
+            children = [child for child in index.children(node) if sizes[child] * scale >= min_area]
+            if not children:
+                continue
+            items = [(sizes[child], child) for child in children]
+            rest = total - sum(size for size, _ in items)
+            if rest > 0:
+                items.append((rest, -1))
+            items.sort(reverse=True)
+            placed = squarify([size for size, _ in items], x, y, w, h)
+
+            layer = []
+            for (cx, cy, cw, ch), (size, child) in zip(placed, items):
+                if child < 0 or cw < self.min_side or ch < self.min_side:
+                    continue
+                has_children = index.ends[child] > child + 1
+                layer.append(TreemapRect(child, cx, cy, cw, ch, depth, index.name(child), size,
+                                         self._dominant_class(child), has_children))
+                if has_children and depth + 1 < self.max_depth:
+                    inner_w = cw - 2 * self.padding
+                    inner_h = ch - self.header - self.padding
+                    if inner_w >= self.min_side and inner_h >= self.min_side:
+                        stack.append((child, cx + self.padding, cy + self.header,
+                                      inner_w, inner_h, depth + 1))
+            rects.extend(layer)
+        return rects
@@ -0,0 +1,201 @@
+"""
+Карта папок: вложенные прямоугольники с площадью по размеру папки.
+
+Раскладка строится в фоновом потоке (treemap.TreemapLayout), поэтому окно
+не замирает и на больших индексах. Щелчок по папке приближает карту к ней,
+правый щелчок или кнопка «Вверх» — отдаляет; уже разложенные уровни
+показываются сразу из кеша.
+"""
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QToolTip
+from PyQt5.QtCore import Qt, QThread, QTimer, QRectF, QEvent, pyqtSignal
+from PyQt5.QtGui import QColor, QPainter, QPen
+
+from main import format_size
+from folder_scanner import FILE_CLASS_NAMES
+
+# Цвета классов FILE_CLASSES: видео, архивы и образы, журналы, программы, прочее
+_CLASS_COLORS = ('#8e6cc4', '#d98c3f', '#d4c04a', '#4a88c7', '#7f9c8a')
+_UNKNOWN_COLOR = '#9a9a9a'
+
+
+class TreemapWorker(QThread):
+    """Строит раскладку одного уровня в фоновом потоке"""
+    level_ready = pyqtSignal(object)  # TreemapLevel
+
+    def __init__(self, treemap, node, width, height):
+        super().__init__()
+        self.treemap = treemap
+        self.node = node
+        self.width = width
+        self.height = height
+
+    def run(self):
+        try:
+            self.level_ready.emit(self.treemap.level(self.node, self.width, self.height))
+        except Exception as e:
+            print(f"Ошибка раскладки карты папок: {e}")
+
+
+class TreemapCanvas(QWidget):
+    """Рисует готовую раскладку и сообщает о щелчках по папкам"""
+    zoom_in_requested = pyqtSignal(int)  # Узел папки
+    zoom_out_requested = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.level = None
+        self.treemap = None
+        self.setMouseTracking(True)
+        self.setMinimumSize(200, 150)
+
+    def set_level(self, treemap, level):
+        self.treemap = treemap
+        self.level = level
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor('#f4f4f4'))
+        if self.level is None:
+            painter.setPen(QColor('#666'))
+            painter.drawText(self.rect(), Qt.AlignCenter, "Карта появится после сканирования")
+            return
+        metrics = painter.fontMetrics()
+        border = QPen(QColor('#ffffff'))
+        for rect in self.level.rects:
+            color = QColor(_CLASS_COLORS[rect.file_class] if rect.file_class >= 0 else _UNKNOWN_COLOR)
+            # Вложенные папки светлее родителей, чтобы уровни различались
+            color = color.lighter(100 + 12 * rect.depth)
+            area = QRectF(rect.x, rect.y, rect.width, rect.height)
+            painter.fillRect(area, color)
+            painter.setPen(border)
+            painter.drawRect(area)
+            if rect.width > 30 and rect.height > metrics.height():
+                label = f"{rect.name} {format_size(rect.size)}"
+                text = metrics.elidedText(label, Qt.ElideRight, int(rect.width) - 6)
+                painter.setPen(QColor('#1e1e1e'))
+                painter.drawText(area.adjusted(3, 1, -3, 0), Qt.AlignLeft | Qt.AlignTop, text)
+
+    def mouseReleaseEvent(self, event):
+        if event.button() == Qt.RightButton:
+            self.zoom_out_requested.emit()
+            return
+        if event.button() != Qt.LeftButton or self.level is None:
+            return
+        # Приближаем к папке верхнего уровня под курсором: её подпапки уже видны
+        rect = self.level.rect_at(event.x(), event.y(), depth=0)
+        if rect is not None and rect.has_children:
+            self.zoom_in_requested.emit(rect.node)
+
+    def mouseMoveEvent(self, event):
+        if self.level is None:
+            return
+        rect = self.level.rect_at(event.x(), event.y())
+        if rect is None:
+            QToolTip.hideText()
+            return
+        text = f"{self.treemap.path(rect.node)}\n{format_size(rect.size)}"
+        if rect.file_class >= 0:
+            text += f"\nБольше всего: {FILE_CLASS_NAMES[rect.file_class]}"
+        QToolTip.showText(event.globalPos(), text, self)
+
+
+class TreemapView(QWidget):
+    """Карта папок с приближением по щелчку"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.treemap = None
+        self.node = 0
+        self._worker = None
+        # Уровень, который запросили, пока строился предыдущий
+        self._pending = False
+        self.init_ui()
+
+    def init_ui(self):
+        layout = QVBoxLayout(self)
+        toolbar = QHBoxLayout()
+        self.up_button = QPushButton("Вверх")
+        self.up_button.setEnabled(False)
+        self.up_button.clicked.connect(self.zoom_out)
+        toolbar.addWidget(self.up_button)
+        self.path_label = QLabel("")
+        toolbar.addWidget(self.path_label, 1)
+        layout.addLayout(toolbar)
+
+        self.canvas = TreemapCanvas()
+        self.canvas.zoom_in_requested.connect(self.zoom_to)
+        self.canvas.zoom_out_requested.connect(self.zoom_out)
+        layout.addWidget(self.canvas)
+
+        # Новая раскладка строится, когда размер окна перестал меняться
+        self._resize_timer = QTimer(self)
+        self._resize_timer.setSingleShot(True)
+        self._resize_timer.setInterval(150)
+        self._resize_timer.timeout.connect(self._request_level)
+        self.canvas.installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        if obj is self.canvas and event.type() == QEvent.Resize and self.treemap is not None:
+            self._resize_timer.start()
+        return super().eventFilter(obj, event)
+
+    def set_treemap(self, treemap, node=0):
+        """Показывает карту новой раскладки (индекс последнего сканирования) с папки node."""
+        self.clear()
+        self.treemap = treemap
+        self.zoom_to(node)
+
+    def clear(self):
+        """Убирает карту и закрывает индекс, чтобы его можно было перезаписать."""
+        if self._worker is not None:
+            self._worker.wait()
+            self._worker = None
+        self._pending = False
+        if self.treemap is not None:
+            self.treemap.close()
+            self.treemap = None
+        self.canvas.set_level(None, None)
+        self.path_label.setText("")
+        self.up_button.setEnabled(False)
+
+    def zoom_to(self, node):
+        if self.treemap is None:
+            return
+        self.node = node
+        self.path_label.setText(self.treemap.path(node))
+        self.up_button.setEnabled(self.treemap.parent(node) >= 0)
+        self._request_level()
+
+    def zoom_out(self):
+        if self.treemap is not None and self.treemap.parent(self.node) >= 0:
+            self.zoom_to(self.treemap.parent(self.node))
+
+    def _request_level(self):
+        width, height = self.canvas.width(), self.canvas.height()
+        level = self.treemap.cached(self.node, width, height)
+        if level is not None:
+            self.canvas.set_level(self.treemap, level)
+            return
+        # Раскладка в фоне занимает один поток; новый запрос ждет окончания текущего
+        if self._worker is not None:
+            self._pending = True
+            return
+        worker = TreemapWorker(self.treemap, self.node, width, height)
+        # Сигналы потока, брошенного в clear, приходят позже и не должны задеть новую карту
+        worker.level_ready.connect(lambda level: self._level_ready(worker, level))
+        worker.finished.connect(lambda: self._worker_finished(worker))
+        self._worker = worker
+        worker.start()
+
+    def _level_ready(self, worker, level):
+        if worker is self._worker and level.node == self.node:
+            self.canvas.set_level(self.treemap, level)
+
+    def _worker_finished(self, worker):
+        if worker is not self._worker:
+            return
+        self._worker = None
+        if self._pending and self.treemap is not None:
+            self._pending = False
+            self._request_level()